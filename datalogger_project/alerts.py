@@ -0,0 +1,253 @@
+import os
+import json
+import logging
+import queue
+import threading
+from datetime import datetime
+
+import requests
+
+import config_store
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ALERT_STATE_FILE = os.path.join(BASE_DIR, "run", "alerts_state.json")
+DEFAULT_ALERT_LOG = os.path.join("logs", "alerts.jsonl")
+
+LAST_SEEN_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 倉庫 (location_id) ごとの上書きがない項目はこの値を使う。None はチェックしない
+DEFAULT_RULE = {
+    "temperature_min": None,
+    "temperature_max": None,
+    "humidity_min": None,
+    "humidity_max": None,
+    "temperature_hysteresis": 0.5,
+    "humidity_hysteresis": 2.0,
+    "stale_minutes": 30,
+    "offline": True,
+}
+
+# (種別, 値のキー, しきい値のキー, 上限か, ヒステリシスのキー)
+BAND_CHECKS = (
+    ("temperature_high", "temperature", "temperature_max", True, "temperature_hysteresis"),
+    ("temperature_low", "temperature", "temperature_min", False, "temperature_hysteresis"),
+    ("humidity_high", "humidity", "humidity_max", True, "humidity_hysteresis"),
+    ("humidity_low", "humidity", "humidity_min", False, "humidity_hysteresis"),
+)
+
+QUEUE_SIZE = 1000
+
+
+def _number(value):
+    if value is None or value == "" or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def resolve_rules(rules):
+    """``{location_id: rule}`` with every rule filled in from "default" and DEFAULT_RULE."""
+    base = dict(DEFAULT_RULE, **(rules.get("default") or {}))
+    resolved = {loc_id: dict(base, **rule) for loc_id, rule in rules.items() if loc_id != "default"}
+    resolved[None] = base
+    return resolved
+
+
+class AlertEngine:
+    """Evaluate alert rules against each snapshot and keep alert state between cycles.
+
+    An alert is keyed by ``(device, kind)``. Band alerts are raised when a
+    value crosses a limit and cleared only once it is back inside the band
+    by the hysteresis margin; ``offline`` and ``stale`` follow the
+    device's online flag and ``last_seen`` age. Active alerts are saved to
+    ``state_file`` whenever they change, so a restart neither re-raises nor
+    forgets them.
+    """
+
+    def __init__(self, state_file=ALERT_STATE_FILE):
+        self.state_file = state_file
+        self.active = {}   # "device|kind" -> alert dict
+        state = config_store.load_json(state_file, {})
+        for alert in state.get("active", []):
+            self.active[f"{alert['device']}|{alert['kind']}"] = alert
+
+    def evaluate(self, devices, rules, now=None):
+        """Run every rule over ``devices`` in one pass; returns the raised and cleared events."""
+        now = now or datetime.now()
+        resolved = resolve_rules(rules)
+        events = []
+        seen = set()
+        for device in devices:
+            dev_id = str(device.get("id"))
+            loc_id = device.get("location_id") or None
+            rule = resolved.get(loc_id, resolved[None])
+            online = bool(device.get("online"))
+            firing = {}
+
+            if rule.get("offline"):
+                firing["offline"] = (not online, None, None)
+
+            stale_minutes = _number(rule.get("stale_minutes"))
+            if stale_minutes:
+                try:
+                    age = (now - datetime.strptime(device.get("last_seen") or "", LAST_SEEN_FORMAT)).total_seconds()
+                except ValueError:
+                    age = None
+                if age is not None:
+                    firing["stale"] = (age > stale_minutes * 60, round(age / 60, 1), stale_minutes)
+
+            if online:
+                for kind, value_key, limit_key, upper, hyst_key in BAND_CHECKS:
+                    limit = _number(rule.get(limit_key))
+                    value = _number(device.get(value_key))
+                    if limit is None or value is None:
+                        continue
+                    margin = _number(rule.get(hyst_key)) or 0.0
+                    key = f"{dev_id}|{kind}"
+                    if upper:
+                        on = value > limit if key not in self.active else value > limit - margin
+                    else:
+                        on = value < limit if key not in self.active else value < limit + margin
+                    firing[kind] = (on, value, limit)
+
+            for kind, (on, value, limit) in firing.items():
+                key = f"{dev_id}|{kind}"
+                seen.add(key)
+                alert = self.active.get(key)
+                if on and alert is None:
+                    alert = {"device": dev_id, "name": device.get("name"), "kind": kind,
+                             "location_id": loc_id, "warehouse": device.get("warehouse"),
+                             "value": value, "limit": limit, "since": now.isoformat(timespec="seconds")}
+                    self.active[key] = alert
+                    events.append(dict(alert, event="raised", at=alert["since"]))
+                elif on:
+                    alert["value"] = value
+                elif alert is not None:
+                    del self.active[key]
+                    events.append(dict(alert, event="cleared", value=value, at=now.isoformat(timespec="seconds")))
+
+        # ルールが外れた (しきい値削除など) 警報は解除扱いにする。一覧から消えた機器の警報は残す
+        listed = {str(d.get("id")) for d in devices}
+        for key in [k for k in self.active if k not in seen and k.split("|", 1)[0] in listed]:
+            alert = self.active.pop(key)
+            events.append(dict(alert, event="cleared", at=now.isoformat(timespec="seconds")))
+        return events
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        config_store.save_json(self.state_file, {
+            "updated": datetime.now().isoformat(timespec="seconds"),
+            "active": sorted(self.active.values(), key=lambda a: (a["since"], a["device"], a["kind"])),
+        }, indent=None)
+
+
+class FileSink:
+    """Append each event as one JSON line to ``path``."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, events):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+
+class WebhookSink:
+    """POST ``{"events": [...]}`` to ``url``."""
+
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send(self, events):
+        response = self.session.post(self.url, json={"events": events}, timeout=self.timeout)
+        response.raise_for_status()
+
+
+SINK_TYPES = {
+    "file": lambda conf: FileSink(os.path.join(BASE_DIR, conf.get("path", DEFAULT_ALERT_LOG))),
+    "webhook": lambda conf: WebhookSink(conf["url"], float(conf.get("timeout", 5))),
+}
+
+
+def make_sinks(settings):
+    sinks = []
+    for conf in settings.get("alert_sinks", [{"type": "file"}]):
+        factory = SINK_TYPES.get(conf.get("type"))
+        if factory is None:
+            logger.warning("Unknown alert sink type: %s", conf.get("type"))
+            continue
+        try:
+            sinks.append(factory(conf))
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning("Bad alert sink config %s: %s", conf, e)
+    return sinks
+
+
+class Dispatcher:
+    """Deliver events to the sinks on a background thread so a slow webhook never delays a fetch cycle."""
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, name="alert-dispatch", daemon=True)
+        self._thread.start()
+
+    def submit(self, events):
+        try:
+            self._queue.put_nowait(events)
+        except queue.Full:
+            logger.warning("Alert queue full, dropping %d events", len(events))
+
+    def _run(self):
+        while True:
+            events = self._queue.get()
+            if events is None:
+                return
+            for sink in self.sinks:
+                try:
+                    sink.send(events)
+                except Exception as e:
+                    logger.error("Alert sink %s failed: %s", type(sink).__name__, e)
+
+    def close(self, timeout=5):
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+
+_engine = None
+_dispatcher = None
+_sink_config = None
+
+
+def process(devices, settings):
+    """Evaluate ``devices`` against the configured rules and hand new events to the sinks."""
+    global _engine, _dispatcher, _sink_config
+    if _engine is None:
+        _engine = AlertEngine()
+    sink_config = json.dumps(settings.get("alert_sinks"), sort_keys=True)
+    if _dispatcher is None or sink_config != _sink_config:
+        if _dispatcher is not None:
+            _dispatcher.close()
+        _dispatcher = Dispatcher(make_sinks(settings))
+        _sink_config = sink_config
+
+    events = _engine.evaluate(devices, config_store.get_alert_rules())
+    if events:
+        _engine.save()
+        _dispatcher.submit(events)
+        raised = sum(1 for e in events if e["event"] == "raised")
+        logger.debug("Alerts: %d raised, %d cleared, %d active", raised, len(events) - raised, len(_engine.active))
+    return events
+
+
+def active_alerts():
+    """Active alerts as last saved by the worker (readable from any process)."""
+    return config_store.load_json(ALERT_STATE_FILE, {"updated": None, "active": []})
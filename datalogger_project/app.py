@@ -1,11 +1,27 @@
-from flask import Flask, render_template, jsonify, request, redirect, url_for, session, flash
+from flask import Flask, Response, g, render_template, jsonify, request, redirect, url_for, session, flash, send_file
 from functools import wraps
-import requests
 import json
 import os
-import subprocess
-import sys
-from datetime import datetime
+import hashlib
+import logging
+import math
+import time
+from datetime import datetime, timedelta, timezone
+
+import alerts
+import assignment_log
+import cadence
+import config_store
+import export
+import latest
+import logging_setup
+import metrics
+import rollup
+import supervisor
+import upstream
+from store import TimeSeriesStore, BUCKET_COLUMNS
+from live import LiveFeed, DEFAULT_MAX_CLIENTS, DEFAULT_MAX_STREAM_SECONDS
+from views import ViewCache
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'
@@ -13,19 +29,12 @@ app.secret_key = 'your_secret_key_here'
 USERNAME = 'admin'
 PASSWORD = 'ngls1234'
 
-LOGIN_URL = "http://1weilian.com/user/login"
-DATA_URL = "http://1weilian.com/public/realTimeData"
-ACCOUNT = "nglswhs47"
-PASSWORD = "ngls1234"
-
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-ASSIGNMENT_FILE = os.path.join(BASE_DIR, "device_assignments.json")
-SETTINGS_FILE = os.path.join(BASE_DIR, "settings.json")
 WAREHOUSE_FILE = os.path.join(BASE_DIR, "warehouses.json")
-LOCATION_FILE = os.path.join(BASE_DIR, "locations.json")
-ASSIGNMENT_HISTORY_FILE = os.path.join(BASE_DIR, "assignment_history.json")
 CACHE_DIR = os.path.join(BASE_DIR, "cache")
 
+logger = logging.getLogger(__name__)
+
 
 def login_required(f):
     @wraps(f)
@@ -35,102 +44,75 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def login_and_get_token():
-    payload = {
-        "account": ACCOUNT,
-        "pwd": PASSWORD,
-        "systemVersion": "PC",
-        "loginType": 2
-    }
-    headers = {"Content-Type": "application/json;charset=UTF-8"}
-    response = requests.post(LOGIN_URL, json=payload, headers=headers)
-    result = response.json()
-    return result["data"]["accessToken"], result["data"]["userId"]
-
-def fetch_all_devices(token, user_id):
-    all_devices = []
-    page = 0
-    while True:
-        payload = {
-            "userId": user_id,
-            "loginType": 2,
-            "accessToken": token,
-            "permissions": 2,
-            "language": 1,
-            "page": page,
-            "rows": 20,
-            "sortingType": 0
-        }
-        headers = {"Content-Type": "application/json;charset=UTF-8"}
-        response = requests.post(DATA_URL, json=payload, headers=headers)
-        try:
-            result = response.json()
-            if "data" not in result or "dataList" not in result["data"]:
-                print(f"[WARN] No dataList found in response: {result}")
-                break
-            data_list = result["data"]["dataList"]
-        except Exception as e:
-            print(f"[ERROR] Failed to parse device data: {e}")
-            break
-
-        if not data_list:
-            break
-
-        for dev in data_list:
-            all_devices.append({
-                "id": dev["sn"],
-                "name": dev["deviceName"],
-                "temperature": dev["temperature"] if dev["status"] == 0 else "-",
-                "humidity": dev["humidity"] if dev["status"] == 0 else "-",
-                "last_seen": dev["date"],
-                "online": dev["status"] == 0
-            })
-
-        page += 1
-    return all_devices
-
 def start_background_tasks():
+    # 同一ホストで動くのは 1 組だけ (ロックを取れなかったプロセスは何もしない)
     try:
-        subprocess.Popen([sys.executable, os.path.join(BASE_DIR, "cache_worker.py")],
-                         stdout=sys.stdout, stderr=sys.stderr)
-        subprocess.Popen([sys.executable, os.path.join(BASE_DIR, "cache_logger.py")],
-                         stdout=sys.stdout, stderr=sys.stderr)
+        logging_setup.configure(config_store.get_settings())
+        metrics.start_exporter()
+        supervisor.start_background()
     except Exception as e:
-        print(f"[ERROR] Failed to start background tasks: {e}")
+        logger.exception("Failed to start background tasks: %s", e)
 
-def load_json(filename, default):
-    if os.path.exists(filename):
-        with open(filename, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return default
+REQUEST_SECONDS = metrics.histogram("datalogger_http_request_seconds", "Flask request latency by route")
 
-def save_json(filename, data):
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _record_latency(response):
+    start = g.get("request_start")
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        REQUEST_SECONDS.observe(time.perf_counter() - start, route=route, method=request.method,
+                                status=str(response.status_code))
+    return response
+
+_store = None
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = TimeSeriesStore()
+    return _store
+
+LATEST_CACHE_FILE = latest.LATEST_FILE
+
+# (mtime_ns, size) of device_cache_latest.json -> parsed snapshot.
+# Replaced as a whole tuple so waitress threads never see a torn update.
+_latest_cache = (None, None, [])
+
+def _file_stamp(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return (0, 0)
+    return (st.st_mtime_ns, st.st_size)
 
 def load_latest_cache():
-    latest_file = os.path.join(CACHE_DIR, 'device_cache_latest.json')
-    if not os.path.exists(latest_file):
+    global _latest_cache
+    stamp = _file_stamp(LATEST_CACHE_FILE)
+    if stamp == (0, 0):
         return None, []
+    if _latest_cache[0] == stamp:
+        return _latest_cache[1], _latest_cache[2]
     try:
-        with open(latest_file, 'r', encoding='utf-8') as f:
+        with open(LATEST_CACHE_FILE, 'r', encoding='utf-8') as f:
             data = json.load(f)
-        timestamp = os.path.getmtime(latest_file)
-        dt = datetime.fromtimestamp(timestamp)
+        dt = datetime.fromtimestamp(stamp[0] / 1e9)
+        _latest_cache = (stamp, dt, data)
         return dt, data
     except Exception as e:
-        print(f"[ERROR] Failed to load latest cache: {e}")
-        return None, []
+        logger.error("Failed to load latest cache: %s", e)
+        # 書き込み途中のファイルを読んだ場合は前回の内容を返す
+        return _latest_cache[1], _latest_cache[2]
 
-def record_assignment_history(device_id, location_id):
-    history = load_json(ASSIGNMENT_HISTORY_FILE, {})
-    if device_id not in history:
-        history[device_id] = []
-    history[device_id].append({
-        "location_id": location_id,
-        "timestamp": datetime.now().isoformat()
-    })
-    save_json(ASSIGNMENT_HISTORY_FILE, history)
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    since = request.if_modified_since
+    return since is not None and last_modified is not None and \
+        last_modified.replace(microsecond=0) <= since
 
 # ログイン画面
 @app.route('/login', methods=['GET', 'POST'])
@@ -149,82 +131,346 @@ def logout():
     session.pop('logged_in', None)
     return redirect(url_for('login'))
 
-@app.route("/")
-def index():
+def data_stamp():
+    # 最新キャッシュと割当・倉庫名の stat だけで変更有無を判定する
+    return (_file_stamp(LATEST_CACHE_FILE),) + config_store.config_stamp()
+
+def _view_source():
     dt, devices = load_latest_cache()
-    assignments = load_json(ASSIGNMENT_FILE, {})
-    locations = load_json(LOCATION_FILE, {})
-    settings = load_json(SETTINGS_FILE, {})
+    return dt, devices, config_store.get_assignments(), config_store.get_locations()
+
+# スナップショットごとに一度だけ倉庫別ビューを組み立て、描画結果も使い回す
+view_cache = ViewCache(data_stamp, _view_source)
+
+def data_rows():
+    return list(view_cache.get().rows)
+
+live_feed = LiveFeed(data_stamp, data_rows)
+
+def cached_page(key, mimetype, render):
+    """Serve ``render(view)`` memoized per snapshot version and ``key``, with ETag/304 support."""
+    view, body = view_cache.render(key, render)
+    etag = hashlib.md5(f"{view.etag}:{key!r}".encode()).hexdigest()
+    newest = max((s[0] for s in view.version if s), default=0)
+    last_modified = datetime.fromtimestamp(newest / 1e9, timezone.utc) if newest else None
+    if _not_modified(etag, last_modified):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, mimetype=mimetype)
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+def _last_updated(view):
+    return view.updated.strftime("%Y-%m-%d %H:%M:%S") if view.updated else "N/A"
+
+def rolling_by_warehouse():
+    """Saved rolling aggregates keyed by warehouse name ({} until the worker has saved some)."""
+    state = rollup.load_state()
+    if state is None:
+        return {}
+    rows = rollup.location_summaries(state, config_store.get_locations(), config_store.get_alert_rules(), days=1)
+    return {row["name"]: row for row in rows}
 
-    warehouse_devices = {}
-    for device in devices:
-        device_id = str(device.get("id"))
-        loc_id = assignments.get(device_id)
+@app.route("/")
+def index():
+    interval = config_store.get_settings().get("interval", 10)
+    # 集計ファイルはスナップショットとは別に更新されるので、その更新もキーに含める
+    key = ("index", interval, config_store.file_stamp(rollup.ROLLUP_FILE))
+    return cached_page(key, "text/html", lambda view: render_template(
+        "index.html", warehouses=view.warehouses, interval=interval, rolling=rolling_by_warehouse(),
+        last_updated=_last_updated(view)).encode("utf-8"))
 
-        if not loc_id or not isinstance(loc_id, str) or loc_id.strip() == "":
-            continue
+@app.route("/data")
+def data():
+    try:
+        return cached_page("data", "application/json", lambda view: json.dumps(
+            view.rows, ensure_ascii=False).encode("utf-8"))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        warehouse = locations.get(loc_id)
-        if not warehouse or warehouse == "未割当":
-            continue  # 表示除外条件を追加
+@app.route("/warehouses")
+def warehouses():
+    return cached_page("warehouses", "application/json", lambda view: json.dumps({
+        "updated": _last_updated(view),
+        "warehouses": [{"name": name, "stats": stats} for name, _, stats in view.warehouses],
+    }, ensure_ascii=False).encode("utf-8"))
+
+# ワーカーが公開した圧縮済みファイルをそのまま返す (JSON の読み直し・再シリアライズをしない)
+@app.route("/latest.json")
+def latest_json():
+    current = latest.manifest()
+    if current is None:
+        return jsonify({"error": "no snapshot published yet"}), 404
+    encoding, path = latest.choose_variant(current, request.accept_encodings)
+    if path is None:
+        return jsonify({"error": "snapshot is being replaced, retry"}), 503
+    etag = f'{current["etag"]}-{encoding}'
+    if request.if_none_match and request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = send_file(path, mimetype="application/json", conditional=False, etag=False,
+                             last_modified=None, max_age=None)
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.cache_control.no_cache = True
+    return response
+
+# ワーカーが新しいスナップショットを書いたときだけ変更分を配信する
+@app.route("/stream")
+def stream():
+    settings = config_store.get_settings()
+    max_clients = int(settings.get("stream_max_clients", DEFAULT_MAX_CLIENTS))
+    max_seconds = int(settings.get("stream_max_seconds", DEFAULT_MAX_STREAM_SECONDS))
+    # 上限の判定と枠の確保は subscribe() のロック内で一度に行う
+    q = live_feed.subscribe(max_clients)
+    if q is None:
+        return jsonify({"error": "too many stream clients"}), 503
+    response = Response(live_feed.stream(q, max_seconds), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # 送り始める前に切断されるとジェネレーターの finally が走らないので、close 時にも枠を返す
+    response.call_on_close(lambda: live_feed.unsubscribe(q))
+    return response
+
+# 差分フィード: 前回の cursor 以降に値が変わった機器だけを返す
+@app.route("/changes")
+def changes():
+    cursor = request.args.get("cursor")
+    if cursor is not None and not cursor.isdigit():
+        return jsonify({"error": "cursor must be an integer"}), 400
+    result = get_store().changes_since(int(cursor) if cursor else None, offline_value="-")
+    response = jsonify(result)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# 履歴 API: /history/<device_id> と /history?devices=a,b
+HISTORY_RESOLUTIONS = [60, 300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 86400]
+HISTORY_TARGET_BUCKETS = 300
+HISTORY_MAX_BUCKETS = 5000
+RESOLUTION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_time_arg(value, default):
+    if not value:
+        return default
+    if value.isdigit():
+        return datetime.fromtimestamp(int(value))
+    if value[-1:] in ("Z", "z"):
+        value = value[:-1] + "+00:00"
+    moment = datetime.fromisoformat(value)
+    # ストアはサーバーのローカル時刻で扱うので、オフセット付きの指定はローカル時刻に直す
+    return moment.astimezone().replace(tzinfo=None) if moment.tzinfo is not None else moment
+
+def parse_resolution(value, span_seconds):
+    if not value:
+        # 指定がなければ約 HISTORY_TARGET_BUCKETS 個になる刻みを選ぶ
+        for resolution in HISTORY_RESOLUTIONS:
+            if span_seconds / resolution <= HISTORY_TARGET_BUCKETS:
+                return resolution
+        return HISTORY_RESOLUTIONS[-1]
+    unit = RESOLUTION_UNITS.get(value[-1:].lower())
+    return int(value[:-1]) * unit if unit else int(value)
+
+def floor_to_resolution(moment, resolution):
+    midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    elapsed = int((moment - midnight).total_seconds())
+    return midnight + timedelta(seconds=elapsed - elapsed % resolution) if resolution < 86400 else midnight
+
+def history_response(serials):
+    try:
+        end = parse_time_arg(request.args.get("end"), datetime.now())
+        start = parse_time_arg(request.args.get("start"), end - timedelta(hours=24))
+        if start >= end:
+            raise ValueError("start must be before end")
+        resolution = parse_resolution(request.args.get("resolution"), (end - start).total_seconds())
+        if resolution < 1:
+            raise ValueError("resolution must be positive")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    start = floor_to_resolution(start, resolution)
+    if (end - start).total_seconds() / resolution > HISTORY_MAX_BUCKETS:
+        return jsonify({"error": f"too many buckets; use a resolution of at least "
+                                 f"{int((end - start).total_seconds() // HISTORY_MAX_BUCKETS) + 1}s"}), 400
+
+    buckets = get_store().aggregate(serials, start, end, resolution)
+    return jsonify({
+        "start": start.strftime("%Y-%m-%d %H:%M:%S"),
+        "end": end.strftime("%Y-%m-%d %H:%M:%S"),
+        "resolution": resolution,
+        "devices": {sn: buckets.get(sn) or {key: [] for key in BUCKET_COLUMNS} for sn in serials},
+    })
 
-        warehouse_devices.setdefault(warehouse, []).append(device)
+@app.route("/health")
+def health():
+    ok, report = supervisor.health(config_store.get_settings())
+    response = jsonify(report)
+    response.status_code = 200 if ok else 503
+    response.headers["Cache-Control"] = "no-store"
+    return response
 
-    return render_template("index.html", warehouse_devices=warehouse_devices,
-                           interval=settings.get("interval", 10),
-                           last_updated=dt.strftime("%Y-%m-%d %H:%M:%S") if dt else "N/A")
+@app.route("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
 
-@app.route("/data")
-def data():
-    try:
-        token, user_id = login_and_get_token()
-        devices = fetch_all_devices(token, user_id)
-        assignments = load_json(ASSIGNMENT_FILE, {})
-        locations = load_json(LOCATION_FILE, {})  # ← 追加
+PROFILE_MIN_SECONDS = 1
 
-        for device in devices:
-            loc_id = assignments.get(device["id"], "")
-            device["location_id"] = loc_id
-            device["warehouse"] = locations.get(loc_id, "未割当") if loc_id else "未割当"  # ← 追加
+# 稼働中のプロセスで一定時間だけサンプリングプロファイラを動かす
+@app.route("/debug/profile", methods=["GET", "POST"])
+@login_required
+def debug_profile():
+    if request.method == "POST":
+        try:
+            seconds = float(request.form.get("seconds") or request.args.get("seconds") or 30)
+            if not math.isfinite(seconds):
+                raise ValueError("seconds must be a finite number")
+            pid = request.form.get("pid") or request.args.get("pid")
+            pid = int(pid) if pid else None
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        seconds = min(max(seconds, PROFILE_MIN_SECONDS), metrics.MAX_PROFILE_SECONDS)
+        if pid in (None, os.getpid()):
+            metrics.start_profiler(seconds)
+        if pid != os.getpid():
+            metrics.request_profile(seconds, pid=pid)
+    profiler = metrics.current_profiler()
+    return jsonify({
+        "pid": os.getpid(),
+        "running": bool(profiler and profiler.running),
+        "samples": profiler.samples if profiler else 0,
+        "last_profile": profiler.path if profiler else None,
+    })
 
-        return jsonify(devices)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+@app.route("/alerts")
+def active_alerts():
+    state = alerts.active_alerts()
+    active = state.get("active", [])
+    warehouse = request.args.get("warehouse")
+    if warehouse:
+        active = [a for a in active if a.get("warehouse") == warehouse]
+    response = jsonify({"updated": state.get("updated"), "count": len(active), "active": active})
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# 取得周期の自動調整の状況と、固定間隔と比べて減らせた上流リクエスト数
+@app.route("/cadence")
+def cadence_report():
+    response = jsonify(cadence.load_report() or {})
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# 日別の最小・最大・平均、24 時間の傾向、範囲外時間。ワーカーの集計を読むだけで履歴は走査しない
+@app.route("/stats")
+def rolling_stats():
+    state = rollup.load_state()
+    if state is None:
+        return jsonify({"error": "no aggregates saved yet"}), 404
+    days = max(request.args.get("days", 7, type=int), 1)
+    device_id = request.args.get("device")
+    if device_id:
+        summary = rollup.device_summary(state, device_id, days=days)
+        if summary is None:
+            return jsonify({"error": f"no readings for {device_id}"}), 404
+        response = jsonify(dict(summary, updated=state["updated"]))
+    else:
+        rows = rollup.location_summaries(state, config_store.get_locations(), config_store.get_alert_rules(),
+                                         days=days)
+        warehouse = request.args.get("warehouse")
+        if warehouse:
+            rows = [row for row in rows if row["name"] == warehouse]
+        response = jsonify({"updated": state["updated"], "since": state["since"], "warehouses": rows})
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/history/<device_id>")
+def history(device_id):
+    return history_response([device_id])
+
+@app.route("/history")
+def history_multi():
+    serials = [sn.strip() for sn in request.args.get("devices", "").split(",") if sn.strip()]
+    if not serials:
+        return jsonify({"error": "devices is required"}), 400
+    return history_response(serials)
+
+# 一括エクスポート: /export?start=&end=&devices=a,b&warehouse=倉庫&format=csv|csv.gz|columns.gz
+# all=1 はキーフレームで繰り返した変化のない行も含める (ポーリングごとの行ではない)
+def split_arg(name):
+    values = [v.strip() for v in request.args.get(name, "").split(",") if v.strip()]
+    return values or None
+
+@app.route("/export")
+def export_data():
+    fmt = request.args.get("format", "csv")
+    if fmt not in export.FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(export.FORMATS)}"}), 400
+    try:
+        end = parse_time_arg(request.args.get("end"), datetime.now())
+        start = parse_time_arg(request.args.get("start"), end - timedelta(hours=24))
+        if start >= end:
+            raise ValueError("start must be before end")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    mimetype, suffix, _, _ = export.FORMATS[fmt]
+    filename = f"export_{start:%Y%m%d%H%M}-{end:%Y%m%d%H%M}.{suffix}"
+    # Content-Length を付けないので waitress が chunked で送る。行はストアから少しずつ読む
+    body = export.stream(get_store(), start, end, fmt, serials=split_arg("devices"),
+                         warehouses=split_arg("warehouse"),
+                         changes_only=request.args.get("all") not in ("1", "true"))
+    return Response(body, mimetype=mimetype,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"',
+                             "Cache-Control": "no-store", "X-Accel-Buffering": "no"})
 
 @app.route("/save_assignment", methods=["POST"])
 def save_assignment():
     data = request.get_json()
-    save_json(ASSIGNMENT_FILE, data)
-    for dev_id, loc_id in data.items():
-        record_assignment_history(dev_id, loc_id)
+    config_store.save_assignments(data)
+    assignment_log.get_journal().record(data)
     return jsonify({"status": "ok"})
 
+@app.route("/assignment_history/<device_id>")
+def assignment_history(device_id):
+    journal = assignment_log.get_journal()
+    try:
+        at = parse_time_arg(request.args.get("at"), None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if at is not None:
+        return jsonify({"device": device_id, "at": at.isoformat(),
+                        "location_id": journal.location_at(device_id, at)})
+    return jsonify({"device": device_id, "history": journal.history(device_id)})
+
 @app.route("/settings", methods=["GET", "POST"])
 @login_required
 def settings():
-    settings = load_json(SETTINGS_FILE, {
-        "interval": 10,
-        "cache_interval": 10,
-        "cache_expire_hours": 72,
-        "log_times": ["03:00", "09:00"],
-        "log_directory": "logs"
-    })
+    settings = config_store.get_settings()
 
     if request.method == "POST":
         settings["interval"] = int(request.form.get("interval", settings["interval"]))
         settings["cache_interval"] = int(request.form.get("cache_interval", settings["cache_interval"]))
         settings["cache_expire_hours"] = int(request.form.get("cache_expire_hours", settings["cache_expire_hours"]))
         settings["log_directory"] = request.form.get("log_directory", settings["log_directory"]).strip()
-        settings["log_times"] = request.form.getlist("log_times")
-        save_json(SETTINGS_FILE, settings)
+        if request.form.get("log_format") in ("per_device", "daily"):
+            settings["log_format"] = request.form["log_format"]
+        settings["log_times"] = [t for t in request.form.getlist("log_times") if t]
+        settings["log_interval_seconds"] = int(request.form.get("log_interval_seconds") or 0)
+        settings["cadence_adaptive"] = request.form.get("cadence_adaptive") == "on"
+        settings["cadence_floor_seconds"] = int(request.form.get("cadence_floor_seconds") or 0)
+        settings["cadence_ceiling_seconds"] = int(
+            request.form.get("cadence_ceiling_seconds") or settings["cadence_ceiling_seconds"])
+        config_store.save_settings(settings)
         return redirect(url_for("index"))
 
-    return render_template("settings.html", **settings)
+    return render_template("settings.html", cadence_report=cadence.load_report(), **settings)
 
 @app.route("/locations", methods=["GET", "POST"])
 @login_required
 def edit_locations():
-    locations = load_json(LOCATION_FILE, {})
+    locations = config_store.get_locations()
     if request.method == "POST":
         new_locations = {}
         for key in request.form:
@@ -233,26 +479,25 @@ def edit_locations():
                 name = request.form[key].strip()
                 if name:
                     new_locations[loc_id] = name
-        save_json(LOCATION_FILE, new_locations)
+        config_store.save_locations(new_locations)
         return redirect(url_for("edit_locations"))
     return render_template("locations.html", locations=locations)
 
 @app.route("/warehouse_assign", methods=["GET", "POST"])
 @login_required
 def warehouse_assign():
-    token, user_id = login_and_get_token()
-    devices = fetch_all_devices(token, user_id)
-    assignments = load_json(ASSIGNMENT_FILE, {})
-    locations = load_json(LOCATION_FILE, {})
+    # 機器一覧はワーカーが更新するレジストリから読む (上流 API は待たない)
+    devices = get_store().registry()
+    assignments = config_store.get_assignments()
+    locations = config_store.get_locations()
     device_names = {d["id"]: d["name"] for d in devices}
 
     if request.method == "POST":
         assignments_json = request.form.get("assignments_json")
         if assignments_json:
             new_assignments = json.loads(assignments_json)
-            save_json(ASSIGNMENT_FILE, new_assignments)
-            for device_id, loc_id in new_assignments.items():
-                record_assignment_history(device_id, loc_id)
+            config_store.save_assignments(new_assignments)
+            assignment_log.get_journal().record(new_assignments)
         return redirect(url_for("settings"))
 
     # 表示用データの構築
@@ -279,9 +524,40 @@ def warehouse_assign():
         locations=locations,  # location_id → 倉庫名の辞書
         warehouse_to_devices=warehouse_to_devices,  # location_id → device list
         unassigned_devices=unassigned_devices,  # ← 正しい名前で渡す
-        assignments_json=json.dumps(assignments, ensure_ascii=False)
+        assignments_json=json.dumps(assignments, ensure_ascii=False),
+        devices_json=json.dumps({d["id"]: d for d in devices}, ensure_ascii=False)
     )
 
+# 機器一覧の手動更新: 各アカウントの上流をページ順に読み、レジストリに無かった機器を NDJSON で 1 行ずつ返す
+@app.route("/warehouse_assign/refresh", methods=["POST"])
+@login_required
+def refresh_devices():
+    settings = config_store.get_settings()
+    clients = upstream.get_clients(settings)
+    options = upstream.fetch_options(settings)
+    store = get_store()
+
+    def generate():
+        seen = added = 0
+        try:
+            for name, client in clients.items():
+                for page in upstream.iter_device_pages(client, rows=options["rows"], retries=options["retries"],
+                                                       backoff=options["backoff"]):
+                    seen += len(page)
+                    for device in page:
+                        device["account"] = name
+                    for device in store.register(page, datetime.now()):
+                        added += 1
+                        info = {"id": device["id"], "name": device.get("name") or "", "account": name}
+                        yield json.dumps({"device": info}, ensure_ascii=False) + "\n"
+            yield json.dumps({"done": True, "devices": seen, "added": added}) + "\n"
+        except Exception as e:
+            logger.warning("Device list refresh failed: %s", e)
+            yield json.dumps({"error": str(e), "devices": seen, "added": added}, ensure_ascii=False) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson",
+                    headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"})
+
 @app.route("/warehouse_names")
 @login_required
 def warehouse_names():
@@ -289,20 +565,11 @@ def warehouse_names():
 
 @app.route("/all_devices")
 def all_devices():
-    dt, devices = load_latest_cache()
-    assignments = load_json(ASSIGNMENT_FILE, {})
-    locations = load_json(LOCATION_FILE, {})
-
-    # assignments のキーが文字列であるため、idを文字列化して参照
-    for dev in devices:
-        dev_id = str(dev.get("id"))
-        loc_id = assignments.get(dev_id)
-        dev["location_id"] = loc_id
-        dev["location_name"] = locations.get(loc_id, "未割当") if loc_id else "未割当"
-
-    return render_template("all_devices.html", devices=devices,
-                           last_updated=dt.strftime("%Y-%m-%d %H:%M:%S") if dt else "N/A")
+    return cached_page("all_devices", "text/html", lambda view: render_template(
+        "all_devices.html", devices=view.rows, last_updated=_last_updated(view)).encode("utf-8"))
 
 if __name__ == "__main__":
-    start_background_tasks()
+    # デバッグ用リローダーでは親プロセスではなく、実際に app を動かす子プロセスでだけ起動する
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_tasks()
     app.run(debug=True)
@@ -0,0 +1,277 @@
+import os
+import json
+import sys
+import logging
+import threading
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+JOURNAL_FILE = os.path.join(BASE_DIR, "assignment_history.jsonl")
+LEGACY_HISTORY_FILE = os.path.join(BASE_DIR, "assignment_history.json")
+
+# この行数だけ追記されたら record() のついでに圧縮する
+COMPACT_EVERY_LINES = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_ts(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+class AssignmentJournal:
+    """Append-only JSON Lines log of device → location changes.
+
+    Each line is ``{"ts": iso, "device": id, "location_id": loc}``, where a
+    null location means the device was unassigned. ``record()`` only appends
+    devices whose location actually changed, in one O_APPEND write per save.
+
+    Readers keep a per-device bisect index of change times and pick up new
+    lines incrementally from the last offset they read; a changed inode or a
+    shorter file (after ``compact()``) triggers a full reload.
+
+    The web app is the only writer; other processes only read.
+    """
+
+    def __init__(self, path=JOURNAL_FILE, legacy_path=LEGACY_HISTORY_FILE):
+        self.path = path
+        self.legacy_path = legacy_path
+        self._lock = threading.Lock()
+        self._ino = None
+        self._offset = 0
+        self._lines = 0
+        self._appended = 0
+        self._times = {}      # device -> [datetime, ...] (sorted)
+        self._locations = {}  # device -> [location_id, ...]
+
+    # ---- 読み込み ----
+
+    def _reset(self):
+        self._ino = None
+        self._offset = 0
+        self._lines = 0
+        self._times = {}
+        self._locations = {}
+
+    def _apply(self, entry):
+        device = entry.get("device")
+        if not device:
+            return
+        ts = _parse_ts(entry.get("ts"))
+        times = self._times.setdefault(device, [])
+        locations = self._locations.setdefault(device, [])
+        if times and ts < times[-1]:
+            # 時刻が逆行した行 (手編集など) は正しい位置に差し込む
+            i = bisect_right(times, ts)
+            times.insert(i, ts)
+            locations.insert(i, entry.get("location_id"))
+        else:
+            times.append(ts)
+            locations.append(entry.get("location_id"))
+
+    def _refresh(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            if self._ino is not None:
+                self._reset()
+            return
+        if st.st_ino != self._ino or st.st_size < self._offset:
+            self._reset()
+            self._ino = st.st_ino
+        if st.st_size == self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(st.st_size - self._offset)
+        # 書き込み途中の最終行は次回に回す
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                self._apply(json.loads(line))
+            except (ValueError, TypeError) as e:
+                logger.warning("Skipping bad assignment history line: %s", e)
+            self._lines += 1
+        self._offset += end
+
+    def refresh(self):
+        with self._lock:
+            self._refresh()
+
+    def current(self):
+        """Latest known location of every device (unassigned devices are omitted)."""
+        with self._lock:
+            self._refresh()
+            return {dev: locs[-1] for dev, locs in self._locations.items() if locs[-1]}
+
+    def location_at(self, device_id, ts, default=None):
+        """Location of ``device_id`` at ``ts``, or ``default`` if no change is recorded before it."""
+        with self._lock:
+            self._refresh()
+            times = self._times.get(device_id)
+            if not times:
+                return default
+            i = bisect_right(times, ts)
+            if i == 0:
+                return default
+            return self._locations[device_id][i - 1] or ""
+
+    def locations_at(self, ts, default=None):
+        """``{device_id: location_id}`` for every device with a recorded change before ``ts``."""
+        with self._lock:
+            self._refresh()
+            result = {}
+            for device, times in self._times.items():
+                i = bisect_right(times, ts)
+                if i:
+                    result[device] = self._locations[device][i - 1] or ""
+                elif default is not None:
+                    result[device] = default
+            return result
+
+    def timeline(self, device_id):
+        """``(times, location_ids)`` copies for callers that look up many timestamps of one device."""
+        with self._lock:
+            self._refresh()
+            return list(self._times.get(device_id, [])), list(self._locations.get(device_id, []))
+
+    def history(self, device_id):
+        with self._lock:
+            self._refresh()
+            return [{"timestamp": ts.isoformat(), "location_id": loc}
+                    for ts, loc in zip(self._times.get(device_id, []), self._locations.get(device_id, []))]
+
+    # ---- 書き込み ----
+
+    def _append(self, entries):
+        if not entries:
+            return
+        data = "".join(json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n" for e in entries)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            view = memoryview(data.encode("utf-8"))
+            while view:
+                view = view[os.write(fd, view):]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def record(self, assignments, timestamp=None):
+        """Append an entry for every device whose location differs from the journal.
+
+        ``assignments`` is the full device → location map that was just
+        saved; devices that dropped out of it are recorded as unassigned.
+        Returns the number of changes written.
+        """
+        ts = (timestamp or datetime.now()).isoformat()
+        with self._lock:
+            self._refresh()
+            current = {dev: locs[-1] for dev, locs in self._locations.items()}
+            entries = []
+            for device, location_id in assignments.items():
+                if current.get(device) != (location_id or None):
+                    entries.append({"ts": ts, "device": device, "location_id": location_id or None})
+            for device, location_id in current.items():
+                if location_id and device not in assignments:
+                    entries.append({"ts": ts, "device": device, "location_id": None})
+            self._append(entries)
+            self._appended += len(entries)
+            self._refresh()
+            compact = self._appended >= COMPACT_EVERY_LINES
+        if compact:
+            self.compact()
+        return len(entries)
+
+    def compact(self, retention_days=None):
+        """Rewrite the journal without repeated entries.
+
+        With ``retention_days``, changes older than that are dropped except
+        the last one per device before the cutoff, so ``location_at()``
+        still answers for any time inside the retention window.
+        Returns ``(lines_before, lines_after)``.
+        """
+        cutoff = datetime.now() - timedelta(days=retention_days) if retention_days else None
+        with self._lock:
+            self._refresh()
+            before = self._lines
+            entries = []
+            for device, times in self._times.items():
+                kept = []
+                for ts, loc in zip(times, self._locations[device]):
+                    if kept and kept[-1][1] == loc:
+                        continue
+                    if cutoff is not None and kept and ts <= cutoff:
+                        kept[-1] = (ts, loc)
+                        continue
+                    kept.append((ts, loc))
+                entries.extend((ts, device, loc) for ts, loc in kept)
+            entries.sort(key=lambda e: e[0])
+
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for ts, device, loc in entries:
+                    f.write(json.dumps({"ts": ts.isoformat(), "device": device, "location_id": loc},
+                                       ensure_ascii=False, separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._reset()
+            self._appended = 0
+            self._refresh()
+            logger.info("Compacted assignment history: %d -> %d lines", before, self._lines)
+            return before, self._lines
+
+    def migrate_legacy(self):
+        """Import ``assignment_history.json`` once, keeping only real changes.
+
+        Does nothing when the journal already exists or there is no legacy file.
+        """
+        with self._lock:
+            if os.path.exists(self.path) or not os.path.exists(self.legacy_path):
+                return 0
+            try:
+                with open(self.legacy_path, "r", encoding="utf-8") as f:
+                    legacy = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error("Failed to load %s: %s", self.legacy_path, e)
+                return 0
+            entries = []
+            for device, items in legacy.items():
+                previous = None
+                for item in sorted(items, key=lambda i: i.get("timestamp", "")):
+                    loc = item.get("location_id") or None
+                    if not item.get("timestamp") or loc == previous:
+                        continue
+                    entries.append({"ts": item["timestamp"], "device": device, "location_id": loc})
+                    previous = loc
+            entries.sort(key=lambda e: e["ts"])
+            self._append(entries)
+        logger.info("Migrated %d assignment changes from %s", len(entries), self.legacy_path)
+        return len(entries)
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    """Process-wide journal, migrated from the legacy JSON history on first use."""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = AssignmentJournal()
+            _journal.migrate_legacy()
+        return _journal
+
+
+if __name__ == "__main__":
+    # python assignment_log.py compact [retention_days]
+    if len(sys.argv) >= 2 and sys.argv[1] == "compact":
+        logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+        days = float(sys.argv[2]) if len(sys.argv) > 2 else None
+        get_journal().compact(days)
+    else:
+        print("usage: python assignment_log.py compact [retention_days]")
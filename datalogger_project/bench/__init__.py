@@ -0,0 +1,5 @@
+# Benchmarks for the datalogger pipelines. Run from datalogger_project, e.g.
+#   python -m bench.bench_fetch
+# or every suite at once, with machine-readable results to compare between releases:
+#   python -m bench -o before.json   ...   python -m bench -o after.json
+#   python -m bench.compare before.json after.json
@@ -0,0 +1,151 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from bench import (bench_cleanup, bench_faults, bench_fetch, bench_history, bench_log, bench_nearest,
+                   bench_routes)
+from bench.compare import direction
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FORMAT_VERSION = 1
+
+
+def _fetch(full):
+    return bench_fetch.run([100, 500, 1000] if full else [100, 500], 0.02, 20, [1, 4, 8] if full else [1, 4],
+                           3, True)
+
+
+def _faults(full):
+    names = ("clean", "errors", "errors_garbage", "hang") if full else ("clean", "errors")
+    return [bench_faults.run_scenario(name, bench_faults.SCENARIOS[name], 200, 10 if full else 5, 20, 4,
+                                      2, 0.05, 1.0, 1) for name in names]
+
+
+def _nearest(full):
+    return [bench_nearest.run(snapshots, 22, 20, 200, legacy=False)
+            for snapshots in ([1000, 10000, 50000] if full else [1000, 10000])]
+
+
+def _history(full):
+    return bench_history.run(50, 7 if full else 2, 60, [300, 3600, 86400], 3)
+
+
+def _cleanup(full):
+    return [bench_cleanup.run(50, 10 if full else 4, 300, legacy, 20) for legacy in (0, 2000)]
+
+
+def _log(full):
+    rows = []
+    for devices in ([100, 1000] if full else [100]):
+        rows.extend(bench_log.run(devices, 50 if full else 20, 600, ("per_device", "daily"), ("never", "batch")))
+    return rows
+
+
+def _routes(full):
+    rows = []
+    for devices in ([100, 1000] if full else [100]):
+        for concurrency in (1, 8):
+            rows.extend(bench_routes.run(devices, bench_routes.ROUTES, 1000 if full else 300, concurrency))
+        rows.extend(bench_routes.run(devices, bench_routes.ROUTES, 1000 if full else 300, 8,
+                                     conditional=True, churn=1.0))
+    return rows
+
+
+# name -> (runner, fields that identify a row; every other field is a measurement)
+SUITES = {
+    "fetch": (_fetch, ("devices", "rows", "workers", "latency", "report_total")),
+    "faults": (_faults, ("scenario", "devices", "cycles")),
+    "nearest": (_nearest, ("snapshots", "devices")),
+    "history": (_history, ("devices", "days", "interval", "resolution")),
+    "cleanup": (_cleanup, ("devices", "days", "interval", "legacy_files")),
+    "log": (_log, ("devices", "slots", "log_format", "fsync")),
+    "routes": (_routes, ("route", "devices", "concurrency", "conditional", "churn")),
+}
+
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], cwd=BASE_DIR, capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment(profile):
+    return {
+        "format": FORMAT_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "profile": profile,
+        "commit": _git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def _best(old, new):
+    """Merge two measurements of the same row, keeping the better value of each directional metric."""
+    merged = dict(new)
+    for metric, value in old.items():
+        sign = direction(metric)
+        if sign and isinstance(value, (int, float)) and isinstance(new.get(metric), (int, float)):
+            merged[metric] = max(value, new[metric]) if sign > 0 else min(value, new[metric])
+    return merged
+
+
+def run(names, full, repeat=1):
+    """Run the named suites; returns ``[{"bench", "key", "metrics"}]`` plus the seconds each suite took.
+
+    With ``repeat`` > 1 every suite runs that many times and each metric
+    keeps its best value, which filters out most scheduler noise.
+    """
+    results, durations = [], {}
+    for name in names:
+        runner, key_fields = SUITES[name]
+        start = time.perf_counter()
+        rows = {}
+        for attempt in range(repeat):
+            print(f"[bench] {name} ({attempt + 1}/{repeat}) ...", file=sys.stderr, flush=True)
+            for row in runner(full):
+                key = {field: row[field] for field in key_fields if field in row}
+                metrics = {field: value for field, value in row.items() if field not in key_fields}
+                ident = json.dumps(key, sort_keys=True)
+                previous = rows.get(ident)
+                rows[ident] = (key, _best(previous[1], metrics) if previous else metrics)
+        results.extend({"bench": name, "key": key, "metrics": metrics} for key, metrics in rows.values())
+        durations[name] = round(time.perf_counter() - start, 1)
+    return results, durations
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench",
+                                     description="Run the benchmark suites and write machine-readable results")
+    parser.add_argument("--only", nargs="+", choices=list(SUITES), default=list(SUITES))
+    parser.add_argument("--full", action="store_true", help="larger fleets and more repetitions")
+    parser.add_argument("--repeat", type=int, default=1, help="run each suite N times and keep the best values")
+    parser.add_argument("--output", "-o", help="write results here (default: stdout)")
+    args = parser.parse_args()
+
+    # 計測中のログイン等の INFO ログで出力が埋もれないようにする
+    logging.basicConfig(level=logging.ERROR, format="[%(levelname)s] %(name)s: %(message)s")
+    results, durations = run(args.only, args.full, max(args.repeat, 1))
+    document = {"environment": dict(environment("full" if args.full else "quick"), repeat=args.repeat),
+                "durations": durations, "results": results}
+    text = json.dumps(document, indent=1, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"[bench] {len(results)} results written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
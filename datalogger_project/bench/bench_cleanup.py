@@ -0,0 +1,71 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+from bench.corpus import CORPUS_START, snapshot_times, write_legacy_cache, write_store
+from cache_worker import cleanup_cache
+from store import TimeSeriesStore
+
+
+def _hours_since(ts):
+    return (datetime.now() - ts).total_seconds() / 3600
+
+
+def run(devices, days, interval, legacy, repeat):
+    """Time cleanup_cache when nothing is due (every cycle) and when half the corpus expires."""
+    workdir = tempfile.mkdtemp(prefix="bench_cleanup_")
+    try:
+        times = snapshot_times(CORPUS_START, int(days * 86400 / interval), interval)
+        legacy_times = times[::max(len(times) // legacy, 1)][:legacy] if legacy else []
+        store_dir, cache_dir = os.path.join(workdir, "store"), os.path.join(workdir, "cache")
+        populate = write_store(store_dir, devices, times)
+        write_legacy_cache(cache_dir, 1, legacy_times)
+
+        store = TimeSeriesStore(store_dir)
+        keep_all = _hours_since(CORPUS_START) + 48
+        timings = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            removed = cleanup_cache(store, keep_all, cache_dir)
+            timings.append(time.perf_counter() - t0)
+            assert removed == 0, removed
+
+        middle = times[len(times) // 2]
+        t0 = time.perf_counter()
+        removed = cleanup_cache(store, _hours_since(middle), cache_dir)
+        expire = time.perf_counter() - t0
+        store.close()
+        return {
+            "devices": devices,
+            "days": days,
+            "interval": interval,
+            "legacy_files": len(legacy_times),
+            "populate_seconds": populate,
+            "steady_seconds_min": min(timings),
+            "steady_seconds_mean": sum(timings) / len(timings),
+            "expire_seconds": expire,
+            "removed": removed,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cache_worker.cleanup_cache")
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--days", type=float, default=10)
+    parser.add_argument("--interval", type=int, default=300)
+    parser.add_argument("--legacy", type=int, nargs="+", default=[0, 2000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    for legacy in args.legacy:
+        print(json.dumps(run(args.devices, args.days, args.interval, legacy, args.repeat)))
+
+
+if __name__ == "__main__":
+    main()
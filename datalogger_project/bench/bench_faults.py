@@ -0,0 +1,83 @@
+import argparse
+import json
+import time
+
+import upstream
+from cache_worker import merge_previous
+from bench.stub_server import StubServer, StubState
+
+SCENARIOS = {
+    "clean": {},
+    "errors": {"error_rate": 0.1},
+    "errors_garbage": {"error_rate": 0.2, "garbage_rate": 0.1},
+    "hang": {"hang_rate": 0.05, "hang_seconds": 3.0},
+    "no_total_errors": {"error_rate": 0.1, "report_total": False},
+    "down": {"down": True},
+}
+
+
+def run_scenario(name, faults, devices, cycles, rows, workers, retries, backoff, read_timeout, seed):
+    """Run ``cycles`` fetch cycles the way cache_worker does and summarize what came out."""
+    faults = dict(faults)
+    report_total = faults.pop("report_total", True)
+    state = StubState(devices, latency=0.01, report_total=report_total, seed=seed, **faults)
+    breaker = upstream.CircuitBreaker(failures=2, reset_seconds=1)
+    previous = []
+    summary = {"scenario": name, "devices": devices, "cycles": cycles, "complete": 0, "incomplete": 0,
+               "failed": 0, "skipped_by_breaker": 0, "stale_merged": 0, "devices_min": None,
+               "cycle_seconds_max": 0.0}
+    with StubServer(state) as server:
+        client = upstream.UpstreamClient(pool_size=max(workers, 1), read_timeout=read_timeout,
+                                         login_url=server.login_url, data_url=server.data_url)
+        for _ in range(cycles):
+            if not breaker.allow():
+                summary["skipped_by_breaker"] += 1
+                time.sleep(0.2)
+                continue
+            start = time.perf_counter()
+            try:
+                result = upstream.fetch_snapshot(client, rows=rows, workers=workers,
+                                                 retries=retries, backoff=backoff)
+            except Exception:
+                breaker.record_failure()
+                summary["failed"] += 1
+                continue
+            finally:
+                summary["cycle_seconds_max"] = max(summary["cycle_seconds_max"], time.perf_counter() - start)
+            breaker.record_success()
+            current = result.devices
+            if result.complete:
+                summary["complete"] += 1
+            else:
+                summary["incomplete"] += 1
+                current, merged = merge_previous(current, previous)
+                summary["stale_merged"] += merged
+            count = len(current)
+            summary["devices_min"] = count if summary["devices_min"] is None else min(summary["devices_min"], count)
+            previous = current
+        client.close()
+    summary["faults_injected"] = state.faults
+    summary["data_requests"] = state.data_requests
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the fetch pipeline against a fault-injecting stub API")
+    parser.add_argument("--scenario", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--cycles", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--retries", type=int, default=upstream.DEFAULT_FETCH_RETRIES)
+    parser.add_argument("--backoff", type=float, default=0.05)
+    parser.add_argument("--read-timeout", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    for name in args.scenario:
+        print(json.dumps(run_scenario(name, SCENARIOS[name], args.devices, args.cycles, args.rows,
+                                      args.workers, args.retries, args.backoff, args.read_timeout, args.seed)))
+
+
+if __name__ == "__main__":
+    main()
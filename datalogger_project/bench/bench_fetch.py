@@ -0,0 +1,54 @@
+import argparse
+import json
+import time
+
+import upstream
+from bench.stub_server import StubServer, StubState
+
+
+def run(fleet_sizes, latency, rows, workers_list, repeat, report_total):
+    results = []
+    for devices in fleet_sizes:
+        state = StubState(devices, latency, report_total)
+        with StubServer(state) as server:
+            for workers in workers_list:
+                client = upstream.UpstreamClient(pool_size=max(workers, 1),
+                                                 login_url=server.login_url, data_url=server.data_url)
+                client.get_token()
+                timings = []
+                for _ in range(repeat):
+                    before = state.data_requests
+                    start = time.perf_counter()
+                    fetched = upstream.fetch_all_devices(client, rows=rows, workers=workers)
+                    timings.append(time.perf_counter() - start)
+                    assert len(fetched) == devices, (len(fetched), devices)
+                client.close()
+                results.append({
+                    "devices": devices,
+                    "rows": rows,
+                    "workers": workers,
+                    "latency": latency,
+                    "report_total": report_total,
+                    "requests_per_cycle": (state.data_requests - before),
+                    "cycle_seconds_min": min(timings),
+                    "cycle_seconds_mean": sum(timings) / len(timings),
+                })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure fetch_all_devices cycle time against the stub API")
+    parser.add_argument("--devices", type=int, nargs="+", default=[20, 100, 500, 1000])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--rows", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-total", action="store_true")
+    args = parser.parse_args()
+
+    for row in run(args.devices, args.latency, args.rows, args.workers, args.repeat, not args.no_total):
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from bench.corpus import synthetic_devices
+from store import TimeSeriesStore
+
+
+def run(devices, days, interval, resolutions, repeat):
+    workdir = tempfile.mkdtemp(prefix="bench_history_")
+    try:
+        store = TimeSeriesStore(os.path.join(workdir, "store"))
+        start = datetime(2025, 1, 6)
+        cycles = int(days * 86400 / interval)
+        t0 = time.perf_counter()
+        for i in range(cycles):
+            ts = start + timedelta(seconds=i * interval)
+            store.append(ts, synthetic_devices(devices, ts))
+        populate = time.perf_counter() - t0
+
+        serials = [f"SYN{i:08X}" for i in range(devices)]
+        end = start + timedelta(days=days)
+        results = []
+        for resolution in resolutions:
+            timings = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                buckets = store.aggregate(serials, start, end, resolution)
+                timings.append(time.perf_counter() - t0)
+            results.append({
+                "devices": devices,
+                "days": days,
+                "interval": interval,
+                "readings": cycles * devices,
+                "populate_seconds": populate,
+                "resolution": resolution,
+                "buckets": sum(len(v["t"]) for v in buckets.values()),
+                "query_seconds_min": min(timings),
+                "query_seconds_mean": sum(timings) / len(timings),
+            })
+        store.close()
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark TimeSeriesStore.aggregate (the /history query)")
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--interval", type=int, default=60)
+    parser.add_argument("--resolution", type=int, nargs="+", default=[20, 300, 3600, 86400])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for row in run(args.devices, args.days, args.interval, args.resolution, args.repeat):
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import cache_logger
+from bench.corpus import CORPUS_START, snapshot_times, write_store
+from log_writer import LOG_FORMATS, FSYNC_POLICIES
+from store import TimeSeriesStore
+
+
+def run(devices, slots, interval, formats, fsync_policies):
+    """Time cache_logger.log_data for ``slots`` consecutive snapshots per log format and fsync policy."""
+    workdir = tempfile.mkdtemp(prefix="bench_log_")
+    try:
+        times = snapshot_times(CORPUS_START, slots, interval)
+        populate = write_store(os.path.join(workdir, "store"), devices, times)
+        # cache_logger はプロセス共通のストアとライターを使う
+        cache_logger._store = TimeSeriesStore(os.path.join(workdir, "store"))
+        results = []
+        for log_format in formats:
+            for fsync in fsync_policies:
+                log_dir = os.path.join(workdir, f"logs_{log_format}_{fsync}")
+                settings = {"log_directory": log_dir, "log_format": log_format, "log_fsync": fsync}
+                timings = []
+                for ts in times:
+                    t0 = time.perf_counter()
+                    logged = cache_logger.log_data(settings, ts)
+                    timings.append(time.perf_counter() - t0)
+                    assert logged == ts, (logged, ts)
+                cache_logger._writer.close()
+                cache_logger._writer = cache_logger._writer_config = None
+                timings.sort()
+                results.append({
+                    "devices": devices,
+                    "slots": slots,
+                    "log_format": log_format,
+                    "fsync": fsync,
+                    "populate_seconds": populate,
+                    "log_seconds_median": timings[len(timings) // 2],
+                    "log_seconds_mean": sum(timings) / len(timings),
+                    "log_seconds_max": timings[-1],
+                    "bytes": sum(os.path.getsize(os.path.join(log_dir, f)) for f in os.listdir(log_dir)),
+                })
+        cache_logger._store.close()
+        cache_logger._store = None
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cache_logger.log_data (snapshot to CSV logs)")
+    parser.add_argument("--devices", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--slots", type=int, default=50)
+    parser.add_argument("--interval", type=int, default=600)
+    parser.add_argument("--format", nargs="+", default=list(LOG_FORMATS), choices=LOG_FORMATS)
+    parser.add_argument("--fsync", nargs="+", default=list(FSYNC_POLICIES), choices=FSYNC_POLICIES)
+    args = parser.parse_args()
+
+    for devices in args.devices:
+        for row in run(devices, args.slots, args.interval, args.format, args.fsync):
+            print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import cache_logger
+from bench.corpus import synthetic_devices, write_legacy_cache
+from store import TimeSeriesStore
+
+
+def legacy_load_nearest(cache_dir, log_time):
+    # cache_logger.load_nearest_cache() before the time-series store
+    nearest_ts, nearest_data, min_diff = None, [], timedelta.max
+    for fname in sorted(os.listdir(cache_dir), reverse=True):
+        if not fname.endswith(".json"):
+            continue
+        try:
+            ts = datetime.strptime(fname.replace("device_cache_", "").replace(".json", ""), '%Y%m%d%H%M%S')
+        except ValueError:
+            continue
+        diff = abs(log_time - ts)
+        if diff < min_diff:
+            with open(os.path.join(cache_dir, fname), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            nearest_ts, nearest_data, min_diff = ts, data, diff
+    return nearest_ts, nearest_data
+
+
+def run(snapshots, devices, interval, lookups, legacy, seed=1):
+    workdir = tempfile.mkdtemp(prefix="bench_nearest_")
+    try:
+        start = datetime(2025, 1, 1)
+        times = [start + timedelta(seconds=interval * i) for i in range(snapshots)]
+        writer = TimeSeriesStore(os.path.join(workdir, "store"))
+        t0 = time.perf_counter()
+        for ts in times:
+            writer.append(ts, synthetic_devices(devices, ts))
+        populate = time.perf_counter() - t0
+        writer.close()
+
+        rng = random.Random(seed)
+        targets = [start + timedelta(seconds=rng.uniform(0, interval * snapshots)) for _ in range(lookups)]
+
+        # 別プロセスの cache_logger と同じく新規インスタンスから読む
+        t0 = time.perf_counter()
+        reader = TimeSeriesStore(os.path.join(workdir, "store"))
+        reader.refresh_index()
+        cold = time.perf_counter() - t0
+
+        # cache_logger.load_nearest_cache() はプロセス共通のストアを使う
+        cache_logger._store = reader
+        t0 = time.perf_counter()
+        for target in targets:
+            ts, rows = cache_logger.load_nearest_cache(target)
+            assert len(rows) == devices
+        indexed = (time.perf_counter() - t0) / lookups
+        cache_logger._store = None
+        reader.close()
+
+        result = {
+            "snapshots": snapshots,
+            "devices": devices,
+            "populate_seconds": populate,
+            "index_build_seconds": cold,
+            "nearest_seconds": indexed,
+        }
+
+        if legacy:
+            cache_dir = os.path.join(workdir, "cache")
+            write_legacy_cache(cache_dir, devices, times)
+            legacy_lookups = targets[:max(1, min(lookups, 5))]
+            t0 = time.perf_counter()
+            for target in legacy_lookups:
+                legacy_load_nearest(cache_dir, target)
+            result["legacy_nearest_seconds"] = (time.perf_counter() - t0) / len(legacy_lookups)
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark nearest-snapshot lookup")
+    parser.add_argument("--snapshots", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--devices", type=int, default=22)
+    parser.add_argument("--interval", type=int, default=20)
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--legacy", action="store_true", help="also time the old directory scan")
+    args = parser.parse_args()
+
+    for snapshots in args.snapshots:
+        print(json.dumps(run(snapshots, args.devices, args.interval, args.lookups, args.legacy)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+
+from bench.corpus import CORPUS_START, generate, write_latest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTES = ("/", "/data", "/all_devices")
+
+# 作業コピーに持ち込まないもの (実データと実行時ファイル)
+COPY_IGNORE = shutil.ignore_patterns("cache", "store", "logs", "run", "myvenv", "__pycache__",
+                                     "*.json", "*.jsonl", "*.txt", "*.log*")
+
+
+def serve(port):
+    """Serve the app (without background tasks) on waitress with run_server.py's thread count."""
+    from waitress import serve as waitress_serve
+
+    import config_store
+    import run_server
+    from app import app
+
+    waitress_serve(app, host="127.0.0.1", port=port, threads=run_server.server_threads(config_store.get_settings()),
+                   _quiet=True)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_server(app_dir, port, timeout=30):
+    process = subprocess.Popen([sys.executable, "-m", "bench.bench_routes", "--serve", str(port)], cwd=app_dir,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/data", timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("server did not start")
+
+
+def _percentile(values, q):
+    return values[min(int(len(values) * q), len(values) - 1)] if values else None
+
+
+def load(url, total, concurrency, conditional=False):
+    """GET ``url`` ``total`` times from ``concurrency`` keep-alive clients; returns latency statistics."""
+    session = requests.Session()
+    etag = session.get(url).headers.get("ETag") if conditional else None
+    per_client = [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+
+    def client(count):
+        s = requests.Session()
+        headers = {"If-None-Match": etag} if etag else {}
+        latencies, errors, size = [], 0, 0
+        for _ in range(count):
+            t0 = time.perf_counter()
+            try:
+                response = s.get(url, headers=headers, timeout=30)
+                if response.status_code not in (200, 304):
+                    errors += 1
+                size += len(response.content)
+            except requests.RequestException:
+                errors += 1
+            latencies.append(time.perf_counter() - t0)
+        s.close()
+        return latencies, errors, size
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        parts = list(pool.map(client, per_client))
+    wall = time.perf_counter() - start
+    latencies = sorted(t for part, _, _ in parts for t in part)
+    sent = len(latencies)
+    return {
+        "sent": sent,
+        "errors": sum(e for _, e, _ in parts),
+        "requests_per_second": sent / wall if wall else None,
+        "latency_seconds_mean": sum(latencies) / sent if sent else None,
+        "latency_seconds_p50": _percentile(latencies, 0.50),
+        "latency_seconds_p95": _percentile(latencies, 0.95),
+        "latency_seconds_p99": _percentile(latencies, 0.99),
+        "bytes_per_request": sum(s for _, _, s in parts) / sent if sent else None,
+    }
+
+
+def _churn(cache_dir, devices, every, stop):
+    """Publish a new latest snapshot every ``every`` seconds, as cache_worker would."""
+    ts = CORPUS_START + timedelta(days=1)
+    while not stop.wait(every):
+        ts += timedelta(seconds=every)
+        write_latest(cache_dir, devices, ts)
+
+
+def run(devices, routes, total, concurrency, conditional=False, churn=0.0):
+    workdir = tempfile.mkdtemp(prefix="bench_routes_")
+    app_dir = os.path.join(workdir, "app")
+    process = None
+    stop = threading.Event()
+    try:
+        shutil.copytree(BASE_DIR, app_dir, ignore=COPY_IGNORE)
+        generate(app_dir, devices, days=0.05, interval=60)
+        port = _free_port()
+        process = _start_server(app_dir, port)
+        if churn:
+            threading.Thread(target=_churn, args=(os.path.join(app_dir, "cache"), devices, churn, stop),
+                             daemon=True).start()
+        results = []
+        for route in routes:
+            url = f"http://127.0.0.1:{port}{route}"
+            load(url, min(total, 20), min(concurrency, 4))   # 描画キャッシュと接続を温める
+            row = {"route": route, "devices": devices, "concurrency": concurrency,
+                   "conditional": conditional, "churn": churn}
+            row.update(load(url, total, concurrency, conditional))
+            results.append(row)
+        return results
+    finally:
+        stop.set()
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the dashboard routes under waitress")
+    parser.add_argument("--devices", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--route", nargs="+", default=list(ROUTES))
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--conditional", action="store_true", help="send If-None-Match (the polling client case)")
+    parser.add_argument("--churn", type=float, default=0.0, help="publish a new snapshot every N seconds")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+    for devices in args.devices:
+        for concurrency in args.concurrency:
+            for row in run(devices, args.route, args.requests, concurrency, args.conditional, args.churn):
+                print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import json
+import sys
+
+DEFAULT_THRESHOLD = 0.20
+DEFAULT_MIN_SECONDS = 0.0005   # これより短い時間の差は測定誤差として扱う
+
+
+def direction(metric):
+    """+1 when a higher value is better, -1 when lower is better, 0 for informational fields."""
+    if metric.endswith("_per_second"):
+        return 1
+    if "seconds" in metric or "bytes" in metric or "requests" in metric or metric == "errors":
+        return -1
+    return 0
+
+
+def _index(document):
+    return {(row["bench"], json.dumps(row["key"], sort_keys=True)): row["metrics"] for row in document["results"]}
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD, min_seconds=DEFAULT_MIN_SECONDS):
+    """Rows ``(bench, key, metric, old, new, change, status)`` for every metric measured in both runs.
+
+    ``status`` is "regression" or "improvement" when a directional metric
+    moved by more than ``threshold`` (relative), otherwise "ok"; timings
+    below ``min_seconds`` on both sides never count.
+    """
+    old_rows, new_rows = _index(baseline), _index(current)
+    rows = []
+    for ident in sorted(old_rows.keys() & new_rows.keys()):
+        old_metrics, new_metrics = old_rows[ident], new_rows[ident]
+        for metric in sorted(old_metrics.keys() & new_metrics.keys()):
+            old, new = old_metrics[metric], new_metrics[metric]
+            sign = direction(metric)
+            if not sign or isinstance(old, bool) or not isinstance(old, (int, float)) \
+                    or not isinstance(new, (int, float)):
+                continue
+            change = (new - old) / old if old else (0.0 if new == old else float("inf"))
+            status = "ok"
+            noise = "seconds" in metric and max(old, new) < min_seconds
+            if not noise and abs(change) > threshold:
+                status = "improvement" if change * sign > 0 else "regression"
+            rows.append((ident[0], ident[1], metric, old, new, change, status))
+    missing = sorted(old_rows.keys() - new_rows.keys())
+    return rows, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench.compare",
+                                     description="Compare two `python -m bench` result files")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="relative change that counts")
+    parser.add_argument("--min-seconds", type=float, default=DEFAULT_MIN_SECONDS)
+    parser.add_argument("--all", action="store_true", help="also list metrics within the threshold")
+    parser.add_argument("--json", action="store_true", help="print the comparison as JSON")
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    rows, missing = compare(baseline, current, args.threshold, args.min_seconds)
+    regressions = [row for row in rows if row[6] == "regression"]
+
+    if args.json:
+        print(json.dumps({
+            "baseline": baseline.get("environment"),
+            "current": current.get("environment"),
+            "rows": [dict(zip(("bench", "key", "metric", "old", "new", "change", "status"), row)) for row in rows],
+            "missing": [{"bench": bench, "key": key} for bench, key in missing],
+            "regressions": len(regressions),
+        }, ensure_ascii=False, indent=1))
+    else:
+        print(f"baseline {baseline['environment'].get('commit')}  current {current['environment'].get('commit')}")
+        for bench, key, metric, old, new, change, status in rows:
+            if status != "ok" or args.all:
+                print(f"{status:<11} {bench:<8} {key} {metric}: {old:.6g} -> {new:.6g} ({change:+.1%})")
+        for bench, key in missing:
+            print(f"missing     {bench:<8} {key}")
+        print(f"{len(rows)} metrics compared, {len(regressions)} regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+from store import TimeSeriesStore
+from log_writer import CsvLogWriter, FSYNC_NEVER
+
+CORPUS_START = datetime(2025, 1, 6)
+WAREHOUSES = 10
+
+
+def synthetic_devices(count, ts, warehouses=WAREHOUSES):
+    """A deterministic fleet snapshot at ``ts`` (same input, same output)."""
+    return [{
+        "id": f"SYN{i:08X}",
+        "name": f"synthetic-{i}",
+        "temperature": f"{20 + (i + ts.minute) % 10}.{i % 10}",
+        "humidity": f"{50 + i % 30}.{ts.second % 10}",
+        "last_seen": ts.strftime("%Y-%m-%d %H:%M:%S"),
+        "online": i % 17 != 0,
+        "location_id": f"loc{i % warehouses:02d}",
+        "warehouse": f"warehouse-{i % warehouses}",
+    } for i in range(count)]
+
+
+def snapshot_times(start, snapshots, interval):
+    return [start + timedelta(seconds=interval * i) for i in range(snapshots)]
+
+
+def write_store(root, devices, times):
+    """Append one snapshot per entry of ``times`` to a TimeSeriesStore at ``root``; returns seconds taken."""
+    store = TimeSeriesStore(root)
+    t0 = time.perf_counter()
+    try:
+        for ts in times:
+            store.append(ts, synthetic_devices(devices, ts))
+    finally:
+        store.close()
+    return time.perf_counter() - t0
+
+
+def write_legacy_cache(cache_dir, devices, times):
+    """Old-style ``device_cache_YYYYMMDDHHMMSS.json`` files, as cache_worker wrote them before the store."""
+    os.makedirs(cache_dir, exist_ok=True)
+    for ts in times:
+        with open(os.path.join(cache_dir, f"device_cache_{ts:%Y%m%d%H%M%S}.json"), "w", encoding="utf-8") as f:
+            json.dump(synthetic_devices(devices, ts), f, ensure_ascii=False, indent=2)
+
+
+def write_logs(log_dir, devices, times, log_format="per_device"):
+    """CSV logs as cache_logger writes them, one slot per entry of ``times``."""
+    writer = CsvLogWriter(log_dir, log_format, fsync=FSYNC_NEVER)
+    try:
+        for ts in times:
+            stamp = ts.strftime("%Y-%m-%d %H:%M:%S")
+            for d in synthetic_devices(devices, ts):
+                writer.add(d["id"], stamp, d["temperature"], d["humidity"], d["last_seen"], d["location_id"])
+            writer.flush()
+    finally:
+        writer.close()
+
+
+def write_config(base_dir, devices, warehouses=WAREHOUSES):
+    """device_assignments.json / locations.json matching synthetic_devices."""
+    assignments = {f"SYN{i:08X}": f"loc{i % warehouses:02d}" for i in range(devices)}
+    locations = {f"loc{i:02d}": f"warehouse-{i}" for i in range(warehouses)}
+    for name, data in (("device_assignments.json", assignments), ("locations.json", locations)):
+        with open(os.path.join(base_dir, name), "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def write_latest(cache_dir, devices, ts):
+    """``device_cache_latest.json`` as read by the web app."""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, "device_cache_latest.json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(synthetic_devices(devices, ts), f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def generate(root, devices, days, interval, legacy=0, log_slots=0, log_format="per_device"):
+    """Lay out a project-shaped corpus under ``root`` (store/, cache/, logs/ and the config files)."""
+    os.makedirs(root, exist_ok=True)
+    times = snapshot_times(CORPUS_START, int(days * 86400 / interval), interval)
+    summary = {"devices": devices, "snapshots": len(times)}
+    summary["store_seconds"] = write_store(os.path.join(root, "store"), devices, times)
+    if legacy:
+        write_legacy_cache(os.path.join(root, "cache"), devices, times[-legacy:])
+    if log_slots:
+        write_logs(os.path.join(root, "logs"), devices, times[-log_slots:], log_format)
+    write_config(root, devices)
+    write_latest(os.path.join(root, "cache"), devices, times[-1] if times else CORPUS_START)
+    summary["bytes"] = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic store/cache/log corpus")
+    parser.add_argument("--root", required=True, help="output directory (existing config files are overwritten)")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--days", type=float, default=1)
+    parser.add_argument("--interval", type=int, default=60)
+    parser.add_argument("--legacy", type=int, default=0, help="also write this many legacy cache files")
+    parser.add_argument("--log-slots", type=int, default=0, help="also write this many CSV log slots")
+    parser.add_argument("--log-format", default="per_device", choices=["per_device", "daily"])
+    args = parser.parse_args()
+
+    print(json.dumps(generate(args.root, args.devices, args.days, args.interval, args.legacy,
+                              args.log_slots, args.log_format)))
+
+
+if __name__ == "__main__":
+    main()
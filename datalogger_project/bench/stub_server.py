@@ -0,0 +1,181 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class StubState:
+    """Fake 1weilian fleet served by StubServer."""
+
+    def __init__(self, devices=100, latency=0.05, report_total=True,
+                 error_rate=0.0, garbage_rate=0.0, hang_rate=0.0, hang_seconds=30.0, down=False, seed=None,
+                 fail_pages=None):
+        self.devices = devices
+        self.latency = latency
+        self.report_total = report_total
+        # 障害注入: data リクエストごとに確率で 500 / 壊れた JSON / 応答遅延を返す
+        self.error_rate = error_rate
+        self.garbage_rate = garbage_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.down = down
+        # {page: n}: そのページの最初の n 回は必ず 500 を返す (テストで再現性のある一時障害を起こす)
+        self.fail_pages = dict(fail_pages or {})
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.logins = 0
+        self.data_requests = 0
+        self.faults = 0
+
+    def fault(self, page=None):
+        """Pick the fault for one data request: None, "down", "error", "garbage" or "hang"."""
+        with self.lock:
+            if self.down:
+                fault = "down"
+            elif self.fail_pages.get(page, 0) > 0:
+                self.fail_pages[page] -= 1
+                fault = "error"
+            else:
+                roll = self.random.random()
+                fault = None
+                for name, rate in (("error", self.error_rate), ("garbage", self.garbage_rate),
+                                   ("hang", self.hang_rate)):
+                    if roll < rate:
+                        fault = name
+                        break
+                    roll -= rate
+            if fault:
+                self.faults += 1
+            return fault
+
+    def device(self, index):
+        return {
+            "sn": f"STUB{index:08X}",
+            "deviceName": f"stub-{index}",
+            "temperature": f"{20 + index % 10}.{index % 7}",
+            "humidity": f"{50 + index % 30}.{index % 3}",
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "status": 0 if index % 13 else 1
+        }
+
+    def page(self, page, rows):
+        start = page * rows
+        return [self.device(i) for i in range(start, min(start + rows, self.devices))]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        state = self.server.state
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(state.latency)
+
+        if self.path.endswith("/user/login"):
+            with state.lock:
+                state.logins += 1
+            result = {"data": {"accessToken": f"stub-token-{state.logins}", "userId": 1}}
+        elif self.path.endswith("/public/realTimeData"):
+            with state.lock:
+                state.data_requests += 1
+            page = int(body.get("page", 0))
+            fault = state.fault(page)
+            if fault in ("down", "error"):
+                self._send(503 if fault == "down" else 500, b"<html>error</html>", "text/html")
+                return
+            if fault == "garbage":
+                self._send(200, b"<html>maintenance</html>", "text/html")
+                return
+            if fault == "hang":
+                time.sleep(state.hang_seconds)
+            data = {"dataList": state.page(page, int(body.get("rows", 20)))}
+            if state.report_total:
+                data["total"] = state.devices
+            result = {"data": data}
+        else:
+            self.send_error(404)
+            return
+
+        self._send(200, json.dumps(result).encode("utf-8"), "application/json;charset=UTF-8")
+
+    def _send(self, status, payload, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except OSError:
+            # クライアントがタイムアウトで切断済み
+            pass
+
+
+class StubServer:
+    """Local stand-in for LOGIN_URL/DATA_URL, run on a background thread."""
+
+    def __init__(self, state=None, host="127.0.0.1", port=0):
+        self.state = state or StubState()
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = self.state
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def login_url(self):
+        return self.base_url + "/user/login"
+
+    @property
+    def data_url(self):
+        return self.base_url + "/public/realTimeData"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake 1weilian API")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--no-total", action="store_true")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--garbage-rate", type=float, default=0.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--hang-seconds", type=float, default=30.0)
+    parser.add_argument("--down", action="store_true")
+    args = parser.parse_args()
+
+    server = StubServer(StubState(args.devices, args.latency, not args.no_total, args.error_rate,
+                                  args.garbage_rate, args.hang_rate, args.hang_seconds, args.down), port=args.port)
+    print(f"[INFO] Stub 1weilian API on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
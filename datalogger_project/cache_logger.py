@@ -1,152 +1,257 @@
 import os
 import json
-import time
+import logging
+import threading
 from datetime import datetime, timedelta
-import traceback
+
+import assignment_log
+import config_store
+import logging_setup
+import metrics
+from store import TimeSeriesStore
+from log_writer import CsvLogWriter, writer_config
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-SETTINGS_FILE = os.path.join(BASE_DIR, 'settings.json')
-CACHE_DIR = os.path.join(BASE_DIR, 'cache')
 LAST_TIMES_FILE = os.path.join(BASE_DIR, 'last_logged_times.txt')
-ASSIGNMENT_FILE = os.path.join(BASE_DIR, "device_assignments.json")  # device_id → location_id
-LOCATION_FILE = os.path.join(BASE_DIR, "locations.json")  # location_id → 倉庫名
 
+logger = logging.getLogger(__name__)
 
-def load_settings():
-    with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
+RUN_SECONDS = metrics.histogram("datalogger_logger_run_seconds", "Duration of one log_data() run")
+ROWS_LOGGED = metrics.counter("datalogger_logger_rows_total", "CSV rows written by cache_logger")
 
+SETTINGS_POLL_SECONDS = 5      # 設定ファイルの変更を stat で確認する間隔
+DEFAULT_CATCH_UP_HOURS = 24    # 停止後に遡って記録する最大時間
 
-def parse_timestamp_from_filename(filename):
-    try:
-        name_part = filename.replace("device_cache_", "").replace(".json", "")
-        return datetime.strptime(name_part, '%Y%m%d%H%M%S')
-    except Exception:
-        return None
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = TimeSeriesStore()
+    return _store
+
+
+_writer = None
+_writer_config = None
+
+
+def get_writer(settings):
+    # 設定が変わったときだけハンドルを閉じて作り直す
+    global _writer, _writer_config
+    config = writer_config(settings, BASE_DIR)
+    if _writer is None or config != _writer_config:
+        if _writer is not None:
+            _writer.close()
+        _writer = CsvLogWriter(*config)
+        _writer_config = config
+    return _writer
 
 
 def load_nearest_cache(log_time: datetime):
-    nearest_ts = None
-    nearest_data = []
-    min_diff = timedelta.max
+    return get_store().nearest(log_time)
+
 
-    for fname in sorted(os.listdir(CACHE_DIR), reverse=True):
-        if not fname.endswith(".json"):
-            continue
+def parse_log_times(log_times):
+    """Turn "HH:MM" / "HH:MM:SS" strings into sorted seconds-after-midnight."""
+    offsets = set()
+    for value in log_times or []:
         try:
-            ts = parse_timestamp_from_filename(fname)
-            if ts is None:
-                continue
-            diff = abs(log_time - ts)
-            if diff < min_diff:
-                with open(os.path.join(CACHE_DIR, fname), 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                if isinstance(data, list):
-                    nearest_ts = ts
-                    nearest_data = data
-                    min_diff = diff
-        except Exception:
-            continue
-
-    return nearest_ts, nearest_data
-
-
-def load_last_logged_times():
-    if os.path.exists(LAST_TIMES_FILE):
+            parts = [int(p) for p in str(value).strip().split(":")]
+            if len(parts) == 2:
+                parts.append(0)
+            h, m, sec = parts
+            if 0 <= h < 24 and 0 <= m < 60 and 0 <= sec < 60:
+                offsets.add(h * 3600 + m * 60 + sec)
+        except ValueError:
+            logger.warning("Ignoring invalid log time: %r", value)
+    return sorted(offsets)
+
+
+class LogSchedule:
+    """Log slots from fixed times of day (``log_times``) and/or a fixed interval.
+
+    ``log_interval_seconds`` slots are aligned to midnight, so an interval
+    of 900 logs at :00, :15, :30 and :45 regardless of when we started.
+    """
+
+    def __init__(self, log_times=None, interval_seconds=0):
+        self.offsets = parse_log_times(log_times)
+        self.interval = max(int(interval_seconds or 0), 0)
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(settings.get("log_times", []), settings.get("log_interval_seconds", 0))
+
+    def __bool__(self):
+        return bool(self.offsets or self.interval)
+
+    def next_after(self, moment):
+        """First slot strictly after ``moment``, or None when nothing is scheduled."""
+        midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+        elapsed = (moment - midnight).total_seconds()
+        candidates = []
+        if self.offsets:
+            later = [o for o in self.offsets if o > elapsed]
+            candidates.append(midnight + timedelta(seconds=later[0]) if later
+                              else midnight + timedelta(days=1, seconds=self.offsets[0]))
+        if self.interval:
+            candidates.append(midnight + timedelta(seconds=(int(elapsed // self.interval) + 1) * self.interval))
+        return min(candidates) if candidates else None
+
+    def slots_between(self, start, end):
+        """Slots in (start, end]."""
+        slots = []
+        slot = self.next_after(start)
+        while slot is not None and slot <= end:
+            slots.append(slot)
+            slot = self.next_after(slot)
+        return slots
+
+
+def load_last_slot():
+    if not os.path.exists(LAST_TIMES_FILE):
+        return None
+    try:
         with open(LAST_TIMES_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
-
+            data = json.load(f)
+        if "last_slot" in data:
+            return datetime.fromisoformat(data["last_slot"])
+        # 旧形式 {"HH:MM": "YYYY-MM-DD"} からの移行: 最後に記録した枠を使う
+        logged = [datetime.strptime(f"{day} {hm}", "%Y-%m-%d %H:%M") for hm, day in data.items()]
+        return max(logged) if logged else None
+    except Exception as e:
+        logger.warning("Could not read %s: %s", LAST_TIMES_FILE, e)
+        return None
 
-def save_last_logged_times(data):
-    with open(LAST_TIMES_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f)
 
+def save_last_slot(slot):
+    config_store.save_json(LAST_TIMES_FILE, {"last_slot": slot.isoformat()}, indent=None)
 
-def should_log_now(log_times):
-    now = datetime.now()
-    now_str = now.strftime("%H:%M")
-    today = now.strftime("%Y-%m-%d")
 
-    last_logged_times = load_last_logged_times()
-    last_logged_date = last_logged_times.get(now_str)
+def due_slots(schedule, last_slot, now, catch_up_hours):
+    """Slots that should be logged now; older missed slots only when catching up."""
+    if last_slot is None:
+        # 初回起動時は過去には遡らない
+        last_slot = now - timedelta(seconds=1)
+    # 1 日分遡れば直近の枠は必ず見つかる
+    start = max(last_slot, now - timedelta(hours=max(catch_up_hours, 24)))
+    slots = schedule.slots_between(start, now)
+    if catch_up_hours <= 0:
+        return slots[-1:]
+    horizon = now - timedelta(hours=catch_up_hours)
+    return [slot for slot in slots if slot >= horizon] or slots[-1:]
 
-    if now_str in log_times and last_logged_date != today:
-        last_logged_times[now_str] = today
-        save_last_logged_times(last_logged_times)
-        return True
-    return False
 
+_rows_total = 0    # このプロセスで書いた行数 (実行ごとの集計用)
 
-def load_device_assignments():
-    if os.path.exists(ASSIGNMENT_FILE):
-        with open(ASSIGNMENT_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
 
+def log_data(settings=None, log_time=None, skip_snapshot=None):
+    """Append the snapshot nearest to ``log_time`` (default: now) to the CSV logs.
 
-def load_locations():
-    if os.path.exists(LOCATION_FILE):
-        with open(LOCATION_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+    Returns the snapshot time that was logged. A snapshot equal to
+    ``skip_snapshot`` is not logged again, which keeps catch-up after a
+    long outage from repeating the same rows for every missed slot.
+    """
+    with RUN_SECONDS.time():
+        return _log_data(settings, log_time, skip_snapshot)
 
 
-def log_data():
-    print(f"[DEBUG] Attempting to load cache from: {CACHE_DIR}")
-    settings = load_settings()
-    log_dir = os.path.join(BASE_DIR, settings.get('log_directory', 'logs'))
-    os.makedirs(log_dir, exist_ok=True)
-    print(f"[DEBUG] Logging to directory: {log_dir}")
+def _log_data(settings, log_time, skip_snapshot):
+    global _rows_total
+    if settings is None:
+        settings = config_store.get_settings()
+    writer = get_writer(settings)
+    logger.debug("Logging from %s to %s (%s)", get_store().root, writer.log_dir, writer.log_format)
 
-    assignments = load_device_assignments()  # device_id → location_id
+    assignments = config_store.get_assignments()  # device_id → location_id
+    journal = assignment_log.get_journal()
 
-    now = datetime.now()
-    ts, data = load_nearest_cache(now)
+    ts, data = load_nearest_cache(log_time or datetime.now())
     if ts is None or not data:
-        print("[WARN] No valid cache to log.")
-        return
+        logger.warning("No valid cache to log", extra={"slot": log_time})
+        return None
+    if ts == skip_snapshot:
+        logger.debug("Snapshot %s already logged, skipping slot %s", ts, log_time)
+        return ts
 
     timestamp_str = ts.strftime('%Y-%m-%d %H:%M:%S')
 
     for device in data:
         dev_id = device.get('id')
-        temperature = device.get('temperature', '')
-        humidity = device.get('humidity', '')
-        last_seen = device.get('last_seen', '')
+        writer.add(dev_id, timestamp_str, device.get('temperature', ''), device.get('humidity', ''),
+                   device.get('last_seen', ''), journal.location_at(dev_id, ts, assignments.get(dev_id, '')))
+
+    files, rows, failures = writer.flush()
+    ROWS_LOGGED.inc(rows)
+    _rows_total += rows
+    for path, e in failures:
+        logger.error("Writing log %s failed: %s", path, e)
+    logger.debug("Logged %d rows to %d files at %s", rows, files, timestamp_str)
+    return ts
+
+
+def main(stop_event=None, status=None):
+    """Log every due slot until ``stop_event`` is set, reporting cycles to ``status`` if given."""
+    logger.debug("cache_logger started")
+    stop_event = stop_event or threading.Event()
+    settings, stamp, schedule = {}, None, LogSchedule()
+    last_slot = load_last_slot()
+    last_snapshot = None
 
-        loc_id = assignments.get(dev_id, '')
-
-        log_file = os.path.join(log_dir, f"{dev_id}.csv")
-        write_header = not os.path.exists(log_file)
-
-        try:
-            with open(log_file, 'a', encoding='utf-8') as f:
-                if write_header:
-                    f.write("timestamp,temperature,humidity,last_seen,location_id\n")
-                f.write(f"{timestamp_str},{temperature},{humidity},{last_seen},{loc_id}\n")
-            print(f"[INFO] Logged: {dev_id} at {timestamp_str}")
-        except Exception as e:
-            print(f"[ERROR] Writing log for {dev_id} failed: {e}")
-
-
-def main():
-    print("[DEBUG] cache_logger started")
-    while True:
-        try:
-            settings = load_settings()
-            log_times = settings.get("log_times", ["03:00", "09:00"])
-
-            if should_log_now(log_times):
-                print(f"[DEBUG] Matched log time, logging now...")
-                log_data()
-            else:
-                print(f"[DEBUG] Not time to log yet.")
-        except Exception:
-            print("[ERROR] Unexpected error:")
-            traceback.print_exc()
-
-        time.sleep(60)  # check every minute
+    try:
+        while not stop_event.is_set():
+            error = None
+            try:
+                current = config_store.settings_stamp()
+                if current != stamp:
+                    settings = config_store.get_settings()
+                    logging_setup.configure(settings)
+                    schedule = LogSchedule.from_settings(settings)
+                    stamp = current
+                    logger.debug("Settings loaded, next log at %s", schedule.next_after(datetime.now()))
+
+                now = datetime.now()
+                catch_up_hours = float(settings.get("log_catch_up_hours", DEFAULT_CATCH_UP_HOURS))
+                slots = due_slots(schedule, last_slot, now, catch_up_hours)
+                if slots and status is not None:
+                    status.begin_cycle()
+                rows_before = _rows_total
+                logged = 0
+                for slot in slots:
+                    snapshot = log_data(settings, slot, skip_snapshot=last_snapshot)
+                    if snapshot is not None and snapshot != last_snapshot:
+                        logged += 1
+                    last_snapshot = snapshot or last_snapshot
+                    last_slot = slot
+                    save_last_slot(slot)
+                if slots:
+                    # 遅れを取り戻す場合も 1 回の実行につき 1 レコードにまとめる
+                    logger.info("Log run finished", extra={
+                        "slots": len(slots), "snapshots": logged, "rows": _rows_total - rows_before,
+                        "first_slot": slots[0].isoformat(), "last_slot": slots[-1].isoformat()})
+                if last_slot is None:
+                    last_slot = now
+            except Exception as e:
+                error = e
+                logger.exception("Unexpected error: %s", e)
+
+            # 次の記録時刻まで眠る。設定変更を拾えるよう最大 SETTINGS_POLL_SECONDS ごとに起きる
+            next_slot = schedule.next_after(last_slot or datetime.now())
+            if status is not None:
+                next_due = next_slot.timestamp() if next_slot is not None else None
+                if status.cycle_started is not None or error is not None:
+                    status.end_cycle(next_due=next_due, error=error)
+                else:
+                    status.next_due = next_due
+            wait = SETTINGS_POLL_SECONDS
+            if next_slot is not None:
+                wait = min(wait, max((next_slot - datetime.now()).total_seconds(), 0))
+            stop_event.wait(wait)
+    finally:
+        if _writer is not None:
+            _writer.close()
 
 
 if __name__ == '__main__':
@@ -1,153 +1,264 @@
 import os
-import json
 import time
+import logging
+import threading
 from datetime import datetime, timedelta
-import requests
 
-LOGIN_URL = "http://1weilian.com/user/login"
-DATA_URL = "http://1weilian.com/public/realTimeData"
-ACCOUNT = "nglswhs47"
-PASSWORD = "ngls1234"
+import alerts
+import cadence
+import config_store
+import latest
+import logging_setup
+import metrics
+import rollup
+import upstream
+from store import TimeSeriesStore, DEFAULT_KEYFRAME_EVERY
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-SETTINGS_FILE = os.path.join(BASE_DIR, "settings.json")
-ASSIGNMENT_FILE = os.path.join(BASE_DIR, "device_assignments.json")
 CACHE_DIR = os.path.join(BASE_DIR, "cache")
-LOCATION_FILE = os.path.join(BASE_DIR, "locations.json")
+
+logger = logging.getLogger(__name__)
+
+CYCLE_SECONDS = metrics.histogram("datalogger_worker_cycle_seconds", "Duration of one cache_worker cycle")
+CACHE_INTERVAL = metrics.gauge("datalogger_worker_cache_interval_seconds", "Configured cache_interval")
+LAST_CYCLE = metrics.gauge("datalogger_worker_last_cycle_seconds", "Duration of the last cache_worker cycle")
+WRITE_SECONDS = metrics.histogram("datalogger_snapshot_write_seconds", "Time to store a snapshot and the latest file")
+WRITE_BYTES = metrics.counter("datalogger_snapshot_write_bytes_total", "Bytes written for snapshots by target")
+WRITE_ROWS = metrics.counter("datalogger_snapshot_rows_total", "Changed rows written to the store")
+CLEANUP_SECONDS = metrics.histogram("datalogger_cleanup_seconds", "Time spent expiring old segments and files")
 
 os.makedirs(CACHE_DIR, exist_ok=True)
-print(f"[INFO] Cache directory ensured at: {os.path.abspath(CACHE_DIR)}")
-
-def load_json(filename, default=None):
-    if os.path.exists(filename):
-        with open(filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return default if default is not None else {}
-
-def load_settings():
-    return load_json(SETTINGS_FILE, {})
-
-def load_device_assignments():
-    return load_json(ASSIGNMENT_FILE, {})
-
-def login_and_get_token():
-    payload = {
-        "account": ACCOUNT,
-        "pwd": PASSWORD,
-        "systemVersion": "PC",
-        "loginType": 2
-    }
-    headers = {"Content-Type": "application/json;charset=UTF-8"}
-    response = requests.post(LOGIN_URL, json=payload, headers=headers)
-    result = response.json()
-    return result["data"]["accessToken"], result["data"]["userId"]
-
-def load_locations():
-    return load_json(LOCATION_FILE, {})
-
-def fetch_all_devices(token, user_id):
-    all_devices = []
-    page = 0
-    while True:
-        payload = {
-            "userId": user_id,
-            "loginType": 2,
-            "accessToken": token,
-            "permissions": 2,
-            "language": 1,
-            "page": page,
-            "rows": 20,
-            "sortingType": 0
-        }
-        headers = {"Content-Type": "application/json;charset=UTF-8"}
-        response = requests.post(DATA_URL, json=payload, headers=headers)
-        try:
-            result = response.json()
-            data_list = result["data"]["dataList"]
-        except (KeyError, ValueError) as e:
-            print(f"[ERROR] Failed to parse response: {e}")
-            break
-        if not data_list:
-            break
-        for dev in data_list:
-            all_devices.append({
-                "id": dev["sn"],
-                "name": dev["deviceName"],
-                "temperature": dev["temperature"] if dev["status"] == 0 else "",
-                "humidity": dev["humidity"] if dev["status"] == 0 else "",
-                "last_seen": dev["date"],
-                "online": dev["status"] == 0
-            })
-        page += 1
-    return all_devices
-
-def cleanup_cache(expire_hours):
-    now = datetime.now()
-    for fname in os.listdir(CACHE_DIR):
-        if fname.endswith(".json") and "device_cache_" in fname:
+logger.debug("Cache directory ensured at: %s", os.path.abspath(CACHE_DIR))
+
+def cleanup_cache(store, expire_hours, cache_dir=CACHE_DIR):
+    """Expire segments and legacy cache files older than ``expire_hours``; returns how many were removed."""
+    cutoff = datetime.now() - timedelta(hours=expire_hours)
+    removed = 0
+    for day in store.drop_before(cutoff):
+        logger.debug("Deleted expired segment: %s", day)
+        removed += 1
+
+    # 旧形式 (device_cache_YYYYMMDDHHMMSS.json) の残りを期限切れで削除
+    for fname in os.listdir(cache_dir):
+        if fname.endswith(".json") and "device_cache_" in fname and fname != "device_cache_latest.json":
             try:
                 ts = datetime.strptime(fname.replace("device_cache_", "").replace(".json", ""), "%Y%m%d%H%M%S")
-                if now - ts > timedelta(hours=expire_hours):
-                    path = os.path.join(CACHE_DIR, fname)
+                if ts < cutoff:
+                    path = os.path.join(cache_dir, fname)
                     os.remove(path)
-                    print(f"[INFO] Deleted expired cache: {path}")
+                    logger.debug("Deleted expired cache: %s", path)
+                    removed += 1
             except:
                 continue
+    return removed
+
+def migrate_legacy_cache(store):
+    if store.segment_days():
+        return
+    count = store.import_json_dir(CACHE_DIR)
+    if count:
+        logger.info("Imported %d legacy cache snapshots into %s", count, store.root)
+
+_latest_incomplete = False
 
-def main():
-    print("[DEBUG] cache_worker main loop starting")
-    while True:
-        settings = load_settings()
-        interval = settings.get("cache_interval", 300)
-        expire_hours = settings.get("cache_expire_hours", 168)
+def merge_previous(devices, previous):
+    """Append devices from ``previous`` that are missing in ``devices``, marked ``stale``.
 
+    Used when a cycle could only fetch part of the listing, so devices on the
+    failed pages keep their last reading instead of vanishing.
+    """
+    fetched = {str(d["id"]) for d in devices}
+    merged = [dict(d, stale=True) for d in previous if str(d.get("id")) not in fetched]
+    return devices + merged, len(merged)
+
+def run_cycle(store, settings, breakers=None, schedule=None):
+    """Fetch every account's devices once, store the merged snapshot and expire old data.
+
+    All accounts are polled concurrently (upstream.fetch_accounts) and each
+    device is tagged with its ``account``. ``breakers`` maps account names
+    to upstream.CircuitBreaker: an account is skipped while its breaker is
+    open, and an account that fetched nothing counts as a failure. When
+    only some accounts fail, the cycle goes on with an incomplete listing
+    and their devices keep their last reading. The fetched devices are
+    shown to ``schedule`` (cadence.Cadence), if any, so it can learn their
+    reporting periods, and their readings are folded into the rolling
+    aggregates (rollup.process). Returns a summary dict, which is also
+    logged as the cycle's single INFO record.
+    """
+    global _latest_incomplete
+    cycle_start = time.perf_counter()
+    summary = {}
+    clients = upstream.get_clients(settings)
+    breakers = breakers or {}
+    skipped = [name for name in clients if name in breakers and not breakers[name].allow()]
+    if len(skipped) == len(clients):
+        summary["skipped_seconds"] = round(min(breakers[name].remaining() for name in skipped))
         try:
-            try:
-                token, user_id = login_and_get_token()
-            except Exception as e:
-                print(f"[ERROR] Login failed: {e}")
-                time.sleep(interval)
-                continue
+            summary["expired"] = cleanup_cache(store, settings.get("cache_expire_hours", 168))
+        finally:
+            logger.warning("Upstream circuit open, fetch skipped", extra=summary)
+        return summary
 
-            try:
-                devices = fetch_all_devices(token, user_id)
-            except Exception as e:
-                print(f"[ERROR] Fetching devices failed: {e}")
-                devices = []
+    results = upstream.fetch_accounts({name: client for name, client in clients.items() if name not in skipped},
+                                      **upstream.fetch_options(settings))
+    errors = {name: result for name, result in results.items() if isinstance(result, Exception)}
+    for name, result in results.items():
+        if name in breakers:
+            if name in errors:
+                breakers[name].record_failure()
+            else:
+                breakers[name].record_success()
+    if len(errors) == len(results):
+        raise RuntimeError("Fetching devices failed: " + "; ".join(f"{name}: {e}" for name, e in errors.items()))
+    if len(results) > 1:
+        summary["accounts"] = {name: len(r.devices) for name, r in results.items() if name not in errors}
+    result = upstream.merge_results(dict(results, **{name: RuntimeError("circuit open") for name in skipped}))
 
-            assignments = load_device_assignments()
-            locations = load_json(LOCATION_FILE, {})
+    devices = result.devices
+    summary["fetched"] = len(devices)
+    if schedule is not None:
+        summary["new_readings"] = schedule.observe(devices)
+    if errors:
+        summary["account_errors"] = {name: str(e) for name, e in errors.items()}
+    if skipped:
+        summary["accounts_skipped"] = skipped
+    if not result.complete:
+        cursor = store.latest_cursor()
+        previous = store.load(datetime.fromtimestamp(cursor)) if cursor is not None else []
+        devices, merged = merge_previous(devices, previous)
+        summary["failed_pages"] = result.failed_pages
+        summary["stale_kept"] = merged
 
-            for d in devices:
-                dev_id = str(d["id"])
-                location_id = assignments.get(dev_id)
-                d["location_id"] = location_id
-                d["warehouse"] = locations.get(location_id, "未割当") if location_id else "未割当"
+    assignments = config_store.get_assignments()
+    locations = config_store.get_locations()
 
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            cache_file = os.path.join(CACHE_DIR, f"device_cache_{timestamp}.json")
-            try:
-                with open(cache_file, "w", encoding="utf-8") as f:
-                    json.dump(devices, f, ensure_ascii=False, indent=2)
-                print(f"[INFO] Cache saved to {cache_file}")
+    for d in devices:
+        dev_id = str(d["id"])
+        location_id = assignments.get(dev_id)
+        d["location_id"] = location_id
+        d["warehouse"] = locations.get(location_id, "未割当") if location_id else "未割当"
+
+    now = datetime.now().replace(microsecond=0)
+    summary["devices"] = len(devices)
+    write_start = time.perf_counter()
+    try:
+        day = now.strftime("%Y%m%d")
+        size_before = store.segment_bytes(day)
+        written = store.append(now, devices)
+        WRITE_ROWS.inc(written)
+        WRITE_BYTES.inc(max(store.segment_bytes(day) - size_before, 0), target="store")
+        summary["changed"] = written
+
+        # 変化のないサイクルでは最新ファイルを書き直さない (mtime が「最終変化時刻」になる)
+        # 前回値で補ったサイクルの前後は、△ 表示を付け外しするため必ず書き直す
+        if written or not result.complete or _latest_incomplete or latest.manifest() is None:
+            published = latest.publish(devices)
+            for encoding, size in published["bytes"].items():
+                WRITE_BYTES.inc(size, target=f"latest_{encoding}")
+            summary["latest_written"] = True
+        _latest_incomplete = not result.complete
+
+    except Exception as e:
+        logger.error("Saving cache failed: %s", e)
+    WRITE_SECONDS.observe(time.perf_counter() - write_start)
+
+    try:
+        events = alerts.process(devices, settings)
+        if events:
+            summary["alerts_raised"] = sum(1 for e in events if e["event"] == "raised")
+            summary["alerts_cleared"] = len(events) - summary["alerts_raised"]
+    except Exception as e:
+        logger.error("Alert evaluation failed: %s", e)
 
-                latest_cache_file = os.path.join(CACHE_DIR, "device_cache_latest.json")
-                with open(latest_cache_file, "w", encoding="utf-8") as f:
-                    json.dump(devices, f, ensure_ascii=False, indent=2)
-                print(f"[INFO] device_cache_latest.json updated")
+    try:
+        summary["aggregated"] = rollup.process(devices, settings)
+    except Exception as e:
+        logger.error("Updating aggregates failed: %s", e)
 
+    try:
+        with CLEANUP_SECONDS.time():
+            summary["expired"] = cleanup_cache(store, settings.get("cache_expire_hours", 168))
+    except Exception as e:
+        logger.error("Cache cleanup failed: %s", e)
+
+    summary["seconds"] = round(time.perf_counter() - cycle_start, 3)
+    if result.complete:
+        logger.info("Cycle finished", extra=summary)
+    else:
+        logger.warning("Cycle finished with an incomplete listing", extra=summary)
+    return summary
+
+def main(stop_event=None, status=None):
+    """Run fetch cycles every ``cache_interval`` seconds until ``stop_event`` is set.
+
+    ``status`` is the supervisor's TaskStatus, if any; it is told when each
+    cycle starts and ends and when the next one is due. With
+    ``cadence_adaptive`` the next cycle is scheduled for when new readings
+    are expected (see cadence.Cadence) instead of a fixed interval.
+    """
+    logging_setup.configure(config_store.get_settings())
+    logger.debug("cache_worker main loop starting")
+    stop_event = stop_event or threading.Event()
+    store = TimeSeriesStore(keyframe_every=config_store.get_settings().get("keyframe_every", DEFAULT_KEYFRAME_EVERY))
+    migrate_legacy_cache(store)
+    schedule = cadence.Cadence()
+    try:
+        schedule.seed(store)
+    except Exception as e:
+        logger.warning("Could not learn reporting periods from history: %s", e)
+    try:
+        rollup.seed(store)
+    except Exception as e:
+        logger.warning("Could not backfill aggregates from history: %s", e)
+    breakers, breaker_config = {}, None
+    try:
+        while not stop_event.is_set():
+            settings = config_store.get_settings()
+            logging_setup.configure(settings)
+            interval = settings.get("cache_interval", 300)
+            started = time.time()
+            error = None
+            if status is not None:
+                status.begin_cycle()
+            if upstream.breaker_config(settings) != breaker_config:
+                breaker_config = upstream.breaker_config(settings)
+                breakers = {}
+            # アカウントごとに独立したブレーカー。設定から消えたアカウントの分は捨てる
+            names = [name for name, *_ in upstream.account_configs(settings)]
+            breakers = {name: breakers.get(name) or upstream.CircuitBreaker(*breaker_config, name=name)
+                        for name in names}
+            requests_before = upstream.request_count()
+            try:
+                run_cycle(store, settings, breakers, schedule)
             except Exception as e:
-                print(f"[ERROR] Saving cache failed: {e}")
+                error = e
+                logger.error("Unexpected error in main loop: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+            elapsed = time.time() - started
+            CYCLE_SECONDS.observe(elapsed)
+            LAST_CYCLE.set(round(elapsed, 3))
+            CACHE_INTERVAL.set(interval)
 
+            schedule.record_cycle(upstream.request_count() - requests_before)
+            adaptive, floor, ceiling, grace = cadence.limits(settings)
+            next_due = schedule.next_due(started, floor, ceiling, grace)
+            if not adaptive or error is not None:
+                next_due = started + interval
             try:
-                cleanup_cache(expire_hours)
+                schedule.save(schedule.report(interval, adaptive))
             except Exception as e:
-                print(f"[ERROR] Cache cleanup failed: {e}")
+                logger.error("Saving cadence report failed: %s", e)
+            logger.debug("Next cycle in %.1fs", next_due - started, extra={"reason": schedule.reason})
 
+            if status is not None:
+                status.end_cycle(next_due=next_due, error=error)
+            # 開始時刻基準で待つので取得時間の分だけ周期がずれない
+            stop_event.wait(max(next_due - time.time(), 0))
+    finally:
+        try:
+            rollup.flush()
         except Exception as e:
-            print(f"[FATAL ERROR] Unexpected error in main loop: {e}")
-        finally:
-            time.sleep(interval)
+            logger.error("Saving aggregates failed: %s", e)
+        store.close()
 
 if __name__ == "__main__":
     main()
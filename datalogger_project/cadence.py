@@ -0,0 +1,234 @@
+import os
+import math
+import time
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from statistics import median
+
+import config_store
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CADENCE_FILE = os.path.join(BASE_DIR, "run", "cadence.json")
+
+LAST_SEEN_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+DEFAULT_CEILING_SECONDS = 300
+DEFAULT_GRACE_SECONDS = 5
+SEED_HOURS = 6              # 起動時にストアから周期を学習する範囲
+PERIOD_SAMPLES = 8          # 周期の推定に使う直近の間隔の数
+MIN_PERIOD_SECONDS = 5
+MAX_PERIOD_SECONDS = 6 * 3600
+IDLE_PERIODS = 3            # これだけ周期を飛ばした機器は休止中とみなす
+LAG_CYCLES = 20             # 上流への反映遅れは直近これだけのサイクルから推定する
+
+NEXT_DELAY = metrics.gauge("datalogger_cadence_next_seconds", "Seconds until the next scheduled fetch cycle")
+REQUESTS_SAVED = metrics.gauge("datalogger_cadence_requests_saved",
+                               "Upstream requests saved compared with fixed-interval polling")
+
+
+def limits(settings):
+    """``(adaptive, floor, ceiling, grace)`` from settings; the floor defaults to ``cache_interval``."""
+    interval = float(settings.get("cache_interval", 300))
+    floor = float(settings.get("cadence_floor_seconds") or interval)
+    ceiling = max(float(settings.get("cadence_ceiling_seconds") or DEFAULT_CEILING_SECONDS), floor)
+    grace = float(settings.get("cadence_grace_seconds", DEFAULT_GRACE_SECONDS))
+    return bool(settings.get("cadence_adaptive")), floor, ceiling, grace
+
+
+def _epoch(last_seen):
+    if not last_seen:
+        return None
+    try:
+        return datetime.strptime(str(last_seen), LAST_SEEN_FORMAT).timestamp()
+    except ValueError:
+        return None
+
+
+class _Device:
+    __slots__ = ("last", "intervals", "period", "online")
+
+    def __init__(self, last):
+        self.last = last
+        self.intervals = deque(maxlen=PERIOD_SAMPLES)
+        self.period = None
+        self.online = True
+
+    def observe(self, epoch):
+        """Take a ``last_seen``; returns True when it is a new reading."""
+        if epoch <= self.last:
+            return False
+        interval = epoch - self.last
+        self.last = epoch
+        if interval < MIN_PERIOD_SECONDS or interval > MAX_PERIOD_SECONDS:
+            return True
+        if self.period and interval > 1.5 * self.period:
+            # 取得間隔が周期より長いと途中の報告を取りこぼす。何周期分かで割って 1 周期に直す
+            interval /= round(interval / self.period)
+        self.intervals.append(interval)
+        self.period = median(self.intervals)
+        return True
+
+    def next_report(self, now):
+        """Epoch of the next expected reading, or None when the device looks idle."""
+        if not self.online or not self.period:
+            return None
+        expected = self.last + self.period
+        if expected < now:
+            missed = math.ceil((now - expected) / self.period)
+            if missed > IDLE_PERIODS:
+                return None
+            expected += missed * self.period
+        return expected
+
+
+class Cadence:
+    """Learn each device's reporting period from ``last_seen`` and schedule fetch cycles around it.
+
+    The next cycle is due once the online devices expected to report
+    within ``floor`` seconds of the earliest one have done so, plus the
+    upstream lag and ``grace``, kept between the floor and the ceiling.
+    While no device is expected (the fleet is idle or offline) the delay
+    doubles up to the ceiling; a new reading snaps it back. Requests are
+    counted so that ``report`` can compare them with fixed-interval
+    polling.
+    """
+
+    def __init__(self):
+        self.devices = {}
+        self._lags = deque(maxlen=LAG_CYCLES)
+        self._polled = None
+        self._idle_delay = None
+        self.started = time.time()
+        self.cycles = 0
+        self.requests = 0
+        self.new_readings = 0
+        self.staleness = 0.0
+        self.next_delay = None
+        self.reason = None
+
+    def seed(self, store, hours=SEED_HOURS):
+        """Learn periods from the ``last_seen`` history already in ``store``; returns the readings read."""
+        end = datetime.now()
+        count = 0
+        for chunk in store.iter_readings(end - timedelta(hours=hours), end):
+            for sn, _, _, _, _, online, last_seen in chunk:
+                if last_seen:
+                    self._observe(sn, last_seen)
+                    self.devices[sn].online = bool(online)
+            count += len(chunk)
+        return count
+
+    def _observe(self, sn, epoch):
+        device = self.devices.get(sn)
+        if device is None:
+            self.devices[sn] = _Device(epoch)
+            return False
+        return device.observe(epoch)
+
+    def observe(self, devices, now=None):
+        """Take one fetched snapshot; returns how many devices brought a new reading."""
+        now = now or time.time()
+        fresh = 0
+        missed = []
+        for d in devices:
+            if d.get("stale"):
+                continue
+            epoch = _epoch(d.get("last_seen"))
+            if epoch is None:
+                continue
+            sn = str(d.get("id"))
+            if self._observe(sn, epoch):
+                fresh += 1
+                self.staleness += max(now - epoch, 0)
+                if self._polled is not None and self._polled > epoch:
+                    # 前回の取得時点で既に報告時刻を過ぎていたのに見えなかった分は、確実に反映が遅れている
+                    missed.append(self._polled - epoch)
+            self.devices[sn].online = bool(d.get("online"))
+        if missed:
+            self._lags.append(median(missed))
+        self._polled = now
+        if fresh:
+            self._idle_delay = None
+        self.new_readings += fresh
+        return fresh
+
+    def lag(self):
+        """Recent lower bound on how long a reading takes to show up upstream after its ``last_seen``.
+
+        A reading that was already due at the previous fetch but only
+        appears now proves the delay (clock skew included) is at least that
+        long, so the estimate only grows on evidence and never from our own
+        waiting.
+        """
+        return max(self._lags) if self._lags else 0.0
+
+    def next_due(self, started, floor, ceiling, grace=DEFAULT_GRACE_SECONDS, now=None):
+        """Epoch at which the next cycle should start, for a cycle that started at ``started``."""
+        now = now or time.time()
+        # 報告時刻を過ぎていても反映遅れの間はまだ届いていないだけなので、待つ対象に含める
+        lead = self.lag() + grace
+        expected = [t for t in (d.next_report(now - lead) for d in self.devices.values()) if t is not None]
+        # 周期が未学習でも、ceiling より長く報告のない機器は休止中として待たない
+        learning = any(d.online and not d.period and now - d.last < ceiling for d in self.devices.values())
+        if expected:
+            # 同じ頃に報告する機器はまとめて 1 回で拾う。floor 以内の遅れは固定間隔でも生じる
+            first = min(expected)
+            delay = max(t for t in expected if t <= first + floor) + lead - started
+            self.reason = "expected"
+        elif learning or not self.devices:
+            delay = floor
+            self.reason = "learning"
+        else:
+            delay = self._idle_delay = min((self._idle_delay or floor) * 2, ceiling)
+            self.reason = "idle"
+        self.next_delay = round(min(max(delay, floor), ceiling), 3)
+        NEXT_DELAY.set(self.next_delay)
+        return started + self.next_delay
+
+    def record_cycle(self, requests):
+        self.cycles += 1
+        self.requests += requests
+
+    def report(self, interval, adaptive=True, now=None):
+        """What adaptive scheduling saved, compared with fetching every ``interval`` seconds since start."""
+        now = now or time.time()
+        elapsed = now - self.started
+        per_cycle = self.requests / self.cycles if self.cycles else 0.0
+        fixed_cycles = math.floor(elapsed / interval) + 1 if interval and self.cycles else self.cycles
+        fixed_requests = round(fixed_cycles * per_cycle)
+        saved = fixed_requests - self.requests
+        periods = [d.period for d in self.devices.values() if d.period]
+        REQUESTS_SAVED.set(saved)
+        return {
+            "adaptive": adaptive,
+            "since": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "updated": datetime.fromtimestamp(now).isoformat(timespec="seconds"),
+            "cycles": self.cycles,
+            "requests": self.requests,
+            "fixed_interval": interval,
+            "fixed_cycles": fixed_cycles,
+            "fixed_requests": fixed_requests,
+            "saved_requests": saved,
+            "saved_percent": round(100.0 * saved / fixed_requests, 1) if fixed_requests else 0.0,
+            "new_readings": self.new_readings,
+            "mean_staleness_seconds": round(self.staleness / self.new_readings, 1) if self.new_readings else None,
+            "devices": len(self.devices),
+            "online": sum(1 for d in self.devices.values() if d.online),
+            "median_period_seconds": round(median(periods), 1) if periods else None,
+            "lag_seconds": round(self.lag(), 1),
+            "next_delay_seconds": self.next_delay,
+            "reason": self.reason,
+        }
+
+    def save(self, report, path=CADENCE_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        config_store.save_json(path, report)
+
+
+def load_report(path=CADENCE_FILE):
+    """The worker's last saved report (see Cadence.report), or None."""
+    return config_store.load_json(path, None)
@@ -0,0 +1,157 @@
+import os
+import json
+import logging
+import tempfile
+import threading
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SETTINGS_FILE = os.path.join(BASE_DIR, "settings.json")
+ASSIGNMENT_FILE = os.path.join(BASE_DIR, "device_assignments.json")  # device_id → location_id
+LOCATION_FILE = os.path.join(BASE_DIR, "locations.json")  # location_id → 倉庫名
+ALERT_RULES_FILE = os.path.join(BASE_DIR, "alert_rules.json")  # "default" / location_id → しきい値
+
+logger = logging.getLogger(__name__)
+
+# 設定画面と同じ既定値。型もここから決まる
+DEFAULT_SETTINGS = {
+    "interval": 10,
+    "cache_interval": 10,
+    "cache_expire_hours": 72,
+    "log_times": ["03:00", "09:00"],
+    "log_interval_seconds": 0,
+    "log_directory": "logs",
+    "log_format": "per_device",
+    "cadence_adaptive": False,
+    "cadence_floor_seconds": 0,
+    "cadence_ceiling_seconds": 300,
+}
+
+_lock = threading.Lock()
+_cache = {}  # path -> (stamp, parsed)
+
+
+def file_stamp(filename):
+    """(mtime_ns, size, inode) of ``filename``, or None when it does not exist."""
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def load_json(filename, default):
+    """Parsed contents of ``filename``, re-read only when its stamp changes.
+
+    The returned object is shared between callers; copy it before mutating.
+    """
+    stamp = file_stamp(filename)
+    if stamp is None:
+        return default
+    cached = _cache.get(filename)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    try:
+        with open(filename, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error("Failed to load %s: %s", filename, e)
+        return cached[1] if cached is not None else default
+    with _lock:
+        _cache[filename] = (stamp, data)
+    return data
+
+
+def save_json(filename, data, indent=2):
+    """Write ``data`` atomically (temp file + fsync + rename) and refresh the cache."""
+    directory = os.path.dirname(filename) or "."
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    with _lock:
+        _cache[filename] = (file_stamp(filename), data)
+
+
+_BOOL_TEXT = {"true": True, "1": True, "false": False, "0": False}
+
+
+def _coerce(value, default):
+    """``value`` converted to the type of ``default``, or ``default`` when it cannot be."""
+    try:
+        if isinstance(default, bool):
+            # bool("false") は True になるので、文字列と 0/1 だけを解釈する
+            if isinstance(value, bool):
+                return value
+            if isinstance(value, (int, float)) and value in (0, 1):
+                return bool(value)
+            return _BOOL_TEXT.get(str(value).strip().lower(), default) if isinstance(value, str) else default
+        if isinstance(default, int):
+            return int(value)
+        if isinstance(default, float):
+            return float(value)
+        if isinstance(default, list):
+            # "08:00" のような 1 件だけの文字列を 1 文字ずつのリストにしない
+            if isinstance(value, str):
+                return [value]
+            return list(value) if isinstance(value, (list, tuple)) else default
+        if isinstance(default, str):
+            return str(value)
+    except (TypeError, ValueError):
+        return default
+    return value
+
+
+def get_settings():
+    """settings.json merged over DEFAULT_SETTINGS, with known keys coerced to their default's type.
+
+    Returns a fresh dict, so callers may modify it and pass it to save_settings().
+    """
+    settings = dict(DEFAULT_SETTINGS)
+    for key, value in load_json(SETTINGS_FILE, {}).items():
+        settings[key] = _coerce(value, DEFAULT_SETTINGS[key]) if key in DEFAULT_SETTINGS else value
+    return settings
+
+
+def save_settings(settings):
+    save_json(SETTINGS_FILE, settings)
+
+
+def get_assignments():
+    return dict(load_json(ASSIGNMENT_FILE, {}))
+
+
+def save_assignments(assignments):
+    save_json(ASSIGNMENT_FILE, assignments)
+
+
+def get_locations():
+    return dict(load_json(LOCATION_FILE, {}))
+
+
+def save_locations(locations):
+    save_json(LOCATION_FILE, locations)
+
+
+def get_alert_rules():
+    return dict(load_json(ALERT_RULES_FILE, {}))
+
+
+def save_alert_rules(rules):
+    save_json(ALERT_RULES_FILE, rules)
+
+
+def settings_stamp():
+    return file_stamp(SETTINGS_FILE)
+
+
+def config_stamp():
+    """Combined stamp of the assignment and location files."""
+    return (file_stamp(ASSIGNMENT_FILE), file_stamp(LOCATION_FILE))
+
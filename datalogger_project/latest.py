@@ -0,0 +1,135 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+import tempfile
+from datetime import datetime
+
+import config_store
+
+try:
+    import brotli
+except ImportError:  # 任意。入っていなければ gzip だけ作る
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, "cache")
+LATEST_FILE = os.path.join(CACHE_DIR, "device_cache_latest.json")
+PUBLISH_DIR = os.path.join(CACHE_DIR, "latest")
+MANIFEST_FILE = os.path.join(PUBLISH_DIR, "manifest.json")
+
+# encoding -> file suffix. 優先順
+ENCODINGS = (("br", ".json.br"), ("gzip", ".json.gz"), ("identity", ".json"))
+KEEP_VERSIONS = 3           # 配信中のリクエストのため古い版も少し残す
+
+logger = logging.getLogger(__name__)
+
+
+def _write_atomic(path, data):
+    """Write ``data`` to ``path`` via a temp file in the same directory, fsync and rename."""
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _link_atomic(source, path):
+    """Point ``path`` at the bytes of ``source`` (hard link + rename), copying when links are unsupported."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        os.link(source, tmp_path)
+        os.replace(tmp_path, path)
+    except OSError:
+        with open(source, "rb") as f:
+            _write_atomic(path, f.read())
+
+
+def variant_path(etag, suffix):
+    return os.path.join(PUBLISH_DIR, etag + suffix)
+
+
+def publish(devices):
+    """Publish ``devices`` as compact JSON plus precompressed siblings; returns the manifest.
+
+    Every variant is written under its content hash and fsynced before the
+    manifest is renamed into place, so a reader that goes through the
+    manifest always gets one complete version in every encoding.
+    ``device_cache_latest.json`` is replaced atomically as well for readers
+    that open it directly.
+    """
+    os.makedirs(PUBLISH_DIR, exist_ok=True)
+    body = json.dumps(devices, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    etag = hashlib.sha1(body).hexdigest()[:20]
+    encoded = {"identity": body, "gzip": gzip.compress(body, compresslevel=6, mtime=0)}
+    if brotli is not None:
+        encoded["br"] = brotli.compress(body, quality=5)
+    for encoding, suffix in ENCODINGS:
+        if encoding in encoded and not os.path.exists(variant_path(etag, suffix)):
+            _write_atomic(variant_path(etag, suffix), encoded[encoding])
+    _link_atomic(variant_path(etag, ".json"), LATEST_FILE)
+    # 同じ内容の版を使い回すと mtime が古いままになる。最終更新表示と Last-Modified が
+    # 過去に戻らないよう公開時刻にそろえる
+    os.utime(LATEST_FILE)
+
+    manifest = {
+        "version": time.time_ns(),
+        "etag": etag,
+        "updated": datetime.now().isoformat(timespec="seconds"),
+        "devices": len(devices),
+        "bytes": {encoding: len(data) for encoding, data in encoded.items()},
+    }
+    config_store.save_json(MANIFEST_FILE, manifest, indent=None)
+    _prune(etag)
+    return manifest
+
+
+def _prune(current):
+    versions = {}
+    for fname in os.listdir(PUBLISH_DIR):
+        if fname.startswith(".") or fname == os.path.basename(MANIFEST_FILE):
+            continue
+        path = os.path.join(PUBLISH_DIR, fname)
+        try:
+            versions.setdefault(fname.split(".", 1)[0], []).append((os.stat(path).st_mtime, path))
+        except OSError:
+            continue
+    newest_first = sorted(versions, key=lambda etag: -max(m for m, _ in versions[etag]))
+    for etag in newest_first[KEEP_VERSIONS:]:
+        if etag == current:
+            continue
+        for _, path in versions[etag]:
+            try:
+                os.remove(path)
+            except OSError:
+                # Windows では配信中のファイルは消せない。次回に回す
+                continue
+
+
+def manifest():
+    """The current manifest, or None before the first publish (re-read only when it changes)."""
+    return config_store.load_json(MANIFEST_FILE, None)
+
+
+def choose_variant(current, accept_encodings):
+    """``(encoding, path)`` of the best published variant for a request's Accept-Encoding.
+
+    ``accept_encodings`` is werkzeug's ``request.accept_encodings``.
+    """
+    for encoding, suffix in ENCODINGS:
+        if encoding != "identity" and (encoding not in current["bytes"] or not accept_encodings[encoding]):
+            continue
+        path = variant_path(current["etag"], suffix)
+        if os.path.exists(path):
+            return encoding, path
+    return None, None
@@ -0,0 +1,154 @@
+import json
+import queue
+import logging
+import threading
+import time
+
+DEFAULT_POLL_SECONDS = 0.5
+DEFAULT_MAX_CLIENTS = 8
+DEFAULT_MAX_STREAM_SECONDS = 300
+HEARTBEAT_SECONDS = 15
+RETRY_MILLISECONDS = 3000
+QUEUE_SIZE = 16
+
+logger = logging.getLogger(__name__)
+
+
+def diff_rows(old, new):
+    """Rows of ``new`` that differ from ``old`` (keyed by id) and the ids that disappeared."""
+    changed = [row for key, row in new.items() if old.get(key) != row]
+    removed = [key for key in old if key not in new]
+    return changed, removed
+
+
+def format_event(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+class LiveFeed:
+    """Fan out snapshot changes to Server-Sent Event subscribers.
+
+    One watcher thread per process calls ``stamp_fn()`` (a cheap stat-based
+    version of the worker's snapshot) every ``poll_seconds``; only when it
+    changes does it call ``rows_fn()`` and push the changed rows to each
+    subscriber queue. Subscribers whose queue overflows are sent a full
+    snapshot instead of the deltas they missed.
+    """
+
+    def __init__(self, stamp_fn, rows_fn, poll_seconds=DEFAULT_POLL_SECONDS):
+        self.stamp_fn = stamp_fn
+        self.rows_fn = rows_fn
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._thread = None
+        self._stamp = None
+        self._rows = {}
+        self.version = 0
+
+    def _refresh(self):
+        stamp = self.stamp_fn()
+        if stamp == self._stamp:
+            return None
+        rows = {str(row.get("id")): row for row in self.rows_fn()}
+        with self._lock:
+            changed, removed = diff_rows(self._rows, rows)
+            self._stamp = stamp
+            self._rows = rows
+            if not changed and not removed:
+                return None
+            self.version += 1
+            return self.version, changed, removed
+
+    def poll(self):
+        """Check the snapshot once and hand any change to every subscriber."""
+        update = self._refresh()
+        if update is None:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(update)
+            except queue.Full:
+                # 追いつけないクライアントには次回フルスナップショットを送る
+                q.resync = True
+
+    def _watch(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error("Live feed refresh failed: %s", e)
+            time.sleep(self.poll_seconds)
+
+    def snapshot(self):
+        self.poll()
+        with self._lock:
+            return self.version, list(self._rows.values())
+
+    def subscribe(self, max_clients=DEFAULT_MAX_CLIENTS):
+        """Register a subscriber queue, or return None when ``max_clients`` are connected."""
+        with self._lock:
+            if len(self._subscribers) >= max_clients:
+                return None
+            q = queue.Queue(maxsize=QUEUE_SIZE)
+            q.resync = False
+            self._subscribers.add(q)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._watch, name="live-feed", daemon=True)
+                self._thread.start()
+            return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    @property
+    def client_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def stream(self, q, max_seconds=DEFAULT_MAX_STREAM_SECONDS):
+        """Generate the SSE byte stream for the client that got ``q`` from subscribe().
+
+        The caller subscribes first so that it can refuse the request when
+        the feed is full. The stream ends after ``max_seconds`` so an idle
+        dashboard does not hold a server thread forever; EventSource
+        reconnects by itself after ``retry`` milliseconds and gets a fresh
+        snapshot.
+        """
+        try:
+            yield f"retry: {RETRY_MILLISECONDS}\n\n".encode("utf-8")
+            sent, rows = self.snapshot()
+            yield format_event("snapshot", rows, sent)
+            deadline = time.monotonic() + max_seconds
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    version, changed, removed = q.get(timeout=min(HEARTBEAT_SECONDS, remaining))
+                except queue.Empty:
+                    yield b": ping\n\n"
+                    continue
+                if q.resync:
+                    q.resync = False
+                    sent, rows = self.snapshot()
+                    yield format_event("snapshot", rows, sent)
+                    continue
+                if version <= sent:
+                    continue
+                sent = version
+                yield format_event("delta", {"changed": changed, "removed": removed}, version)
+        finally:
+            self.unsubscribe(q)
@@ -0,0 +1,117 @@
+import os
+from collections import OrderedDict
+
+PER_DEVICE = "per_device"
+DAILY = "daily"
+LOG_FORMATS = (PER_DEVICE, DAILY)
+
+FSYNC_NEVER = "never"
+FSYNC_BATCH = "batch"
+FSYNC_POLICIES = (FSYNC_NEVER, FSYNC_BATCH)
+
+PER_DEVICE_HEADER = "timestamp,temperature,humidity,last_seen,location_id\n"
+DAILY_HEADER = "timestamp,device_id,temperature,humidity,last_seen,location_id\n"
+
+DEFAULT_MAX_OPEN = 64
+
+
+class CsvLogWriter:
+    """Buffered appender for the CSV logs in ``log_dir``.
+
+    Rows are collected with ``add()`` and written by ``flush()``: each file
+    gets its header (if new) and all of its pending rows in a single
+    O_APPEND ``os.write``, so a reader never sees half a batch. Open file
+    descriptors are kept in an LRU pool of ``max_open`` entries and, with
+    the "batch" policy, every touched file is fsync'd once per flush.
+
+    ``log_format`` selects one file per device (``<device_id>.csv``, the
+    historical layout) or one file per day holding every device
+    (``YYYY-MM-DD.csv`` with a device_id column).
+    """
+
+    def __init__(self, log_dir, log_format=PER_DEVICE, fsync=FSYNC_BATCH, max_open=DEFAULT_MAX_OPEN):
+        if log_format not in LOG_FORMATS:
+            raise ValueError(f"Unknown log_format: {log_format!r}")
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown log_fsync policy: {fsync!r}")
+        self.log_dir = log_dir
+        self.log_format = log_format
+        self.fsync = fsync
+        self.max_open = max(int(max_open), 1)
+        self._fds = OrderedDict()   # path -> (fd, is_new)
+        self._pending = {}          # path -> [line, ...]
+        os.makedirs(log_dir, exist_ok=True)
+
+    @property
+    def header(self):
+        return DAILY_HEADER if self.log_format == DAILY else PER_DEVICE_HEADER
+
+    def _path(self, device_id, timestamp):
+        if self.log_format == DAILY:
+            return os.path.join(self.log_dir, f"{timestamp[:10]}.csv")
+        return os.path.join(self.log_dir, f"{device_id}.csv")
+
+    def add(self, device_id, timestamp, temperature, humidity, last_seen, location_id):
+        """Queue one row; ``timestamp`` is the "YYYY-MM-DD HH:MM:SS" snapshot time."""
+        if self.log_format == DAILY:
+            line = f"{timestamp},{device_id},{temperature},{humidity},{last_seen},{location_id}\n"
+        else:
+            line = f"{timestamp},{temperature},{humidity},{last_seen},{location_id}\n"
+        self._pending.setdefault(self._path(device_id, timestamp), []).append(line)
+
+    def _fd(self, path):
+        entry = self._fds.get(path)
+        if entry is not None:
+            self._fds.move_to_end(path)
+            return entry[0]
+        while len(self._fds) >= self.max_open:
+            _, (old_fd, _) = self._fds.popitem(last=False)
+            os.close(old_fd)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._fds[path] = (fd, os.fstat(fd).st_size == 0)
+        return fd
+
+    def flush(self):
+        """Write every pending batch; returns ``(files_written, rows_written, failures)``."""
+        pending, self._pending = self._pending, {}
+        files = rows = 0
+        failures = []
+        for path, lines in pending.items():
+            try:
+                fd = self._fd(path)
+                is_new = self._fds[path][1]
+                data = ((self.header if is_new else "") + "".join(lines)).encode("utf-8")
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+                if is_new:
+                    self._fds[path] = (fd, False)
+                if self.fsync == FSYNC_BATCH:
+                    os.fsync(fd)
+                files += 1
+                rows += len(lines)
+            except OSError as e:
+                failures.append((path, e))
+                self._close(path)
+        return files, rows, failures
+
+    def _close(self, path):
+        entry = self._fds.pop(path, None)
+        if entry is not None:
+            try:
+                os.close(entry[0])
+            except OSError:
+                pass
+
+    def close(self):
+        for path in list(self._fds):
+            self._close(path)
+
+
+def writer_config(settings, base_dir):
+    return (
+        os.path.join(base_dir, settings.get("log_directory", "logs")),
+        settings.get("log_format", PER_DEVICE),
+        settings.get("log_fsync", FSYNC_BATCH),
+        int(settings.get("log_max_open_files", DEFAULT_MAX_OPEN)),
+    )
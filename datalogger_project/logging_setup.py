@@ -0,0 +1,237 @@
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import logging
+import threading
+import logging.handlers
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_LEVEL = "INFO"
+DEFAULT_LOG_FILE = os.path.join("logs", "datalogger.log")
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+DEFAULT_RATE_LIMIT = 20         # 同じメッセージを 1 分間に出す上限
+RATE_WINDOW_SECONDS = 60
+QUEUE_SIZE = 10000
+
+# LogRecord が最初から持つ属性。これ以外は extra= で渡された構造化フィールド
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def record_fields(record):
+    return {k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS and not k.startswith("_")}
+
+
+def _exc_text(formatter, record):
+    """Traceback text of ``record``: already rendered by the queue handler, or formatted here."""
+    if record.exc_text:
+        return record.exc_text
+    return formatter.formatException(record.exc_info) if record.exc_info else ""
+
+
+class ConsoleFormatter(logging.Formatter):
+    """``[LEVEL] logger: message key=value ...``, the same shape as the old print() lines."""
+
+    def format(self, record):
+        text = f"[{record.levelname}] {record.name}: {record.getMessage()}"
+        fields = record_fields(record)
+        if fields:
+            text += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        exc = _exc_text(self, record)
+        if exc:
+            text += "\n" + exc
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the extra= fields as top-level keys."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(record_fields(record))
+        exc = _exc_text(self, record)
+        if exc:
+            entry["exc"] = exc
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Pass at most ``limit`` records per message template and logger every RATE_WINDOW_SECONDS.
+
+    Suppressed records are counted and reported on the first record let
+    through in the next window.
+    """
+
+    def __init__(self, limit=DEFAULT_RATE_LIMIT):
+        super().__init__()
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._windows = {}   # (logger, msg) -> [window start, passed, suppressed]
+
+    def filter(self, record):
+        if self.limit <= 0 or record.levelno >= logging.ERROR:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= RATE_WINDOW_SECONDS:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if window[1] < self.limit:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the listener falls behind."""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # 標準の prepare はトレースバックを msg に埋め込んでしまうので、本文と exc_text を分けたまま渡す
+        # (exc_info そのものはスレッドをまたぐと参照が残り続けるので文字列にしておく)
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            type(self).dropped += 1
+
+
+_lock = threading.Lock()
+_listener = None
+_queue_handler = None
+_rate_filter = None
+_config = None
+
+
+def _level(value, key, problems):
+    """Upper-cased level name of ``value``; DEFAULT_LEVEL (noted in ``problems``) if logging does not know it."""
+    name = str(value).strip().upper()
+    if isinstance(logging.getLevelName(name), int):
+        return name
+    problems.append(f"{key}={value!r}")
+    return DEFAULT_LEVEL
+
+
+def _count(settings, key, default, problems):
+    try:
+        return int(settings.get(key, default))
+    except (TypeError, ValueError):
+        problems.append(f"{key}={settings.get(key)!r}")
+        return default
+
+
+def logging_config(settings, problems=None):
+    """The settings that matter to ``configure`` as a comparable tuple.
+
+    Unknown levels and non-numeric sizes fall back to their defaults and
+    are appended to ``problems`` instead of raising.
+    """
+    problems = [] if problems is None else problems
+    levels = settings.get("log_levels", {})
+    if not isinstance(levels, dict):
+        problems.append(f"log_levels={levels!r}")
+        levels = {}
+    levels = {str(name): _level(name_level, f"log_levels.{name}", problems) for name, name_level in levels.items()}
+    return (
+        _level(settings.get("log_level", DEFAULT_LEVEL), "log_level", problems),
+        json.dumps(levels, sort_keys=True),
+        os.path.join(BASE_DIR, str(settings.get("log_file", DEFAULT_LOG_FILE))),
+        _count(settings, "log_max_bytes", DEFAULT_MAX_BYTES, problems),
+        _count(settings, "log_backup_count", DEFAULT_BACKUP_COUNT, problems),
+        bool(settings.get("log_console", True)),
+        _count(settings, "log_rate_limit", DEFAULT_RATE_LIMIT, problems),
+    )
+
+
+def configure(settings=None):
+    """Install (or update) the process-wide logging setup from ``settings``.
+
+    Records go through a bounded queue to a listener thread, which writes
+    JSON lines to a size-rotated file and, unless ``log_console`` is false,
+    the bracketed console format to stderr. Calling this again with the
+    same settings does nothing, so loops can call it every cycle. Bad
+    values are replaced by their defaults with a warning; this never
+    raises, so a typo in settings.json cannot stop the loops that call it.
+    """
+    global _listener, _queue_handler, _rate_filter, _config
+    problems = []
+    config = logging_config(settings or {}, problems)
+    with _lock:
+        if config == _config:
+            return
+        level, levels, log_file, max_bytes, backup_count, console, rate_limit = config
+
+        # 古いリスナーを止めるのは新しいハンドラーが揃ってから
+        handlers = []
+        try:
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+            file_handler.setFormatter(JsonFormatter())
+            handlers.append(file_handler)
+        except (OSError, ValueError) as e:
+            sys.stderr.write(f"[ERROR] Cannot open log file {log_file}: {e}\n")
+        if console or not handlers:
+            console_handler = logging.StreamHandler(sys.stderr)
+            console_handler.setFormatter(ConsoleFormatter())
+            handlers.append(console_handler)
+
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+
+        root = logging.getLogger()
+        if _queue_handler is None:
+            _queue_handler = _NonBlockingQueueHandler(queue.Queue(QUEUE_SIZE))
+            _rate_filter = RateLimitFilter(rate_limit)
+            _queue_handler.addFilter(_rate_filter)
+            root.addHandler(_queue_handler)
+        _rate_filter.limit = rate_limit
+        root.setLevel(level)
+        for name, name_level in json.loads(levels).items():
+            logging.getLogger(name).setLevel(name_level)
+
+        _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        _config = config
+    if problems:
+        logging.getLogger(__name__).warning("Invalid logging settings replaced by defaults: %s", ", ".join(problems))
+
+
+def shutdown():
+    """Flush the queue and stop the listener thread."""
+    global _listener, _config
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+            _config = None
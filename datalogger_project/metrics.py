@@ -0,0 +1,380 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from collections import Counter as _Tally
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+METRICS_DIR = os.path.join(BASE_DIR, "run", "metrics")
+PROFILE_REQUEST_FILE = os.path.join(BASE_DIR, "run", "profile_request.json")
+PROFILE_DIR = os.path.join(BASE_DIR, "run", "profiles")
+
+EXPORT_SECONDS = 5
+STALE_SECONDS = 60          # これより古い他プロセスのファイルは集計しない
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DEFAULT_PROFILE_HZ = 100
+MAX_PROFILE_SECONDS = 600
+
+logger = logging.getLogger(__name__)
+
+
+def _label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._series = {}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._series[_label_key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, **kwargs)
+            return metric
+
+    def counter(self, name, help_text):
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name, help_text):
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets=buckets)
+
+    def dump(self):
+        """JSON-serializable copy of every series, used to share metrics between processes."""
+        result = {}
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            with metric._lock:
+                series = [[list(map(list, key)), value if not isinstance(value, list)
+                           else [list(value[0]), value[1], value[2]]]
+                          for key, value in metric._series.items()]
+            result[metric.name] = {"kind": metric.kind, "help": metric.help, "series": series,
+                                   "buckets": list(getattr(metric, "buckets", ()))}
+        return result
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+def _merge(into, dump):
+    for name, metric in dump.items():
+        target = into.setdefault(name, {"kind": metric["kind"], "help": metric["help"],
+                                        "buckets": metric.get("buckets", []), "series": {}})
+        for key, value in metric["series"]:
+            key = tuple(tuple(pair) for pair in key)
+            prev = target["series"].get(key)
+            if prev is None or metric["kind"] == "gauge":
+                target["series"][key] = value
+            elif metric["kind"] == "counter":
+                target["series"][key] = prev + value
+            else:
+                target["series"][key] = [[a + b for a, b in zip(prev[0], value[0])],
+                                         prev[1] + value[1], prev[2] + value[2]]
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def collect():
+    """This process's metrics merged with the recent dumps of other live processes."""
+    merged = {}
+    _merge(merged, REGISTRY.dump())
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        names = []
+    now = time.time()
+    for fname in names:
+        if not fname.endswith(".json"):
+            continue
+        try:
+            pid = int(fname[:-5])
+        except ValueError:
+            continue
+        if pid == os.getpid():
+            continue
+        path = os.path.join(METRICS_DIR, fname)
+        try:
+            if now - os.stat(path).st_mtime > STALE_SECONDS or not _pid_alive(pid):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                _merge(merged, json.load(f))
+        except (OSError, ValueError):
+            continue
+    return merged
+
+
+def render(merged=None):
+    """Prometheus text exposition format (version 0.0.4)."""
+    merged = collect() if merged is None else merged
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        for key in sorted(metric["series"]):
+            value = metric["series"][key]
+            if metric["kind"] != "histogram":
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+                continue
+            counts, count, total = value
+            for bound, n in zip(metric["buckets"], counts):
+                lines.append(f"{name}_bucket{_format_labels(key + (('le', _format_value(float(bound))),))} {n}")
+            lines.append(f"{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_format_labels(key)} {_format_value(float(total))}")
+            lines.append(f"{name}_count{_format_labels(key)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+# ---- プロセス間共有 ----
+
+def export():
+    """Write this process's metrics to run/metrics/<pid>.json (temp file + rename)."""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(REGISTRY.dump(), f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    # 終了したプロセスのファイルを片付ける
+    for fname in os.listdir(METRICS_DIR):
+        other = os.path.join(METRICS_DIR, fname)
+        try:
+            if time.time() - os.stat(other).st_mtime > STALE_SECONDS * 10:
+                os.remove(other)
+        except OSError:
+            continue
+
+
+_exporter = None
+
+
+def start_exporter(interval=EXPORT_SECONDS):
+    """Start the background thread that shares metrics and watches for profiling requests (once per process)."""
+    global _exporter
+    if _exporter is not None:
+        return _exporter
+
+    def loop():
+        while True:
+            try:
+                export()
+                check_profile_request()
+            except Exception as e:
+                logger.warning("Metrics export failed: %s", e)
+            time.sleep(interval)
+
+    _exporter = threading.Thread(target=loop, name="metrics-exporter", daemon=True)
+    _exporter.start()
+    return _exporter
+
+
+# ---- サンプリングプロファイラ ----
+
+class SamplingProfiler:
+    """Sample every thread's stack ``hz`` times a second for ``seconds``.
+
+    The result is written as collapsed stacks (``frame;frame;frame count``,
+    the input format of flamegraph.pl / speedscope) to ``PROFILE_DIR``.
+    Sampling only reads ``sys._current_frames()``, so it can be switched
+    on in a running process.
+    """
+
+    def __init__(self, seconds=30, hz=DEFAULT_PROFILE_HZ):
+        self.seconds = min(float(seconds), MAX_PROFILE_SECONDS)
+        self.interval = 1.0 / max(int(hz), 1)
+        self.stacks = _Tally()
+        self.samples = 0
+        self.path = None
+        self._thread = None
+
+    def _sample(self):
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        deadline = time.monotonic() + self.seconds
+        while time.monotonic() < deadline:
+            self._sample()
+            time.sleep(self.interval)
+        self.write()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        logger.info("Sampling profiler running for %ss in pid %d", self.seconds, os.getpid())
+        return self
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def write(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        self.path = os.path.join(PROFILE_DIR, f"profile-{os.getpid()}-{stamp}.txt")
+        with open(self.path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info("Profile written to %s (%d samples)", self.path, self.samples)
+        return self.path
+
+
+_profiler = None
+_profile_seen = None
+_profile_checked = False
+
+
+def start_profiler(seconds=30, hz=DEFAULT_PROFILE_HZ):
+    """Start a sampling profile in this process unless one is already running."""
+    global _profiler
+    if _profiler is not None and _profiler.running:
+        return _profiler
+    _profiler = SamplingProfiler(seconds, hz).start()
+    return _profiler
+
+
+def current_profiler():
+    return _profiler
+
+
+def request_profile(seconds=30, hz=DEFAULT_PROFILE_HZ, pid=None):
+    """Ask other processes (or only ``pid``) to profile themselves; they pick it up within EXPORT_SECONDS."""
+    global _profile_seen, _profile_checked
+    os.makedirs(os.path.dirname(PROFILE_REQUEST_FILE), exist_ok=True)
+    request = {"id": time.time(), "pid": pid, "seconds": seconds, "hz": hz}
+    tmp_path = PROFILE_REQUEST_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(request, f)
+    os.replace(tmp_path, PROFILE_REQUEST_FILE)
+    # 要求を出したプロセス自身は必要なら直接 start_profiler() を呼ぶ
+    _profile_seen, _profile_checked = request["id"], True
+    return request
+
+
+def check_profile_request():
+    global _profile_seen, _profile_checked
+    try:
+        with open(PROFILE_REQUEST_FILE, "r", encoding="utf-8") as f:
+            request = json.load(f)
+    except (OSError, ValueError):
+        request = {}
+    if not _profile_checked:
+        # 起動前からあった要求には反応しない
+        _profile_checked = True
+        _profile_seen = request.get("id")
+        return
+    if not request or request.get("id") == _profile_seen:
+        return
+    _profile_seen = request.get("id")
+    if request.get("pid") in (None, os.getpid()):
+        start_profiler(request.get("seconds", 30), request.get("hz", DEFAULT_PROFILE_HZ))
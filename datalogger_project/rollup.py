@@ -0,0 +1,443 @@
+import os
+import math
+import time
+import logging
+from datetime import date, datetime, timedelta
+
+import alerts
+import config_store
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROLLUP_FILE = os.path.join(BASE_DIR, "run", "rollup.json")
+
+LAST_SEEN_FORMAT = "%Y-%m-%d %H:%M:%S"
+FORMAT_VERSION = 1
+FIELDS = ("temperature", "humidity")
+
+DEFAULT_DAYS = 14               # 日別の集計を残す日数
+DEFAULT_HALF_LIFE_MINUTES = 60  # EWMA の半減期
+DEFAULT_SAVE_SECONDS = 60       # 状態ファイルを書き出す最短間隔
+TREND_HOURS = 24
+MAX_GAP_SECONDS = 30 * 60       # これ以上空いた読み取りの間は範囲外時間に数えない
+SEED_HOURS = 24                 # 状態ファイルがないとき、ストアから取り込む範囲
+
+READINGS = metrics.counter("datalogger_rollup_readings_total", "Readings folded into the rolling aggregates")
+SAVE_SECONDS = metrics.histogram("datalogger_rollup_save_seconds", "Time to write the rolling aggregates")
+
+
+def _epoch(last_seen):
+    """Epoch of a ``last_seen``: the store keeps it as a number, snapshots as a string."""
+    if not last_seen or isinstance(last_seen, bool):
+        return None
+    if isinstance(last_seen, (int, float)):
+        return float(last_seen)
+    try:
+        return datetime.strptime(str(last_seen), LAST_SEEN_FORMAT).timestamp()
+    except ValueError:
+        return None
+
+
+def _round(value, digits=4):
+    return round(value, digits) if value is not None else None
+
+
+def _number(value):
+    if value is None or value == "" or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def band(rule, field):
+    """``(low, high)`` limits for ``field`` from an alert rule; either may be None."""
+    return _number(rule.get(f"{field}_min")), _number(rule.get(f"{field}_max"))
+
+
+def _outside(value, limits):
+    low, high = limits
+    return (low is not None and value < low) or (high is not None and value > high)
+
+
+class Series:
+    """Running statistics of one value stream, each reading folded in O(1).
+
+    Keeps Welford's mean/variance with min/max since the first reading, a
+    time-weighted EWMA, daily buckets (count, mean, M2, min, max and
+    seconds out of band) for ``days`` days and hourly buckets (count, sum,
+    min, max) for the last TREND_HOURS hours.
+    """
+
+    __slots__ = ("n", "mean", "m2", "min", "max", "ewma", "ewma_at", "days", "hours")
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.ewma = None
+        self.ewma_at = None
+        self.days = {}    # "YYYY-MM-DD" -> [n, mean, m2, min, max, out_of_band_seconds]
+        self.hours = {}   # epoch // 3600 -> [n, sum, min, max]
+
+    def add(self, value, epoch, half_life, days_kept):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+        if self.ewma is None:
+            self.ewma, self.ewma_at = value, epoch
+        elif epoch > self.ewma_at:
+            # 読み取り間隔が不揃いでも重みが時間に比例するよう、経過時間から係数を決める
+            alpha = 1.0 - 0.5 ** ((epoch - self.ewma_at) / half_life)
+            self.ewma += alpha * (value - self.ewma)
+            self.ewma_at = epoch
+
+        day = self._day(epoch, days_kept)
+        if day is not None:
+            day[0] += 1
+            delta = value - day[1]
+            day[1] += delta / day[0]
+            day[2] += delta * (value - day[1])
+            day[3] = value if day[3] is None else min(day[3], value)
+            day[4] = value if day[4] is None else max(day[4], value)
+
+        hour = int(epoch // 3600)
+        bucket = self.hours.get(hour)
+        if bucket is None:
+            if hour <= max(self.hours, default=hour) - TREND_HOURS:
+                return
+            bucket = self.hours[hour] = [0, 0.0, value, value]
+            for old in [h for h in self.hours if h <= hour - TREND_HOURS]:
+                del self.hours[old]
+        bucket[0] += 1
+        bucket[1] += value
+        bucket[2] = min(bucket[2], value)
+        bucket[3] = max(bucket[3], value)
+
+    def add_out_of_band(self, seconds, epoch, days_kept):
+        day = self._day(epoch, days_kept)
+        if day is not None:
+            day[5] += seconds
+
+    def _day(self, epoch, days_kept):
+        key = date.fromtimestamp(epoch).isoformat()
+        day = self.days.get(key)
+        if day is None:
+            day = self.days[key] = [0, 0.0, 0.0, None, None, 0.0]
+            # 新しい日ができたときだけ古い日を落とすので、読み取りごとの処理は定数時間のまま
+            while len(self.days) > days_kept:
+                del self.days[min(self.days)]
+            day = self.days.get(key)
+        return day
+
+    def to_list(self):
+        return [self.n, _round(self.mean), _round(self.m2), self.min, self.max, _round(self.ewma), self.ewma_at,
+                {k: [d[0], _round(d[1]), _round(d[2]), d[3], d[4], round(d[5])] for k, d in self.days.items()},
+                {str(h): [b[0], _round(b[1]), b[2], b[3]] for h, b in self.hours.items()}]
+
+    @classmethod
+    def from_list(cls, data):
+        series = cls()
+        (series.n, series.mean, series.m2, series.min, series.max, series.ewma, series.ewma_at,
+         days, hours) = data
+        series.days = {k: list(d) for k, d in sorted(days.items())}
+        series.hours = {int(h): list(b) for h, b in hours.items()}
+        return series
+
+    def summary(self, now=None, days=7):
+        """Lifetime, today, last-24h and per-day statistics as plain numbers for JSON."""
+        now = now or time.time()
+        today = date.fromtimestamp(now).isoformat()
+        daily = [_day_summary(key, d) for key, d in sorted(self.days.items(), reverse=True)[:days]]
+        return {
+            "count": self.n,
+            "mean": _round(self.mean, 2) if self.n else None,
+            "std": _round(math.sqrt(max(self.m2, 0.0) / (self.n - 1)), 3) if self.n > 1 else None,
+            "min": self.min,
+            "max": self.max,
+            "ewma": _round(self.ewma, 2),
+            "today": daily[0] if daily and daily[0]["date"] == today else None,
+            "last_24h": self._last_24h(now),
+            "days": daily,
+        }
+
+    def _last_24h(self, now):
+        current = int(now // 3600)
+        buckets = sorted((h, b) for h, b in self.hours.items() if h > current - TREND_HOURS and b[0])
+        if not buckets:
+            return None
+        count = sum(b[0] for _, b in buckets)
+        return {
+            "count": count,
+            "mean": round(sum(b[1] for _, b in buckets) / count, 2),
+            "min": min(b[2] for _, b in buckets),
+            "max": max(b[3] for _, b in buckets),
+            "trend_per_hour": _slope([(h, b[1] / b[0]) for h, b in buckets]),
+        }
+
+
+def _day_summary(key, day):
+    n, mean, m2, low, high, out = day
+    return {
+        "date": key,
+        "count": n,
+        "mean": round(mean, 2) if n else None,
+        "std": round(math.sqrt(max(m2, 0.0) / (n - 1)), 3) if n > 1 else None,
+        "min": low,
+        "max": high,
+        "out_of_band_seconds": round(out),
+    }
+
+
+def _slope(points):
+    """Least-squares slope of ``(hour, mean)`` points, per hour; None with fewer than two hours."""
+    if len(points) < 2:
+        return None
+    mx = sum(x for x, _ in points) / len(points)
+    my = sum(y for _, y in points) / len(points)
+    sxx = sum((x - mx) ** 2 for x, _ in points)
+    return round(sum((x - mx) * (y - my) for x, y in points) / sxx, 3)
+
+
+class _Device:
+    __slots__ = ("loc", "last", "out", "series")
+
+    def __init__(self):
+        self.loc = None
+        self.last = 0.0
+        self.out = {field: False for field in FIELDS}
+        self.series = {field: Series() for field in FIELDS}
+
+
+class _Location:
+    __slots__ = ("last", "out", "series")
+
+    def __init__(self):
+        self.last = 0.0
+        self.out = {field: 0 for field in FIELDS}   # 範囲外の機器の台数
+        self.series = {field: Series() for field in FIELDS}
+
+
+class Rollup:
+    """Per-device and per-location (``location_id``) streaming aggregates of the readings.
+
+    Only readings with a new ``last_seen`` are counted, so the statistics
+    weigh each reported value once however often it is polled. Time out of
+    band uses the alert rules' ``*_min``/``*_max`` limits without
+    hysteresis: a device is out of band from a reading outside the limits
+    until its next reading back inside (gaps over MAX_GAP_SECONDS are not
+    counted), and a location is out of band while any of its devices is.
+    The state is saved compactly to ``path`` and reloaded on start.
+    """
+
+    def __init__(self, path=ROLLUP_FILE):
+        self.path = path
+        self.devices = {}
+        self.locations = {}
+        self.since = datetime.now().isoformat(timespec="seconds")
+        self.dirty = False
+        self.saved_at = 0.0
+        state = config_store.load_json(path, None)
+        if state and state.get("version") == FORMAT_VERSION:
+            self._load(state)
+
+    def update(self, devices, rules, now=None, days_kept=DEFAULT_DAYS,
+               half_life=DEFAULT_HALF_LIFE_MINUTES * 60):
+        """Fold one snapshot (with ``location_id`` filled in) into the aggregates; returns the new readings."""
+        resolved = alerts.resolve_rules(rules)
+        fresh = 0
+        for d in devices:
+            if d.get("stale"):
+                continue
+            sn = str(d.get("id"))
+            if not d.get("online"):
+                device = self.devices.get(sn)
+                if device is not None:
+                    self._set_out(device, {field: False for field in FIELDS})
+                continue
+            epoch = _epoch(d.get("last_seen"))
+            if epoch is None:
+                continue
+            device = self.devices.get(sn)
+            if device is None:
+                device = self.devices[sn] = _Device()
+            if epoch <= device.last:
+                continue
+            self._add(device, d.get("location_id") or None, epoch, d, resolved, days_kept, half_life)
+            fresh += 1
+        if fresh:
+            self.dirty = True
+            READINGS.inc(fresh)
+        return fresh
+
+    def _add(self, device, loc_id, epoch, values, resolved, days_kept, half_life):
+        if device.loc != loc_id:
+            self._set_out(device, {field: False for field in FIELDS})
+            device.loc = loc_id
+        location = None
+        if loc_id:
+            location = self.locations.get(loc_id)
+            if location is None:
+                location = self.locations[loc_id] = _Location()
+            gap = epoch - location.last
+            if 0 < gap <= MAX_GAP_SECONDS:
+                for field in FIELDS:
+                    if location.out[field]:
+                        location.series[field].add_out_of_band(gap, epoch, days_kept)
+            location.last = max(location.last, epoch)
+
+        gap = epoch - device.last
+        if device.last and gap <= MAX_GAP_SECONDS:
+            for field in FIELDS:
+                if device.out[field]:
+                    device.series[field].add_out_of_band(gap, epoch, days_kept)
+        device.last = epoch
+
+        rule = resolved.get(loc_id, resolved[None])
+        out = dict(device.out)
+        for field in FIELDS:
+            value = _number(values.get(field))
+            if value is None:
+                continue
+            device.series[field].add(value, epoch, half_life, days_kept)
+            if location is not None:
+                location.series[field].add(value, epoch, half_life, days_kept)
+            out[field] = _outside(value, band(rule, field))
+        self._set_out(device, out)
+
+    def _set_out(self, device, out):
+        location = self.locations.get(device.loc) if device.loc else None
+        for field, now_out in out.items():
+            if now_out != device.out[field]:
+                device.out[field] = now_out
+                if location is not None:
+                    location.out[field] = max(location.out[field] + (1 if now_out else -1), 0)
+
+    def seed(self, store, hours=SEED_HOURS, days_kept=DEFAULT_DAYS):
+        """Backfill from the last ``hours`` of ``store`` using the current assignments; returns the readings read."""
+        assignments = config_store.get_assignments()
+        rules = config_store.get_alert_rules()
+        end = datetime.now()
+        count = 0
+        for chunk in store.iter_readings(end - timedelta(hours=hours), end):
+            self.update([{"id": sn, "temperature": t, "humidity": h, "online": online, "last_seen": last_seen,
+                          "location_id": assignments.get(sn)}
+                         for sn, _, _, t, h, online, last_seen in chunk], rules, days_kept=days_kept)
+            count += len(chunk)
+        return count
+
+    def _load(self, state):
+        self.since = state.get("since") or self.since
+        for sn, (loc, last, out, series) in state.get("devices", {}).items():
+            device = self.devices[sn] = _Device()
+            device.loc, device.last = loc, last
+            device.out = dict(zip(FIELDS, map(bool, out)))
+            device.series = dict(zip(FIELDS, map(Series.from_list, series)))
+        for loc_id, (last, out, series) in state.get("locations", {}).items():
+            location = self.locations[loc_id] = _Location()
+            location.last = last
+            location.out = dict(zip(FIELDS, out))
+            location.series = dict(zip(FIELDS, map(Series.from_list, series)))
+
+    def state(self):
+        return {
+            "version": FORMAT_VERSION,
+            "since": self.since,
+            "updated": datetime.now().isoformat(timespec="seconds"),
+            "fields": list(FIELDS),
+            "devices": {sn: [d.loc, d.last, [int(d.out[f]) for f in FIELDS], [d.series[f].to_list() for f in FIELDS]]
+                        for sn, d in self.devices.items()},
+            "locations": {loc_id: [loc.last, [loc.out[f] for f in FIELDS], [loc.series[f].to_list() for f in FIELDS]]
+                          for loc_id, loc in self.locations.items()},
+        }
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with SAVE_SECONDS.time():
+            config_store.save_json(self.path, self.state(), indent=None)
+        self.dirty = False
+        self.saved_at = time.monotonic()
+
+
+_rollup = None
+
+
+def get_rollup():
+    global _rollup
+    if _rollup is None:
+        _rollup = Rollup()
+    return _rollup
+
+
+def seed(store):
+    """Backfill the worker's aggregates from the store when no saved state exists yet."""
+    rollup = get_rollup()
+    if rollup.devices:
+        return 0
+    count = rollup.seed(store, days_kept=int(config_store.get_settings().get("rollup_days", DEFAULT_DAYS)))
+    if rollup.dirty:
+        rollup.save()
+    return count
+
+
+def process(devices, settings):
+    """Fold ``devices`` into the worker's aggregates, saving at most every ``rollup_save_seconds``."""
+    rollup = get_rollup()
+    fresh = rollup.update(devices, config_store.get_alert_rules(),
+                          days_kept=int(settings.get("rollup_days", DEFAULT_DAYS)),
+                          half_life=float(settings.get("rollup_half_life_minutes", DEFAULT_HALF_LIFE_MINUTES)) * 60)
+    # 毎サイクル全体を書き直すと重いので間引く。落ちた場合に失うのは最後の保存以降の分だけ
+    if rollup.dirty and time.monotonic() - rollup.saved_at >= float(
+            settings.get("rollup_save_seconds", DEFAULT_SAVE_SECONDS)):
+        rollup.save()
+    return fresh
+
+
+def flush():
+    if _rollup is not None and _rollup.dirty:
+        _rollup.save()
+
+
+def load_state(path=ROLLUP_FILE):
+    """The worker's last saved aggregates (see Rollup.state), or None."""
+    state = config_store.load_json(path, None)
+    return state if state and state.get("version") == FORMAT_VERSION else None
+
+
+def _summaries(series, now, days):
+    return {field: Series.from_list(data).summary(now, days) for field, data in zip(FIELDS, series)}
+
+
+def device_summary(state, sn, now=None, days=7):
+    entry = state["devices"].get(str(sn))
+    if entry is None:
+        return None
+    loc, last, out, series = entry
+    return dict(_summaries(series, now, days), id=str(sn), location_id=loc,
+                last_reading=datetime.fromtimestamp(last).strftime(LAST_SEEN_FORMAT),
+                out_of_band=dict(zip(FIELDS, map(bool, out))))
+
+
+def location_summaries(state, locations, rules, now=None, days=7):
+    """``[{name, location_id, band, devices_out_of_band, temperature, humidity}]`` per named location."""
+    resolved = alerts.resolve_rules(rules)
+    rows = []
+    for loc_id, (last, out, series) in state["locations"].items():
+        name = locations.get(loc_id)
+        if not name:
+            continue
+        rule = resolved.get(loc_id, resolved[None])
+        rows.append(dict(_summaries(series, now, days), name=name, location_id=loc_id,
+                         band={field: band(rule, field) for field in FIELDS},
+                         devices_out_of_band=dict(zip(FIELDS, out))))
+    rows.sort(key=lambda row: row["name"])
+    return rows
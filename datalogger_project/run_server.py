@@ -1,6 +1,21 @@
+import logging
+
 from waitress import serve
-from wsgi import app
+
+import config_store
+import logging_setup
+
+
+def server_threads(settings):
+    # /stream の接続がスレッドを占有するので、その上限分を通常リクエスト用に上乗せする
+    return int(settings.get("server_threads", 8)) + int(settings.get("stream_max_clients", 8))
+
 
 if __name__ == "__main__":
-    print("Starting Waitress server on port 8000...")
-    serve(app, host="0.0.0.0", port=8000)
+    from wsgi import app
+
+    settings = config_store.get_settings()
+    logging_setup.configure(settings)
+    threads = server_threads(settings)
+    logging.getLogger("run_server").info("Starting Waitress server on port 8000 with %d threads", threads)
+    serve(app, host="0.0.0.0", port=8000, threads=threads)
@@ -0,0 +1,817 @@
+import os
+import sys
+import json
+import bisect
+import logging
+import itertools
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STORE_DIR = os.path.join(BASE_DIR, "store")
+
+META_FILE = "meta.sqlite"
+SEGMENT_PREFIX = "seg_"
+SEGMENT_SUFFIX = ".sqlite"
+SEGMENT_FORMAT = "%Y%m%d"
+LAST_SEEN_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+logger = logging.getLogger(__name__)
+
+META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    id INTEGER PRIMARY KEY,
+    sn TEXT NOT NULL UNIQUE,
+    name TEXT,
+    location_id TEXT,
+    warehouse TEXT,
+    first_seen INTEGER,
+    last_seen INTEGER,
+    account TEXT
+);
+"""
+
+SEGMENT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    ts INTEGER PRIMARY KEY,
+    devices INTEGER NOT NULL,
+    keyframe INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS removed (
+    ts INTEGER NOT NULL,
+    device INTEGER NOT NULL,
+    PRIMARY KEY (ts, device)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS readings (
+    ts INTEGER NOT NULL,
+    device INTEGER NOT NULL,
+    temperature REAL,
+    humidity REAL,
+    online INTEGER NOT NULL,
+    last_seen INTEGER,
+    PRIMARY KEY (ts, device)
+) WITHOUT ROWID;
+"""
+
+# Per-minute and per-hour rollups maintained on append so history queries
+# over long ranges read a few thousand rows instead of every reading.
+ROLLUPS = (("rollup_minute", 60), ("rollup_hour", 3600))
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    bucket INTEGER NOT NULL,
+    device INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    online INTEGER NOT NULL,
+    t_n INTEGER NOT NULL,
+    t_min REAL,
+    t_max REAL,
+    t_sum REAL NOT NULL,
+    h_n INTEGER NOT NULL,
+    h_min REAL,
+    h_max REAL,
+    h_sum REAL NOT NULL,
+    PRIMARY KEY (bucket, device)
+) WITHOUT ROWID;
+"""
+ROLLUP_UPSERT = """
+INSERT INTO {table} VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (bucket, device) DO UPDATE SET
+    n = n + 1,
+    online = online + excluded.online,
+    t_n = t_n + excluded.t_n,
+    t_min = min(coalesce(t_min, excluded.t_min), coalesce(excluded.t_min, t_min)),
+    t_max = max(coalesce(t_max, excluded.t_max), coalesce(excluded.t_max, t_max)),
+    t_sum = t_sum + excluded.t_sum,
+    h_n = h_n + excluded.h_n,
+    h_min = min(coalesce(h_min, excluded.h_min), coalesce(excluded.h_min, h_min)),
+    h_max = max(coalesce(h_max, excluded.h_max), coalesce(excluded.h_max, h_max)),
+    h_sum = h_sum + excluded.h_sum
+"""
+ROLLUP_BACKFILL = """
+INSERT OR REPLACE INTO {table}
+SELECT (ts / {width}) * {width}, device, COUNT(*), SUM(online),
+       COUNT(temperature), MIN(temperature), MAX(temperature), TOTAL(temperature),
+       COUNT(humidity), MIN(humidity), MAX(humidity), TOTAL(humidity)
+FROM readings GROUP BY 1, 2
+"""
+SEGMENT_VERSION = 2
+
+# 差分スナップショットの間に全件を書き直す間隔 (サイクル数)
+DEFAULT_KEYFRAME_EVERY = 60
+EXPORT_CHUNK_ROWS = 5000
+REGISTRY_TOUCH_SECONDS = 300    # 機器一覧の last_seen はこの間隔でだけ更新する
+
+BUCKET_COLUMNS = ("t", "count", "online_ratio",
+                  "temperature_min", "temperature_max", "temperature_mean",
+                  "humidity_min", "humidity_max", "humidity_mean")
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    # 1 サイクル分の行は 1KB 程度なので小さいページで WAL への書き込み量を抑える
+    conn.execute("PRAGMA page_size=1024")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA journal_size_limit=1048576")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_epoch(value):
+    if not value:
+        return None
+    try:
+        return int(datetime.strptime(value, LAST_SEEN_FORMAT).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+def _format_epoch(epoch):
+    return datetime.fromtimestamp(epoch).strftime(LAST_SEEN_FORMAT) if epoch else ""
+
+
+def _format_value(value, offline_value):
+    return offline_value if value is None else repr(value)
+
+
+def _merge_buckets(a, b):
+    def lo(x, y):
+        return y if x is None else x if y is None else min(x, y)
+
+    def hi(x, y):
+        return y if x is None else x if y is None else max(x, y)
+
+    return (a[0], a[1], a[2] + b[2], a[3] + b[3],
+            a[4] + b[4], lo(a[5], b[5]), hi(a[6], b[6]), a[7] + b[7],
+            a[8] + b[8], lo(a[9], b[9]), hi(a[10], b[10]), a[11] + b[11])
+
+
+def _finish_buckets(rows):
+    merged = {}
+    for row in rows:
+        prev = merged.get(row[1])
+        merged[row[1]] = row if prev is None else _merge_buckets(prev, row)
+    finished = []
+    for bucket in sorted(merged):
+        dev_id, _, n, online, t_n, t_min, t_max, t_sum, h_n, h_min, h_max, h_sum = merged[bucket]
+        finished.append((dev_id, bucket, n, round(online / n, 3) if n else None,
+                         t_min, t_max, round(t_sum / t_n, 2) if t_n else None,
+                         h_min, h_max, round(h_sum / h_n, 2) if h_n else None))
+    return finished
+
+
+def parse_timestamp_from_filename(filename):
+    try:
+        name_part = filename.replace("device_cache_", "").replace(".json", "")
+        return datetime.strptime(name_part, '%Y%m%d%H%M%S')
+    except Exception:
+        return None
+
+
+class TimeSeriesStore:
+    """Append-only store of per-device readings, one SQLite segment per day.
+
+    Device metadata (serial, name, location, first/last time listed) is
+    interned once in meta.sqlite, which doubles as the device registry;
+    each segment holds ``(ts, device, temperature, humidity, online,
+    last_seen)`` rows plus a ``snapshots`` table listing every cycle
+    timestamp. Rows are only written for devices whose reading changed,
+    against a full keyframe every ``keyframe_every`` cycles and at the start
+    of each day, so a segment can always be replayed on its own. Retention
+    drops whole segment files.
+    """
+
+    def __init__(self, root=STORE_DIR, keyframe_every=DEFAULT_KEYFRAME_EVERY):
+        self.root = root
+        self.keyframe_every = max(int(keyframe_every), 1)
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.RLock()
+        self._meta = _connect(os.path.join(root, META_FILE))
+        self._meta.executescript(META_SCHEMA)
+        self._segments = {}
+        self._days = (None, [])      # (store dir mtime_ns, sorted segment days)
+        self._times = []             # sorted snapshot epochs across all segments
+        self._indexed = {}           # day -> (PRAGMA data_version, highest indexed epoch)
+        self._devices = {}      # sn -> (id, name, location_id, warehouse, account)
+        self._device_rows = {}  # id -> (sn, name, location_id, warehouse, account)
+        self._seen = {}         # id -> 機器一覧に書いた last_seen
+        self._last = {}         # 直前に append した状態: id -> (temperature, humidity, online, last_seen)
+        self._segment_last = {}  # id -> 当日のセグメントにある最新の行 (集計に数える「新しい読み取り」の判定用)
+        self._delta_day = None
+        self._delta_epoch = -1
+        self._since_keyframe = 0
+        self._upgrade_meta()
+        self._load_devices()
+
+    # -- metadata ---------------------------------------------------------
+
+    def _upgrade_meta(self):
+        columns = [row[1] for row in self._meta.execute("PRAGMA table_info(devices)")]
+        if "account" not in columns:
+            with self._meta:
+                self._meta.execute("ALTER TABLE devices ADD COLUMN account TEXT")
+        if "first_seen" in columns:
+            return
+        with self._meta:
+            self._meta.execute("ALTER TABLE devices ADD COLUMN first_seen INTEGER")
+            self._meta.execute("ALTER TABLE devices ADD COLUMN last_seen INTEGER")
+        # 既存の機器は保持しているセグメントから初出・最終時刻を埋める
+        for day in self.segment_days():
+            conn = _connect(self._segment_path(day))
+            try:
+                spans = conn.execute("SELECT device, MIN(ts), MAX(ts) FROM readings GROUP BY device").fetchall()
+            except sqlite3.Error:
+                spans = []
+            finally:
+                conn.close()
+            with self._meta:
+                self._meta.executemany(
+                    "UPDATE devices SET first_seen = COALESCE(first_seen, ?), "
+                    "last_seen = MAX(COALESCE(last_seen, 0), ?) WHERE id = ?",
+                    [(first, last, dev_id) for dev_id, first, last in spans])
+
+    def _load_devices(self):
+        for dev_id, sn, name, loc_id, warehouse, account, last_seen in self._meta.execute(
+                "SELECT id, sn, name, location_id, warehouse, account, last_seen FROM devices"):
+            self._devices[sn] = (dev_id, name, loc_id, warehouse, account)
+            self._device_rows[dev_id] = (sn, name, loc_id, warehouse, account)
+            self._seen[dev_id] = max(self._seen.get(dev_id) or 0, last_seen or 0)
+
+    def _intern(self, device):
+        sn = str(device["id"])
+        meta = (device.get("name"), device.get("location_id"), device.get("warehouse"), device.get("account"))
+        known = self._devices.get(sn)
+        if known is None:
+            # 画面からの一覧更新 (register) が別プロセスで先に登録していることがある
+            self._meta.execute("INSERT OR IGNORE INTO devices (sn) VALUES (?)", (sn,))
+            dev_id = self._meta.execute("SELECT id FROM devices WHERE sn = ?", (sn,)).fetchone()[0]
+            self._meta.execute(
+                "UPDATE devices SET name = ?, location_id = ?, warehouse = ?, account = ? WHERE id = ?",
+                meta + (dev_id,))
+        elif known[1:] != meta:
+            dev_id = known[0]
+            self._meta.execute(
+                "UPDATE devices SET name = ?, location_id = ?, warehouse = ?, account = ? WHERE id = ?",
+                meta + (dev_id,))
+        else:
+            return known[0]
+        self._devices[sn] = (dev_id,) + meta
+        self._device_rows[dev_id] = (sn,) + meta
+        return dev_id
+
+    def _touch(self, dev_ids, epoch):
+        """Record that ``dev_ids`` were listed at ``epoch`` (at most every REGISTRY_TOUCH_SECONDS per device)."""
+        stale = [dev_id for dev_id in dev_ids if epoch - (self._seen.get(dev_id) or 0) >= REGISTRY_TOUCH_SECONDS]
+        if stale:
+            self._meta.executemany(
+                "UPDATE devices SET first_seen = COALESCE(first_seen, ?), last_seen = ? WHERE id = ?",
+                [(epoch, epoch, dev_id) for dev_id in stale])
+            for dev_id in stale:
+                self._seen[dev_id] = epoch
+
+    def register(self, devices, ts):
+        """Add devices missing from the registry (e.g. found by a manual refresh); returns the new ones."""
+        epoch = int(ts.timestamp())
+        added = []
+        with self._lock, self._meta:
+            for device in devices:
+                sn = str(device["id"])
+                cur = self._meta.execute(
+                    "INSERT OR IGNORE INTO devices (sn, name, account, first_seen, last_seen) VALUES (?, ?, ?, ?, ?)",
+                    (sn, device.get("name"), device.get("account"), epoch, epoch))
+                if cur.rowcount:
+                    added.append(device)
+        if added:
+            with self._lock:
+                self._load_devices()
+        return added
+
+    def registry(self):
+        """Every device ever listed: ``[{"id", "name", "account", "first_seen", "last_seen"}]`` ordered by serial."""
+        with self._lock:
+            rows = self._meta.execute(
+                "SELECT sn, name, account, first_seen, last_seen FROM devices ORDER BY sn").fetchall()
+        return [{"id": sn, "name": name or "", "account": account or "",
+                 "first_seen": _format_epoch(first), "last_seen": _format_epoch(last)}
+                for sn, name, account, first, last in rows]
+
+    def device_ids(self, serials):
+        """Map device serial numbers to interned ids, skipping unknown ones."""
+        with self._lock:
+            if any(str(sn) not in self._devices for sn in serials):
+                self._load_devices()
+            return {str(sn): self._devices[str(sn)][0] for sn in serials if str(sn) in self._devices}
+
+    def _device_row(self, dev_id):
+        row = self._device_rows.get(dev_id)
+        if row is None:
+            self._load_devices()
+            row = self._device_rows.get(dev_id, (str(dev_id), None, None, None, None))
+        return row
+
+    # -- segments ---------------------------------------------------------
+
+    def _segment_path(self, day):
+        return os.path.join(self.root, f"{SEGMENT_PREFIX}{day}{SEGMENT_SUFFIX}")
+
+    def segment_bytes(self, day):
+        """On-disk size of ``day``'s segment including its WAL."""
+        total = 0
+        for suffix in ("", "-wal"):
+            try:
+                total += os.stat(self._segment_path(day) + suffix).st_size
+            except OSError:
+                pass
+        return total
+
+    def segment_days(self):
+        # ディレクトリの mtime が変わったとき (セグメントの追加・削除) だけ listdir する
+        mtime = os.stat(self.root).st_mtime_ns
+        if self._days[0] != mtime:
+            days = []
+            for fname in os.listdir(self.root):
+                if fname.startswith(SEGMENT_PREFIX) and fname.endswith(SEGMENT_SUFFIX):
+                    days.append(fname[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            self._days = (mtime, sorted(days))
+        return list(self._days[1])
+
+    def _segment(self, day, create=False):
+        path = self._segment_path(day)
+        conn = self._segments.get(day)
+        if conn is not None and not os.path.exists(path):
+            # 別プロセスの保持期間処理で削除済み
+            conn.close()
+            del self._segments[day]
+            conn = None
+        if conn is None:
+            if not create and not os.path.exists(path):
+                return None
+            conn = _connect(path)
+            conn.executescript(SEGMENT_SCHEMA)
+            if conn.execute("PRAGMA user_version").fetchone()[0] < SEGMENT_VERSION:
+                self._upgrade_segment(conn)
+            self._segments[day] = conn
+        return conn
+
+    def _upgrade_segment(self, conn):
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        with conn:
+            if version < 1:
+                # 集計テーブル導入前のセグメントは既存の readings から作り直す
+                for table, width in ROLLUPS:
+                    conn.execute(ROLLUP_SCHEMA.format(table=table))
+                    conn.execute(ROLLUP_BACKFILL.format(table=table, width=width))
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(snapshots)")]
+            if "keyframe" not in columns:
+                # 差分導入前のスナップショットはすべて全件 (キーフレーム) として扱える
+                conn.execute("ALTER TABLE snapshots ADD COLUMN keyframe INTEGER NOT NULL DEFAULT 1")
+            conn.execute(f"PRAGMA user_version={SEGMENT_VERSION}")
+
+    def _days_between(self, start, end):
+        days = self.segment_days()
+        if start is not None:
+            days = [d for d in days if d >= start.strftime(SEGMENT_FORMAT)]
+        if end is not None:
+            days = [d for d in days if d <= end.strftime(SEGMENT_FORMAT)]
+        return days
+
+    # -- writes -----------------------------------------------------------
+
+    def append(self, ts, devices, keyframe=None):
+        """Store one cycle's device list under snapshot time ``ts`` (a datetime).
+
+        Only devices whose reading changed since the previous append are
+        written, plus a ``removed`` marker for devices that dropped out of
+        the list. A full keyframe is written on the first append of a day
+        segment or of this process, every ``keyframe_every`` cycles, or
+        when ``keyframe`` is true. The rollups only count readings that
+        differ from the device's previous row in the same segment, so
+        keyframe repeats are not counted twice. Returns the number of rows
+        written.
+        """
+        epoch = int(ts.timestamp())
+        day = ts.strftime(SEGMENT_FORMAT)
+        with self._lock:
+            current = {}
+            with self._meta:
+                for device in devices:
+                    dev_id = self._intern(device)
+                    current[dev_id] = (_to_float(device.get("temperature")), _to_float(device.get("humidity")),
+                                       1 if device.get("online") else 0, _to_epoch(device.get("last_seen")))
+                self._touch(current, epoch)
+            if self._delta_day != day:
+                # 日替わりと再起動直後は、そのセグメントに既にある行と比べる
+                self._segment_last = self._newest_rows(day)
+            if keyframe is None:
+                keyframe = (self._delta_day != day or self._since_keyframe + 1 >= self.keyframe_every
+                            or epoch <= self._delta_epoch)
+            # 集計に数えるのはセグメント内で直前の行と違う読み取りだけ (aggregate の生データ集計と同じ基準)
+            fresh = {dev_id: reading for dev_id, reading in current.items()
+                     if self._segment_last.get(dev_id) != reading}
+            changed = current if keyframe else fresh
+            removed = [] if keyframe else [dev_id for dev_id in self._last if dev_id not in current]
+            rows = [(epoch, dev_id) + reading for dev_id, reading in changed.items()]
+
+            conn = self._segment(day, create=True)
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO readings VALUES (?, ?, ?, ?, ?, ?)", rows)
+                conn.executemany("INSERT OR REPLACE INTO removed VALUES (?, ?)",
+                                 [(epoch, dev_id) for dev_id in removed])
+                conn.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)",
+                             (epoch, len(current), 1 if keyframe else 0))
+                for table, width in ROLLUPS:
+                    bucket = epoch // width * width
+                    # キーフレームで書き直しただけの値は集計に二重に数えない
+                    conn.executemany(ROLLUP_UPSERT.format(table=table), [
+                        (bucket, dev_id, online, 0 if t is None else 1, t, t, t or 0.0,
+                         0 if h is None else 1, h, h, h or 0.0)
+                        for dev_id, (t, h, online, _) in fresh.items()])
+            self._segment_last.update(changed)
+            self._last = current
+            self._delta_day = day
+            self._delta_epoch = epoch
+            self._since_keyframe = 0 if keyframe else self._since_keyframe + 1
+            self._add_to_index(epoch)
+            return len(rows) + len(removed)
+
+    def _newest_rows(self, day):
+        """``{device id: reading}`` of each device's newest row in ``day``'s segment ({} when there is none)."""
+        conn = self._segment(day)
+        if conn is None:
+            return {}
+        # SQLite では MAX() と並べた列はその最大の行の値になる
+        rows = conn.execute(
+            "SELECT device, MAX(ts), temperature, humidity, online, last_seen FROM readings GROUP BY device")
+        return {row[0]: tuple(row[2:]) for row in rows}
+
+    def drop_before(self, cutoff):
+        """Delete every segment whose whole day lies before ``cutoff``; returns the dropped days."""
+        dropped = []
+        with self._lock:
+            for day in self.segment_days():
+                day_end = datetime.strptime(day, SEGMENT_FORMAT) + timedelta(days=1)
+                if day_end > cutoff:
+                    continue
+                conn = self._segments.pop(day, None)
+                if conn is not None:
+                    conn.close()
+                path = self._segment_path(day)
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+                dropped.append(day)
+            if dropped:
+                self._trim_index()
+        return dropped
+
+    # -- snapshot index -----------------------------------------------------
+
+    def _add_to_index(self, epoch):
+        i = bisect.bisect_left(self._times, epoch)
+        if i == len(self._times) or self._times[i] != epoch:
+            self._times.insert(i, epoch)
+
+    def _trim_index(self):
+        days = self.segment_days()
+        for day in list(self._indexed):
+            if day not in days:
+                del self._indexed[day]
+        if not days:
+            self._times = []
+            return
+        first = int(datetime.strptime(days[0], SEGMENT_FORMAT).timestamp())
+        del self._times[:bisect.bisect_left(self._times, first)]
+
+    def refresh_index(self):
+        """Bring the in-memory snapshot index up to date with the segments on disk.
+
+        Only segments whose ``PRAGMA data_version`` moved since the last
+        refresh are queried, and only for timestamps above what is already
+        indexed, so a refresh with no new snapshots costs a stat() and a
+        pragma per recent segment.
+        """
+        with self._lock:
+            days = self.segment_days()
+            if any(day not in days for day in self._indexed):
+                self._trim_index()
+            newest = max(self._indexed) if self._indexed else None
+            for day in days:
+                if newest is not None and day < newest:
+                    continue
+                conn = self._segment(day)
+                if conn is None:
+                    continue
+                version = conn.execute("PRAGMA data_version").fetchone()[0]
+                known = self._indexed.get(day)
+                if known is not None and known[0] == version:
+                    continue
+                high = known[1] if known is not None else -1
+                fresh = [ts for (ts,) in conn.execute(
+                    "SELECT ts FROM snapshots WHERE ts > ? ORDER BY ts", (high,))]
+                for ts in fresh:
+                    self._add_to_index(ts)
+                self._indexed[day] = (version, fresh[-1] if fresh else high)
+            return len(self._times)
+
+    # -- reads ------------------------------------------------------------
+
+    def snapshot_times(self, start=None, end=None):
+        lo = int(start.timestamp()) if start is not None else 0
+        hi = int(end.timestamp()) if end is not None else 2 ** 62
+        with self._lock:
+            self.refresh_index()
+            i = bisect.bisect_left(self._times, lo)
+            j = bisect.bisect_right(self._times, hi)
+            return [datetime.fromtimestamp(ts) for ts in self._times[i:j]]
+
+    def _state_at(self, epoch):
+        """``{device id: (temperature, humidity, online, last_seen)}`` as of ``epoch``.
+
+        Starts from the newest keyframe at or before ``epoch`` in that day's
+        segment and replays the deltas and removals up to ``epoch``.
+        """
+        conn = self._segment(datetime.fromtimestamp(epoch).strftime(SEGMENT_FORMAT))
+        if conn is None:
+            return {}
+        row = conn.execute("SELECT MAX(ts) FROM snapshots WHERE keyframe = 1 AND ts <= ?", (epoch,)).fetchone()
+        start = row[0] if row[0] is not None else 0
+        state = {}
+        seen = {}
+        for ts, dev_id, temperature, humidity, online, last_seen in conn.execute(
+                "SELECT ts, device, temperature, humidity, online, last_seen FROM readings "
+                "WHERE ts BETWEEN ? AND ? ORDER BY ts", (start, epoch)):
+            state[dev_id] = (temperature, humidity, online, last_seen)
+            seen[dev_id] = ts
+        for ts, dev_id in conn.execute(
+                "SELECT ts, device FROM removed WHERE ts > ? AND ts <= ?", (start, epoch)):
+            if seen.get(dev_id, -1) < ts:
+                state.pop(dev_id, None)
+        return state
+
+    def _rows(self, state, offline_value):
+        devices = []
+        for dev_id, (temperature, humidity, online, last_seen) in state.items():
+            sn, name, loc_id, warehouse, account = self._device_row(dev_id)
+            devices.append({
+                "id": sn,
+                "name": name,
+                "temperature": _format_value(temperature, offline_value),
+                "humidity": _format_value(humidity, offline_value),
+                "last_seen": _format_epoch(last_seen),
+                "online": bool(online),
+                "location_id": loc_id,
+                "warehouse": warehouse,
+                "account": account,
+            })
+        return devices
+
+    def load(self, ts, offline_value=""):
+        """Rebuild the device list as of ``ts`` in the cache JSON shape."""
+        with self._lock:
+            return self._rows(self._state_at(int(ts.timestamp())), offline_value)
+
+    def readings_at(self, ts, serials=None):
+        """Each device's state as of ``ts`` in iter_readings()' row shape, stamped with ``ts``.
+
+        Unchanged devices have no row between keyframes, so a reader of a
+        range starts from this and then follows iter_readings() from just
+        after ``ts``. ``serials=None`` means every device.
+        """
+        epoch = int(ts.timestamp())
+        ids = set(self.device_ids(serials).values()) if serials is not None else None
+        with self._lock:
+            state = self._state_at(epoch)
+            return [self._device_row(dev_id)[:2] + (epoch,) + reading
+                    for dev_id, reading in sorted(state.items()) if ids is None or dev_id in ids]
+
+    def latest_cursor(self):
+        """Epoch of the newest snapshot, or None when the store is empty."""
+        with self._lock:
+            self.refresh_index()
+            return self._times[-1] if self._times else None
+
+    def changes_since(self, cursor, offline_value=""):
+        """What changed between snapshot ``cursor`` (an epoch) and the newest snapshot.
+
+        Returns ``{"cursor", "reset", "changed", "removed"}``: pass the
+        returned cursor back on the next call. When ``cursor`` is None or
+        older than the retained segments, ``reset`` is true and ``changed``
+        holds every device.
+        """
+        with self._lock:
+            self.refresh_index()
+            latest = self._times[-1] if self._times else None
+            if latest is None:
+                return {"cursor": None, "reset": True, "changed": [], "removed": []}
+            cursor = int(cursor) if cursor is not None else None
+            if cursor is not None and cursor >= latest:
+                return {"cursor": latest, "reset": False, "changed": [], "removed": []}
+            after = self._state_at(latest)
+            if cursor is None or cursor < self._times[0]:
+                return {"cursor": latest, "reset": True, "changed": self._rows(after, offline_value), "removed": []}
+            before = self._state_at(cursor)
+            changed = {dev_id: reading for dev_id, reading in after.items() if before.get(dev_id) != reading}
+            removed = [self._device_row(dev_id)[0] for dev_id in before if dev_id not in after]
+            return {"cursor": latest, "reset": False,
+                    "changed": self._rows(changed, offline_value), "removed": removed}
+
+    def nearest(self, ts):
+        """Return ``(snapshot_time, devices)`` for the snapshot closest to ``ts``.
+
+        The lookup is a bisect over the in-memory index followed by a single
+        segment read for the chosen snapshot.
+        """
+        epoch = int(ts.timestamp())
+        with self._lock:
+            self.refresh_index()
+            i = bisect.bisect_left(self._times, epoch)
+            candidates = self._times[max(i - 1, 0):i + 1]
+            if not candidates:
+                return None, []
+            best = min(candidates, key=lambda cand: abs(cand - epoch))
+        snapshot_time = datetime.fromtimestamp(best)
+        return snapshot_time, self.load(snapshot_time)
+
+    def readings(self, serials, start, end):
+        """Yield ``(sn, ts, temperature, humidity, online, last_seen)`` for ``serials`` in [start, end].
+
+        Rows come out in (ts, device) order, read through the primary key
+        range of each segment overlapping the window.
+        """
+        ids = self.device_ids(serials)
+        if not ids:
+            return
+        sn_by_id = {dev_id: sn for sn, dev_id in ids.items()}
+        lo, hi = int(start.timestamp()), int(end.timestamp())
+        placeholders = ",".join("?" * len(sn_by_id))
+        for day in self._days_between(start, end):
+            with self._lock:
+                conn = self._segment(day)
+                if conn is None:
+                    continue
+                rows = conn.execute(
+                    "SELECT device, ts, temperature, humidity, online, last_seen FROM readings "
+                    f"WHERE ts BETWEEN ? AND ? AND device IN ({placeholders}) ORDER BY ts, device",
+                    [lo, hi] + list(sn_by_id)).fetchall()
+            for row in rows:
+                yield (sn_by_id[row[0]],) + row[1:]
+
+    def iter_readings(self, start, end, serials=None, chunk_rows=EXPORT_CHUNK_ROWS):
+        """Yield lists of ``(sn, name, ts, temperature, humidity, online, last_seen)`` for [start, end].
+
+        Unlike readings(), rows are fetched ``chunk_rows`` at a time by
+        keyset pagination on ``(ts, device)`` and the lock is released
+        between chunks, so an export over months never holds more than one
+        chunk in memory nor blocks the worker for long. ``serials=None``
+        means every device.
+        """
+        where, params = "", []
+        if serials is not None:
+            ids = self.device_ids(serials)
+            if not ids:
+                return
+            where = f" AND device IN ({','.join('?' * len(ids))})"
+            params = list(ids.values())
+        lo, hi = int(start.timestamp()), int(end.timestamp())
+        query = ("SELECT ts, device, temperature, humidity, online, last_seen FROM readings "
+                 f"WHERE (ts, device) > (?, ?) AND ts <= ?{where} ORDER BY ts, device LIMIT ?")
+        for day in self._days_between(start, end):
+            after = (lo - 1, 2 ** 62)
+            while True:
+                with self._lock:
+                    conn = self._segment(day)
+                    if conn is None:
+                        break
+                    rows = conn.execute(query, [after[0], after[1], hi] + params + [chunk_rows]).fetchall()
+                    chunk = [self._device_row(dev_id)[:2] + (ts, t, h, online, last_seen)
+                             for ts, dev_id, t, h, online, last_seen in rows]
+                if chunk:
+                    yield chunk
+                if len(rows) < chunk_rows:
+                    break
+                after = rows[-1][:2]
+
+    def aggregate(self, serials, start, end, resolution):
+        """Min/max/mean buckets of ``resolution`` seconds per device over [start, end).
+
+        Buckets start at ``start``. The aggregation runs inside
+        SQLite against the coarsest rollup table whose width divides
+        ``resolution`` (falling back to raw readings); when the resolution
+        equals the rollup width the rows are read straight off the primary
+        key without a GROUP BY. Returns ``{sn: columns}`` where ``columns``
+        holds parallel lists (t, count, online_ratio, temperature_min, ...).
+        """
+        resolution = max(int(resolution), 1)
+        ids = self.device_ids(serials)
+        if not ids:
+            return {}
+        sn_by_id = {dev_id: sn for sn, dev_id in ids.items()}
+        lo, hi = int(start.timestamp()), int(end.timestamp())
+        offset = int(start.astimezone().utcoffset().total_seconds())
+
+        table, table_width = None, 1
+        for name, width in ROLLUPS:
+            if resolution % width == 0 and lo % width == 0:
+                table, table_width = name, width
+        placeholders = ",".join("?" * len(sn_by_id))
+        if table is not None and table_width == resolution:
+            query = (f"SELECT device, bucket AS b, n, online, t_n, t_min, t_max, t_sum, h_n, h_min, h_max, h_sum "
+                     f"FROM {table} WHERE bucket >= ? AND bucket < ? AND device IN ({placeholders})")
+        else:
+            # 生データではキーフレームで書き直しただけの行を除き、rollup と同じく新しい読み取りだけ数える
+            source = table or (
+                "(SELECT ts AS bucket, device, 1 AS n, online, temperature IS NOT NULL AS t_n, "
+                "temperature AS t_min, temperature AS t_max, coalesce(temperature, 0) AS t_sum, "
+                "humidity IS NOT NULL AS h_n, humidity AS h_min, humidity AS h_max, "
+                "coalesce(humidity, 0) AS h_sum FROM ("
+                "SELECT *, LAG(ts) OVER w AS p_ts, LAG(temperature) OVER w AS p_t, LAG(humidity) OVER w AS p_h, "
+                "LAG(online) OVER w AS p_online, LAG(last_seen) OVER w AS p_last_seen "
+                f"FROM readings WHERE ts < {hi} WINDOW w AS (PARTITION BY device ORDER BY ts)) "
+                "WHERE p_ts IS NULL OR p_t IS NOT temperature OR p_h IS NOT humidity "
+                "OR p_online IS NOT online OR p_last_seen IS NOT last_seen)")
+            query = (
+                f"SELECT device, {lo} + ((bucket - {lo}) / {resolution}) * {resolution} AS b, "
+                "SUM(n) AS n, SUM(online) AS online, SUM(t_n) AS t_n, MIN(t_min) AS t_min, "
+                "MAX(t_max) AS t_max, SUM(t_sum) AS t_sum, SUM(h_n) AS h_n, MIN(h_min) AS h_min, "
+                "MAX(h_max) AS h_max, SUM(h_sum) AS h_sum "
+                f"FROM {source} WHERE bucket >= ? AND bucket < ? AND device IN ({placeholders}) "
+                "GROUP BY device, b ORDER BY device, b"
+            )
+
+        # 日付セグメントをまたぐ刻みのときだけ Python 側で併合する
+        merge = 86400 % resolution != 0 or (lo + offset) % resolution != 0
+        if not merge:
+            query = (
+                "SELECT device, b, n, ROUND(online * 1.0 / n, 3), t_min, t_max, "
+                "CASE WHEN t_n THEN ROUND(t_sum / t_n, 2) END, h_min, h_max, "
+                f"CASE WHEN h_n THEN ROUND(h_sum / h_n, 2) END FROM ({query}) ORDER BY device, b"
+            )
+
+        per_device = {}
+        for day in self._days_between(start, end):
+            with self._lock:
+                conn = self._segment(day)
+                if conn is None:
+                    continue
+                rows = conn.execute(query, [lo, hi] + list(sn_by_id)).fetchall()
+            for dev_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+                per_device.setdefault(dev_id, []).extend(group)
+
+        if merge:
+            per_device = {dev_id: _finish_buckets(rows) for dev_id, rows in per_device.items()}
+
+        labels = {}
+        result = {}
+        for dev_id, rows in per_device.items():
+            columns = list(zip(*rows))[1:]
+            for bucket in columns[0]:
+                if bucket not in labels:
+                    labels[bucket] = datetime.fromtimestamp(bucket).strftime(LAST_SEEN_FORMAT)
+            columns[0] = [labels[bucket] for bucket in columns[0]]
+            result[sn_by_id[dev_id]] = dict(zip(BUCKET_COLUMNS, map(list, columns)))
+        return result
+
+    def close(self):
+        with self._lock:
+            for conn in self._segments.values():
+                conn.close()
+            self._segments.clear()
+            self._meta.close()
+
+    # -- migration --------------------------------------------------------
+
+    def import_json_dir(self, cache_dir):
+        """Load legacy ``device_cache_YYYYMMDDHHMMSS.json`` files into the store."""
+        imported = 0
+        for fname in sorted(os.listdir(cache_dir)):
+            ts = parse_timestamp_from_filename(fname) if fname.endswith(".json") else None
+            if ts is None:
+                continue
+            try:
+                with open(os.path.join(cache_dir, fname), 'r', encoding='utf-8') as f:
+                    devices = json.load(f)
+            except Exception as e:
+                logger.warning("Skipping %s: %s", fname, e)
+                continue
+            if isinstance(devices, list):
+                self.append(ts, devices)
+                imported += 1
+        return imported
+
+
+if __name__ == "__main__":
+    # python store.py import [cache_dir]
+    if len(sys.argv) >= 2 and sys.argv[1] == "import":
+        source = sys.argv[2] if len(sys.argv) > 2 else os.path.join(BASE_DIR, "cache")
+        store = TimeSeriesStore()
+        print(f"[INFO] Imported {store.import_json_dir(source)} snapshots from {source}")
+        store.close()
+    else:
+        print("usage: python store.py import [cache_dir]")
@@ -0,0 +1,330 @@
+import os
+import signal
+import threading
+import time
+import logging
+from datetime import datetime
+
+import config_store
+import logging_setup
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RUN_DIR = os.path.join(BASE_DIR, "run")
+LOCK_FILE = os.path.join(RUN_DIR, "supervisor.lock")
+STATUS_FILE = os.path.join(RUN_DIR, "status.json")
+
+CHECK_SECONDS = 1           # タスクの生存確認の間隔
+STATUS_SECONDS = 5          # 状態ファイルを書き出す間隔
+BACKOFF_INITIAL = 1
+BACKOFF_MAX = 300
+BACKOFF_RESET_SECONDS = 600  # これだけ動き続けたら再起動間隔を初期値に戻す
+DEFAULT_MAX_LAG_SECONDS = 300
+
+logger = logging.getLogger(__name__)
+
+
+class HostLock:
+    """Exclusive, non-blocking lock on ``path`` that lasts as long as the process holds it.
+
+    The OS drops the lock when the process dies, so a stale pid in the file
+    never blocks the next start.
+    """
+
+    def __init__(self, path=LOCK_FILE):
+        self.path = path
+        self._fd = None
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode("ascii"))
+        self._fd = fd
+        return True
+
+    def holder(self):
+        try:
+            with open(self.path, "r", encoding="ascii") as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        except OSError:
+            pass
+        os.close(self._fd)
+        self._fd = None
+
+
+class TaskStatus:
+    """Cycle bookkeeping a task updates and the supervisor reports."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.state = "starting"
+        self.restarts = 0
+        self.cycles = 0
+        self.started_at = None
+        self.cycle_started = None
+        self.last_cycle_end = None
+        self.last_cycle_seconds = None
+        self.next_due = None
+        self.last_error = None
+
+    def begin_cycle(self):
+        with self._lock:
+            self.cycle_started = time.time()
+
+    def end_cycle(self, next_due=None, error=None):
+        """Record a finished cycle; ``next_due`` is when the task expects to run next (epoch seconds)."""
+        now = time.time()
+        with self._lock:
+            if self.cycle_started is not None:
+                self.last_cycle_seconds = round(now - self.cycle_started, 3)
+            self.cycle_started = None
+            self.last_cycle_end = now
+            self.next_due = next_due
+            self.cycles += 1
+            if error is not None:
+                self.last_error = str(error)
+
+    def as_dict(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            # 予定時刻を過ぎても次のサイクルが終わっていない分が遅れ
+            lag = max(now - self.next_due, 0) if self.next_due is not None else 0.0
+            return {
+                "state": self.state,
+                "restarts": self.restarts,
+                "cycles": self.cycles,
+                "last_cycle_seconds": self.last_cycle_seconds,
+                "last_cycle_end": _iso(self.last_cycle_end),
+                "next_due": _iso(self.next_due),
+                "lag_seconds": round(lag, 3),
+                "running_for": round(now - self.cycle_started, 3) if self.cycle_started else None,
+                "last_error": self.last_error,
+            }
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts).isoformat(timespec="seconds") if ts else None
+
+
+class Supervisor:
+    """Run the background tasks as threads in this process and restart them when they die.
+
+    ``tasks`` maps a name to ``target(stop_event, status)``; a target is
+    expected to loop until ``stop_event`` is set. A target that returns or
+    raises early is restarted after an exponential backoff.
+    """
+
+    def __init__(self, tasks, lock=None, status_file=STATUS_FILE):
+        self.tasks = dict(tasks)
+        self.lock = lock or HostLock()
+        self.status_file = status_file
+        self.stop_event = threading.Event()
+        self.statuses = {name: TaskStatus(name) for name in self.tasks}
+        self._threads = {}
+        self._restart_at = {}
+        self._backoff = {name: BACKOFF_INITIAL for name in self.tasks}
+        self._monitor = None
+        self._stopped = False
+        self.started_at = None
+
+    def _run_task(self, name):
+        status = self.statuses[name]
+        status.state = "running"
+        status.started_at = time.time()
+        try:
+            self.tasks[name](self.stop_event, status)
+            if not self.stop_event.is_set():
+                status.last_error = "exited"
+        except Exception as e:
+            status.last_error = f"{type(e).__name__}: {e}"
+            logger.exception("Task %s crashed", name)
+        finally:
+            status.state = "stopped" if self.stop_event.is_set() else "crashed"
+
+    def _spawn(self, name):
+        thread = threading.Thread(target=self._run_task, args=(name,), name=name, daemon=True)
+        self._threads[name] = thread
+        thread.start()
+
+    def _check(self):
+        now = time.time()
+        for name, thread in self._threads.items():
+            if thread.is_alive() or self.stop_event.is_set():
+                continue
+            status = self.statuses[name]
+            restart_at = self._restart_at.get(name)
+            if restart_at is None:
+                if status.started_at and now - status.started_at >= BACKOFF_RESET_SECONDS:
+                    self._backoff[name] = BACKOFF_INITIAL
+                delay = self._backoff[name]
+                self._backoff[name] = min(delay * 2, BACKOFF_MAX)
+                self._restart_at[name] = now + delay
+                status.state = "backoff"
+                logger.warning("Task %s stopped, restarting in %ss", name, delay)
+            elif now >= restart_at:
+                del self._restart_at[name]
+                status.restarts += 1
+                logger.info("Restarting task %s (restart #%d)", name, status.restarts)
+                self._spawn(name)
+
+    def status(self):
+        now = time.time()
+        return {
+            "pid": os.getpid(),
+            "started_at": _iso(self.started_at),
+            "updated_at": _iso(now),
+            "updated_ts": now,
+            "tasks": {name: s.as_dict(now) for name, s in self.statuses.items()},
+        }
+
+    def write_status(self):
+        try:
+            config_store.save_json(self.status_file, self.status(), indent=None)
+        except OSError as e:
+            logger.warning("Writing %s failed: %s", self.status_file, e)
+
+    def _watch(self):
+        written = 0.0
+        while not self.stop_event.is_set():
+            try:
+                self._check()
+                if time.monotonic() - written >= STATUS_SECONDS:
+                    self.write_status()
+                    written = time.monotonic()
+            except Exception as e:
+                logger.error("Supervisor check failed: %s", e)
+            self.stop_event.wait(CHECK_SECONDS)
+
+    def start(self):
+        """Take the host lock and start every task; returns False if another process holds it."""
+        if not self.lock.acquire():
+            logger.info("Background tasks already run by pid %s, not starting", self.lock.holder())
+            return False
+        self.started_at = time.time()
+        for name in self.tasks:
+            self._spawn(name)
+        self._monitor = threading.Thread(target=self._watch, name="supervisor", daemon=True)
+        self._monitor.start()
+        logger.info("Supervisor started tasks: %s", ", ".join(self.tasks))
+        return True
+
+    def stop(self, timeout=30):
+        """Signal every task to stop, wait for them, then release the host lock."""
+        if self._stopped:
+            return
+        self._stopped = True
+        self.stop_event.set()
+        deadline = time.monotonic() + timeout
+        for name, thread in self._threads.items():
+            thread.join(max(deadline - time.monotonic(), 0))
+            if thread.is_alive():
+                logger.warning("Task %s did not stop within %ss", name, timeout)
+        if self._monitor is not None:
+            self._monitor.join(STATUS_SECONDS)
+        self.write_status()
+        self.lock.release()
+        logger.info("Supervisor stopped")
+
+
+def default_tasks():
+    import cache_worker
+    import cache_logger
+    return {"cache_worker": cache_worker.main, "cache_logger": cache_logger.main}
+
+
+_supervisor = None
+_supervisor_lock = threading.Lock()
+
+
+def start_background():
+    """Start the process-wide supervisor once; a no-op when another process already owns the host lock."""
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor is None:
+            sup = Supervisor(default_tasks())
+            if not sup.start():
+                return None
+            _supervisor = sup
+            import atexit
+            atexit.register(sup.stop)
+        return _supervisor
+
+
+def current():
+    return _supervisor
+
+
+def health(settings=None):
+    """``(ok, report)`` for the background tasks, from this process or the status file."""
+    settings = settings or config_store.get_settings()
+    max_lag = float(settings.get("health_max_lag_seconds", DEFAULT_MAX_LAG_SECONDS))
+    if _supervisor is not None:
+        report = _supervisor.status()
+    else:
+        report = config_store.load_json(STATUS_FILE, None)
+        if report is None:
+            return False, {"error": "no supervisor status"}
+        report = dict(report)
+    now = time.time()
+    problems = []
+    if now - report.get("updated_ts", 0) > STATUS_SECONDS * 3:
+        problems.append("supervisor status is stale")
+    for name, task in report.get("tasks", {}).items():
+        if task.get("state") != "running":
+            problems.append(f"{name} is {task.get('state')}")
+        elif (task.get("lag_seconds") or 0) > max_lag:
+            problems.append(f"{name} lags {task['lag_seconds']}s")
+    report["problems"] = problems
+    return not problems, report
+
+
+def main():
+    logging_setup.configure(config_store.get_settings())
+    metrics.start_exporter()
+    sup = Supervisor(default_tasks())
+    if not sup.start():
+        return 1
+
+    def _stop(signum, frame):
+        logger.info("Signal %s received, shutting down", signum)
+        sup.stop_event.set()
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+    while not sup.stop_event.wait(1):
+        pass
+    sup.stop()
+    logging_setup.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
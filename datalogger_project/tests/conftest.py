@@ -0,0 +1,29 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+# モジュールはプロジェクト直下に平置きなので、そこから import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from store import TimeSeriesStore  # noqa: E402
+
+
+def reading(sn, ts, temperature=20.0, humidity=50.0, online=True, location_id=None):
+    """One device in the shape upstream.fetch_snapshot returns (plus ``location_id``)."""
+    return {"id": sn, "name": f"name-{sn}", "temperature": str(temperature), "humidity": str(humidity),
+            "online": online, "last_seen": ts.strftime("%Y-%m-%d %H:%M:%S"), "location_id": location_id}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TimeSeriesStore(str(tmp_path / "store"), keyframe_every=5)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def recent():
+    """A whole-minute datetime an hour ago: inside SEED_HOURS and the default retention."""
+    return (datetime.now() - timedelta(hours=1)).replace(second=0, microsecond=0)
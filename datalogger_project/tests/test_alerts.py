@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+
+from alerts import AlertEngine
+from tests.conftest import reading
+
+NOW = datetime(2025, 1, 6, 12, 0)
+RULES = {
+    "default": {"temperature_max": 25, "temperature_hysteresis": 0.5, "stale_minutes": None, "offline": False},
+    "cold": {"temperature_min": 2, "temperature_max": 8},
+}
+
+
+def _events(engine, temperature, location_id=None, sn="A"):
+    events = engine.evaluate([reading(sn, NOW, temperature=temperature, location_id=location_id)], RULES, NOW)
+    return [(e["kind"], e["event"]) for e in events]
+
+
+def test_band_alert_clears_only_past_the_hysteresis_margin(tmp_path):
+    engine = AlertEngine(str(tmp_path / "alerts_state.json"))
+    assert _events(engine, 24.9) == []
+    assert _events(engine, 25.5) == [("temperature_high", "raised")]
+    assert _events(engine, 26.0) == []
+    # 25 を下回っても 24.5 までは発報中のまま
+    assert _events(engine, 24.8) == []
+    assert list(engine.active) == ["A|temperature_high"]
+    assert engine.active["A|temperature_high"]["value"] == 24.8
+    assert _events(engine, 24.4) == [("temperature_high", "cleared")]
+    assert engine.active == {}
+
+
+def test_location_rules_override_the_default(tmp_path):
+    engine = AlertEngine(str(tmp_path / "alerts_state.json"))
+    assert _events(engine, 1.0, "cold") == [("temperature_low", "raised")]
+    # 既定の温度ヒステリシス 0.5 を引き継ぐ
+    assert _events(engine, 2.3, "cold") == []
+    assert _events(engine, 2.6, "cold") == [("temperature_low", "cleared")]
+    assert _events(engine, 9.0, "cold") == [("temperature_high", "raised")]
+
+
+def test_active_alerts_survive_a_restart(tmp_path):
+    path = str(tmp_path / "alerts_state.json")
+    engine = AlertEngine(path)
+    assert _events(engine, 30.0) == [("temperature_high", "raised")]
+    engine.save()
+
+    restarted = AlertEngine(path)
+    assert _events(restarted, 30.0) == []
+    assert _events(restarted, 20.0) == [("temperature_high", "cleared")]
+
+
+def test_stale_and_offline_alerts(tmp_path):
+    engine = AlertEngine(str(tmp_path / "alerts_state.json"))
+    rules = {"default": {"stale_minutes": 30, "offline": True}}
+    old = reading("A", NOW - timedelta(minutes=45), online=False)
+    events = engine.evaluate([old], rules, NOW)
+    assert sorted((e["kind"], e["event"]) for e in events) == [("offline", "raised"), ("stale", "raised")]
+    fresh = reading("A", NOW)
+    events = engine.evaluate([fresh], rules, NOW)
+    assert sorted((e["kind"], e["event"]) for e in events) == [("offline", "cleared"), ("stale", "cleared")]
@@ -0,0 +1,88 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+import config_store
+import metrics
+from app import app, live_feed, parse_time_arg
+
+
+@pytest.fixture
+def client():
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        with client.session_transaction() as session:
+            session["logged_in"] = True
+        yield client
+
+
+@pytest.mark.parametrize("query", ["seconds=abc", "seconds=nan", "seconds=inf", "pid=xyz"])
+def test_debug_profile_rejects_bad_arguments(client, query):
+    response = client.post(f"/debug/profile?{query}")
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+@pytest.mark.parametrize("value, expected", [("0", 1), ("-5", 1), ("99999", metrics.MAX_PROFILE_SECONDS),
+                                             ("12.5", 12.5)])
+def test_debug_profile_clamps_seconds(client, monkeypatch, value, expected):
+    started, requested = [], []
+    monkeypatch.setattr(metrics, "start_profiler", lambda seconds: started.append(seconds))
+    monkeypatch.setattr(metrics, "request_profile", lambda seconds, pid=None: requested.append(seconds))
+    response = client.post("/debug/profile", data={"seconds": value})
+    assert response.status_code == 200
+    assert started == [expected] and requested == [expected]
+
+
+def _local(moment):
+    return moment.astimezone().replace(tzinfo=None)
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2025-01-01T00:00:00+09:00", _local(datetime(2024, 12, 31, 15, tzinfo=timezone.utc))),
+    ("2025-01-01T00:00:00Z", _local(datetime(2025, 1, 1, tzinfo=timezone.utc))),
+    ("2025-01-01T00:00:00-05:00", _local(datetime(2025, 1, 1, 5, tzinfo=timezone.utc))),
+    ("2025-01-01T09:30:00", datetime(2025, 1, 1, 9, 30)),
+    ("1735689600", datetime.fromtimestamp(1735689600)),
+])
+def test_parse_time_arg_converts_offsets_to_local_time(value, expected):
+    assert parse_time_arg(value, None) == expected
+
+
+def test_parse_time_arg_conversion_follows_the_server_zone(monkeypatch):
+    monkeypatch.setenv("TZ", "Asia/Tokyo")
+    time.tzset()
+    try:
+        assert parse_time_arg("2025-01-01T00:00:00Z", None) == datetime(2025, 1, 1, 9, 0)
+        assert parse_time_arg("2025-01-01T00:00:00+09:00", None) == datetime(2025, 1, 1, 0, 0)
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+def test_history_rejects_a_bad_time(client):
+    response = client.get("/history/A?start=yesterday")
+    assert response.status_code == 400
+
+
+def test_stream_refuses_with_503_when_the_feed_is_full(client, monkeypatch):
+    monkeypatch.setattr(config_store, "get_settings", lambda: {"stream_max_clients": 1})
+    # 監視スレッドは実データを読みに行くので、何もせず終わるものにしておく
+    monkeypatch.setattr(live_feed, "_watch", lambda: None)
+    monkeypatch.setattr(live_feed, "_thread", None)
+    held = live_feed.subscribe(1)
+    # 件数を見てから枠を取るまでの間に他のリクエストが最後の枠を取った状況
+    monkeypatch.setattr(type(live_feed), "client_count", property(lambda self: 0))
+    try:
+        response = client.get("/stream")
+        assert response.status_code == 503
+        assert response.get_json() == {"error": "too many stream clients"}
+    finally:
+        live_feed.unsubscribe(held)
+
+    # 取れた枠は本文を読まずに閉じても返される
+    response = client.get("/stream")
+    assert response.status_code == 200 and len(live_feed._subscribers) == 1
+    response.close()
+    assert not live_feed._subscribers
@@ -0,0 +1,73 @@
+import json
+from datetime import datetime, timedelta
+
+from assignment_log import AssignmentJournal
+
+T0 = datetime(2025, 1, 6, 9, 0)
+
+
+def _journal(tmp_path):
+    return AssignmentJournal(str(tmp_path / "assignment_history.jsonl"), str(tmp_path / "legacy.json"))
+
+
+def test_record_appends_only_changes(tmp_path):
+    journal = _journal(tmp_path)
+    assert journal.record({"A": "loc1", "B": "loc2"}, T0) == 2
+    assert journal.record({"A": "loc1", "B": "loc2"}, T0 + timedelta(hours=1)) == 0
+    # B は外れたので未割当として記録される
+    assert journal.record({"A": "loc3"}, T0 + timedelta(hours=2)) == 2
+    assert journal.current() == {"A": "loc3"}
+
+
+def test_replay_from_file_answers_point_in_time_queries(tmp_path):
+    writer = _journal(tmp_path)
+    writer.record({"A": "loc1", "B": "loc2"}, T0)
+    writer.record({"A": "loc3", "B": "loc2"}, T0 + timedelta(hours=2))
+    writer.record({"A": "loc3"}, T0 + timedelta(hours=4))
+
+    reader = _journal(tmp_path)
+    assert reader.location_at("A", T0 - timedelta(minutes=1), default="?") == "?"
+    assert reader.location_at("A", T0) == "loc1"
+    assert reader.location_at("A", T0 + timedelta(hours=3)) == "loc3"
+    assert reader.location_at("B", T0 + timedelta(hours=5)) == ""
+    assert reader.locations_at(T0 + timedelta(hours=1)) == {"A": "loc1", "B": "loc2"}
+    assert [h["location_id"] for h in reader.history("A")] == ["loc1", "loc3"]
+
+
+def test_reader_picks_up_appends_incrementally_and_skips_partial_lines(tmp_path):
+    writer = _journal(tmp_path)
+    reader = _journal(tmp_path)
+    writer.record({"A": "loc1"}, T0)
+    assert reader.current() == {"A": "loc1"}
+
+    writer.record({"A": "loc2"}, T0 + timedelta(hours=1))
+    with open(writer.path, "a", encoding="utf-8") as f:
+        f.write('{"ts": "2025-01-06T11:00:00", "device": "A", "loc')   # 書き込み途中の行
+    assert reader.current() == {"A": "loc2"}
+
+    with open(writer.path, "a", encoding="utf-8") as f:
+        f.write('ation_id": "loc9"}\n')
+    assert reader.current() == {"A": "loc9"}
+
+
+def test_out_of_order_lines_are_replayed_in_time_order(tmp_path):
+    journal = _journal(tmp_path)
+    lines = [{"ts": (T0 + timedelta(hours=2)).isoformat(), "device": "A", "location_id": "loc2"},
+             {"ts": T0.isoformat(), "device": "A", "location_id": "loc1"}]
+    with open(journal.path, "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(line) + "\n" for line in lines)
+    assert journal.location_at("A", T0 + timedelta(hours=1)) == "loc1"
+    assert journal.current() == {"A": "loc2"}
+
+
+def test_compact_keeps_answers_and_drops_repeats(tmp_path):
+    journal = _journal(tmp_path)
+    with open(journal.path, "w", encoding="utf-8") as f:
+        for i, loc in enumerate(["loc1", "loc1", "loc2", "loc2", "loc1"]):
+            f.write(json.dumps({"ts": (T0 + timedelta(hours=i)).isoformat(), "device": "A",
+                                "location_id": loc}) + "\n")
+    before = [journal.location_at("A", T0 + timedelta(hours=i, minutes=30)) for i in range(5)]
+
+    assert journal.compact() == (5, 3)
+    reader = _journal(tmp_path)
+    assert [reader.location_at("A", T0 + timedelta(hours=i, minutes=30)) for i in range(5)] == before
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+from cache_logger import LogSchedule, due_slots, parse_log_times
+
+DAY = datetime(2025, 1, 6)
+
+
+def test_parse_log_times_sorts_and_skips_invalid():
+    assert parse_log_times(["09:00", "03:00:30", "25:00", "xx", "09:00"]) == [3 * 3600 + 30, 9 * 3600]
+
+
+def test_next_after_combines_times_of_day_and_interval():
+    schedule = LogSchedule(["03:00", "09:00"], interval_seconds=0)
+    assert schedule.next_after(DAY + timedelta(hours=2)) == DAY + timedelta(hours=3)
+    assert schedule.next_after(DAY + timedelta(hours=3)) == DAY + timedelta(hours=9)
+    assert schedule.next_after(DAY + timedelta(hours=10)) == DAY + timedelta(days=1, hours=3)
+
+    schedule = LogSchedule(["03:00"], interval_seconds=900)
+    # 間隔は 0:00 基準なので起動時刻によらず :00 / :15 / :30 / :45
+    assert schedule.next_after(DAY + timedelta(hours=2, minutes=7)) == DAY + timedelta(hours=2, minutes=15)
+    assert schedule.next_after(DAY + timedelta(hours=2, minutes=59, seconds=59)) == DAY + timedelta(hours=3)
+    assert not LogSchedule([], 0)
+    assert LogSchedule([], 0).next_after(DAY) is None
+
+
+def test_slots_between_is_half_open():
+    schedule = LogSchedule([], interval_seconds=3600)
+    assert schedule.slots_between(DAY, DAY + timedelta(hours=3)) == [DAY + timedelta(hours=h) for h in (1, 2, 3)]
+
+
+def test_due_slots_on_first_start_does_not_backfill():
+    schedule = LogSchedule(["03:00", "09:00"])
+    assert due_slots(schedule, None, DAY + timedelta(hours=10), 24) == []
+    assert due_slots(schedule, None, DAY + timedelta(hours=9), 24) == [DAY + timedelta(hours=9)]
+
+
+def test_due_slots_catches_up_within_the_horizon():
+    schedule = LogSchedule([], interval_seconds=3600)
+    last = DAY
+    now = DAY + timedelta(hours=5, minutes=30)
+    assert due_slots(schedule, last, now, 24) == [DAY + timedelta(hours=h) for h in range(1, 6)]
+    assert due_slots(schedule, last, now, 2) == [DAY + timedelta(hours=h) for h in (4, 5)]
+    # 遡りなしなら直近の枠だけ
+    assert due_slots(schedule, last, now, 0) == [DAY + timedelta(hours=5)]
+    assert due_slots(schedule, now, now + timedelta(minutes=10), 24) == []
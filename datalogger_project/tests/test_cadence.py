@@ -0,0 +1,78 @@
+from datetime import datetime
+
+import pytest
+
+from cadence import Cadence, _Device
+
+BASE = datetime(2025, 1, 6, 12, 0).timestamp()
+FLOOR, CEILING, GRACE = 10, 300, 5
+
+
+def _snapshot(**last):
+    """Devices whose ``last_seen`` is BASE + the given seconds."""
+    return [{"id": sn, "online": True,
+             "last_seen": datetime.fromtimestamp(BASE + offset).strftime("%Y-%m-%d %H:%M:%S")}
+            for sn, offset in last.items()]
+
+
+def _learned(periods, polls=3):
+    """A Cadence that has seen every device report ``polls`` times at its period, polled right after each."""
+    schedule = Cadence()
+    for i in range(polls):
+        schedule.observe(_snapshot(**{sn: i * p for sn, p in periods.items()}),
+                         now=BASE + i * max(periods.values()) + 1)
+    return schedule
+
+
+def _delay(schedule, started):
+    return schedule.next_due(BASE + started, FLOOR, CEILING, GRACE, now=BASE + started) - (BASE + started)
+
+
+def test_empty_fleet_polls_at_the_floor():
+    schedule = Cadence()
+    assert _delay(schedule, 0) == FLOOR
+    assert schedule.reason == "learning"
+
+
+def test_waits_for_the_next_expected_report_plus_grace():
+    schedule = _learned({"A": 60})
+    assert schedule.devices["A"].period == 60
+    # 最後の報告 120 秒 + 周期 60 秒 + grace 5 秒。サイクル開始は 125 秒
+    assert _delay(schedule, 125) == pytest.approx(60)
+    assert schedule.reason == "expected"
+
+
+def test_reports_close_together_are_picked_up_in_one_cycle():
+    schedule = _learned({"A": 60, "B": 60})
+    schedule.devices["B"].last += 8       # B は A の 8 秒後 (floor 以内) に報告する
+    schedule.devices["C"] = _Device(BASE + 120 + 40)
+    schedule.devices["C"].period = 60     # C は 40 秒後で別のまとまり
+    assert _delay(schedule, 125) == pytest.approx(60 + 8)
+
+
+def test_delay_is_kept_between_floor_and_ceiling():
+    assert _delay(_learned({"A": 60}), 178) == FLOOR
+    slow = _learned({"A": 3000})
+    assert _delay(slow, 6001) == CEILING
+
+
+def test_idle_fleet_backs_off_and_a_new_reading_snaps_back():
+    schedule = _learned({"A": 60})
+    # 4 周期以上報告がないと休止中とみなし、待ち時間を倍々に伸ばす
+    started = 120 + 60 * 5
+    delays = [_delay(schedule, started + i) for i in range(6)]
+    assert delays == [20, 40, 80, 160, 300, 300]
+    assert schedule.reason == "idle"
+
+    schedule.observe(_snapshot(A=started + 10), now=BASE + started + 11)
+    assert _delay(schedule, started + 11) == pytest.approx(60 + GRACE - 1)
+
+
+def test_upstream_lag_is_learned_from_readings_the_last_poll_missed():
+    schedule = _learned({"A": 60})
+    assert schedule.lag() == 0
+    schedule.observe(_snapshot(A=120), now=BASE + 185)   # 180 秒の報告がまだ見えない
+    schedule.observe(_snapshot(A=180), now=BASE + 200)
+    assert schedule.lag() == 5
+    # 次の報告 240 秒 + 遅れ 5 秒 + grace 5 秒
+    assert _delay(schedule, 200) == pytest.approx(50)
@@ -0,0 +1,26 @@
+import pytest
+
+from config_store import _coerce
+
+
+@pytest.mark.parametrize("value, expected", [
+    (True, True), (False, False), ("true", True), ("False", False), (" TRUE ", True),
+    ("1", True), ("0", False), (1, True), (0, False),
+    # 解釈できないものは既定値
+    ("yes please", False), ("", False), (2, False), (None, False), (["true"], False),
+])
+def test_bool_settings_parse_text_and_fall_back_to_the_default(value, expected):
+    assert _coerce(value, False) is expected
+
+
+def test_bool_settings_keep_a_true_default_for_unknown_values():
+    assert _coerce("maybe", True) is True
+    assert _coerce("false", True) is False
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("08:00", ["08:00"]), (["03:00", "09:00"], ["03:00", "09:00"]), (("03:00",), ["03:00"]),
+    ({"03:00": 1}, ["03:00", "09:00"]), (5, ["03:00", "09:00"]), (None, ["03:00", "09:00"]),
+])
+def test_list_settings_wrap_a_single_string(value, expected):
+    assert _coerce(value, ["03:00", "09:00"]) == expected
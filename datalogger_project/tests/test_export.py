@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import assignment_log
+import config_store
+import export
+from assignment_log import AssignmentJournal
+from tests.conftest import reading
+
+START = datetime(2025, 1, 6, 12, 0)
+
+
+@pytest.fixture
+def filled(store, tmp_path, monkeypatch):
+    """A changes every minute, B never (so it only has rows at the keyframes 0 and 5)."""
+    journal = AssignmentJournal(str(tmp_path / "journal.jsonl"), str(tmp_path / "legacy.json"))
+    monkeypatch.setattr(assignment_log, "get_journal", lambda: journal)
+    monkeypatch.setattr(config_store, "get_assignments", lambda: {})
+    monkeypatch.setattr(config_store, "get_locations", lambda: {})
+    for step in range(8):
+        ts = START + timedelta(minutes=step)
+        store.append(ts, [reading("A", ts, temperature=20 + step), reading("B", START, temperature=30)])
+    return store
+
+
+def _rows(store, start, end, **kwargs):
+    return [(row[0][11:], row[1], row[3]) for row in export.export_rows(store, start, end, **kwargs)]
+
+
+def test_export_between_keyframes_starts_from_the_state_at_start(filled):
+    start = START + timedelta(minutes=2, seconds=30)
+    rows = _rows(filled, start, START + timedelta(minutes=4))
+    assert rows == [("12:02:30", "A", 22.0), ("12:02:30", "B", 30.0), ("12:03:00", "A", 23.0),
+                    ("12:04:00", "A", 24.0)]
+
+
+def test_export_starting_on_a_snapshot_has_no_duplicates(filled):
+    rows = _rows(filled, START + timedelta(minutes=4), START + timedelta(minutes=6), changes_only=False)
+    # 5 分のキーフレームで B が繰り返されるのは all=1 のときだけ
+    assert rows == [("12:04:00", "A", 24.0), ("12:04:00", "B", 30.0), ("12:05:00", "A", 25.0),
+                    ("12:05:00", "B", 30.0), ("12:06:00", "A", 26.0)]
+    assert _rows(filled, START + timedelta(minutes=4), START + timedelta(minutes=6), serials=["B"]) == [
+        ("12:04:00", "B", 30.0)]
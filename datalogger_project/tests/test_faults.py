@@ -0,0 +1,142 @@
+import time
+
+import pytest
+
+import alerts
+import cache_worker
+import config_store
+import latest
+import rollup
+import upstream
+from bench.stub_server import StubServer, StubState
+
+ROWS = 10
+DEVICES = 25        # 10 + 10 + 5: ページ 0〜2
+SETTINGS = {"fetch_rows": ROWS, "fetch_workers": 2, "fetch_retries": 1, "fetch_retry_backoff": 0.01}
+
+
+@pytest.fixture
+def stub():
+    state = StubState(DEVICES, latency=0, seed=1)
+    with StubServer(state) as server:
+        client = upstream.UpstreamClient(login_url=server.login_url, data_url=server.data_url, read_timeout=2)
+        yield state, client
+        client.close()
+
+
+@pytest.fixture
+def cycle(stub, store, monkeypatch):
+    """run_cycle against the stub and a temporary store; returns ``(run, published)``."""
+    _, client = stub
+    published = []
+    monkeypatch.setattr(upstream, "get_clients", lambda settings: {"default": client})
+    monkeypatch.setattr(latest, "publish", lambda devices: published.append(devices) or {"bytes": {}})
+    monkeypatch.setattr(latest, "manifest", lambda: {})
+    monkeypatch.setattr(alerts, "process", lambda devices, settings: [])
+    monkeypatch.setattr(rollup, "process", lambda devices, settings: 0)
+    monkeypatch.setattr(cache_worker, "cleanup_cache", lambda *args, **kwargs: 0)
+    monkeypatch.setattr(cache_worker, "_latest_incomplete", False)
+    monkeypatch.setattr(config_store, "get_assignments", lambda: {})
+    monkeypatch.setattr(config_store, "get_locations", lambda: {})
+
+    def run(breakers=None):
+        return cache_worker.run_cycle(store, SETTINGS, breakers)
+    return run, published
+
+
+def test_page_retry_succeeds_after_transient_errors(stub):
+    state, client = stub
+    state.fail_pages = {0: 1, 2: 2}
+    result = upstream.fetch_snapshot(client, rows=ROWS, workers=2, retries=2, backoff=0.01)
+    assert result.complete and result.failed_pages == []
+    assert len(result.devices) == DEVICES
+    assert len({d["id"] for d in result.devices}) == DEVICES
+    assert state.faults == 3
+
+
+def test_page_failing_every_retry_marks_listing_incomplete(stub):
+    state, client = stub
+    state.fail_pages = {1: 99}
+    result = upstream.fetch_snapshot(client, rows=ROWS, workers=2, retries=1, backoff=0.01)
+    assert not result.complete
+    assert result.failed_pages == [1]
+    assert len(result.devices) == DEVICES - ROWS
+
+
+def test_breaker_opens_after_failures_and_half_opens_after_reset(stub):
+    state, client = stub
+    state.down = True
+    breaker = upstream.CircuitBreaker(failures=2, reset_seconds=0.2)
+    for _ in range(2):
+        assert breaker.allow()
+        with pytest.raises(upstream.FetchError):
+            upstream.fetch_snapshot(client, rows=ROWS, retries=0)
+        breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.25)
+    assert breaker.state == "half-open" and breaker.allow()
+    # 試行が失敗すると倍の時間開き直す
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert 0.2 < breaker.remaining() <= 0.4
+
+    state.down = False
+    time.sleep(0.45)
+    assert breaker.allow()
+    assert upstream.fetch_snapshot(client, rows=ROWS, retries=0).complete
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_run_cycle_skips_when_every_breaker_is_open(stub, cycle, store):
+    state, _ = stub
+    run, published = cycle
+    breaker = upstream.CircuitBreaker(failures=1, reset_seconds=60)
+    breaker.record_failure()
+
+    summary = run({"default": breaker})
+    assert summary["skipped_seconds"] > 0
+    assert state.data_requests == 0
+    assert published == []
+    assert store.segment_days() == []
+
+
+def test_merge_previous_keeps_missing_devices_as_stale():
+    previous = [{"id": "A", "temperature": "20.0"}, {"id": "B", "temperature": "21.0"}]
+    devices, merged = cache_worker.merge_previous([{"id": "A", "temperature": "22.0"}], previous)
+    assert merged == 1
+    assert devices == [{"id": "A", "temperature": "22.0"}, {"id": "B", "temperature": "21.0", "stale": True}]
+
+
+def test_partial_listing_is_never_published_as_complete(stub, cycle):
+    state, _ = stub
+    run, published = cycle
+
+    summary = run()
+    assert "failed_pages" not in summary
+    assert len(published[-1]) == DEVICES and not any(d.get("stale") for d in published[-1])
+    failing = {d["id"] for d in published[-1][ROWS:2 * ROWS]}
+
+    state.fail_pages = {1: 99}
+    summary = run()
+    assert summary["failed_pages"] == ["default:1"] and summary["stale_kept"] == ROWS
+    assert len(published) == 2
+    assert {d["id"] for d in published[-1] if d.get("stale")} == failing
+    assert len(published[-1]) == DEVICES
+
+    # 回復したサイクルは値が変わっていなくても △ を外すため必ず公開し直す
+    state.fail_pages = {}
+    run()
+    assert len(published) == 3
+    assert not any(d.get("stale") for d in published[-1])
+
+
+def test_account_with_bad_rate_limit_is_skipped_not_fatal(caplog):
+    settings = {"upstream_rate_limit": "fast", "accounts": [
+        {"name": "a", "account": "a", "password": "x", "rate_limit": "5/s"},
+        {"name": "b", "account": "b", "password": "y", "rate_limit": "2"},
+        {"name": "c", "account": "c", "password": "z"},
+    ]}
+    assert upstream.account_configs(settings) == [("b", "b", "y", 2.0), ("c", "c", "z", upstream.DEFAULT_RATE_LIMIT)]
+    assert "upstream_rate_limit" in caplog.text and "Ignoring account entry a" in caplog.text
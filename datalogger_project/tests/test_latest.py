@@ -0,0 +1,32 @@
+import os
+import time
+
+import pytest
+
+import latest
+
+
+@pytest.fixture
+def publish_dir(tmp_path, monkeypatch):
+    publish_dir = tmp_path / "latest"
+    monkeypatch.setattr(latest, "LATEST_FILE", str(tmp_path / "device_cache_latest.json"))
+    monkeypatch.setattr(latest, "PUBLISH_DIR", str(publish_dir))
+    monkeypatch.setattr(latest, "MANIFEST_FILE", str(publish_dir / "manifest.json"))
+    return publish_dir
+
+
+def test_republishing_an_earlier_snapshot_moves_mtime_forward(publish_dir):
+    first = latest.publish([{"id": "A", "stale": True}])
+    latest.publish([{"id": "A"}])
+    # 前の版のファイルを古い時刻にしておき、同じ内容に戻ったときに使い回させる
+    old = time.time() - 3600
+    for fname in os.listdir(publish_dir):
+        if fname.startswith(first["etag"]):
+            os.utime(publish_dir / fname, (old, old))
+
+    before = time.time()
+    again = latest.publish([{"id": "A", "stale": True}])
+    assert again["etag"] == first["etag"]
+    assert os.path.getmtime(latest.LATEST_FILE) >= before - 1
+    with open(latest.LATEST_FILE, encoding="utf-8") as f:
+        assert '"stale":true' in f.read()
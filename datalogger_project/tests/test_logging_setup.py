@@ -0,0 +1,56 @@
+import json
+import logging
+
+import pytest
+
+import logging_setup
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    """Configure into a temporary file and restore the root logger afterwards."""
+    root = logging.getLogger()
+    level, handlers = root.level, list(root.handlers)
+    yield tmp_path / "datalogger.log"
+    logging_setup.shutdown()
+    for handler in root.handlers:
+        if handler not in handlers:
+            root.removeHandler(handler)
+    root.setLevel(level)
+    logging.getLogger("noisy").setLevel(logging.NOTSET)
+    logging_setup._queue_handler = None
+    logging_setup._rate_filter = None
+
+
+def _lines(log_file):
+    logging_setup.shutdown()    # キューを書き出させる
+    return [json.loads(line) for line in log_file.read_text(encoding="utf-8").splitlines()]
+
+
+def test_bad_levels_and_numbers_fall_back_to_defaults(log_file):
+    logging_setup.configure({"log_file": str(log_file), "log_console": False, "log_level": "DEBUG"})
+    logging_setup.configure({"log_file": str(log_file), "log_console": False, "log_level": "verbose",
+                             "log_levels": {"noisy": "loud"}, "log_max_bytes": "5MB"})
+    assert logging_setup._listener._thread is not None
+    assert logging.getLogger().level == logging.INFO
+    assert logging.getLogger("noisy").level == logging.INFO
+
+    logging.getLogger("test").info("still logging")
+    lines = _lines(log_file)
+    warning = next(line for line in lines if line["logger"] == "logging_setup")
+    assert "log_level='verbose'" in warning["msg"] and "log_levels.noisy='loud'" in warning["msg"]
+    assert "log_max_bytes='5MB'" in warning["msg"]
+    assert lines[-1]["msg"] == "still logging"
+
+
+def test_exception_traceback_stays_out_of_msg(log_file):
+    logging_setup.configure({"log_file": str(log_file), "log_console": False})
+    try:
+        raise RuntimeError("boom")
+    except RuntimeError:
+        logging.getLogger("test").exception("Cycle failed: %s", "boom", extra={"account": "default"})
+
+    line = _lines(log_file)[-1]
+    assert line["msg"] == "Cycle failed: boom"
+    assert line["account"] == "default"
+    assert line["exc"].startswith("Traceback") and "RuntimeError: boom" in line["exc"]
@@ -0,0 +1,64 @@
+from datetime import timedelta
+
+import config_store
+import rollup
+from tests.conftest import reading
+
+ASSIGNMENTS = {"A": "loc1", "B": "loc1", "C": "loc2"}
+
+
+def _snapshots(start, count):
+    for i in range(count):
+        ts = start + timedelta(minutes=i)
+        yield ts, [reading(sn, ts, temperature=20 + i, location_id=loc) for sn, loc in ASSIGNMENTS.items()]
+
+
+def test_seed_backfills_devices_and_locations_from_store(store, recent, tmp_path, monkeypatch):
+    for ts, devices in _snapshots(recent, 10):
+        store.append(ts, devices)
+    monkeypatch.setattr(config_store, "get_assignments", lambda: dict(ASSIGNMENTS))
+    monkeypatch.setattr(config_store, "get_alert_rules", lambda: {})
+
+    aggregates = rollup.Rollup(str(tmp_path / "rollup.json"))
+    assert aggregates.seed(store) >= 30
+
+    assert {sn: d.series["temperature"].n for sn, d in aggregates.devices.items()} == {"A": 10, "B": 10, "C": 10}
+    assert {loc: l.series["temperature"].n for loc, l in aggregates.locations.items()} == {"loc1": 20, "loc2": 10}
+    series = aggregates.devices["A"].series["temperature"]
+    assert (series.min, series.max, series.mean) == (20.0, 29.0, 24.5)
+
+
+def test_update_counts_each_reading_once_and_times_out_of_band(recent, tmp_path):
+    aggregates = rollup.Rollup(str(tmp_path / "rollup.json"))
+    rules = {"default": {"temperature_max": 25}}
+    temperatures = [20, 26, 27, 24, 20]
+    for i, t in enumerate(temperatures):
+        devices = [reading("A", recent + timedelta(minutes=i), temperature=t, location_id="loc1")]
+        assert aggregates.update(devices, rules) == 1
+        assert aggregates.update(devices, rules) == 0   # 同じ last_seen の再取得は数えない
+
+    summary = aggregates.devices["A"].series["temperature"].summary(now=(recent + timedelta(minutes=4)).timestamp())
+    assert summary["count"] == 5
+    assert summary["min"] == 20.0 and summary["max"] == 27.0
+    days = summary["days"]
+    # 26 (1 分後) から 24 (3 分後) に戻るまでの 2 分間が範囲外
+    assert sum(day["out_of_band_seconds"] for day in days) == 120
+    location = aggregates.locations["loc1"].series["temperature"].summary()
+    assert sum(day["out_of_band_seconds"] for day in location["days"]) == 120
+
+
+def test_state_survives_save_and_reload(recent, tmp_path):
+    path = str(tmp_path / "run" / "rollup.json")
+    aggregates = rollup.Rollup(path)
+    for ts, devices in _snapshots(recent, 5):
+        aggregates.update(devices, {})
+    aggregates.save()
+
+    reloaded = rollup.Rollup(path)
+    before, after = aggregates.devices["C"].series["temperature"], reloaded.devices["C"].series["temperature"]
+    assert after.to_list() == before.to_list()
+    assert reloaded.update(devices, {}) == 0
+    state = rollup.load_state(path)
+    rows = rollup.location_summaries(state, {"loc1": "倉庫1"}, {})
+    assert [row["name"] for row in rows] == ["倉庫1"]
+    assert rows[0]["temperature"]["count"] == 10
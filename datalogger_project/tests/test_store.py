@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+
+from store import TimeSeriesStore
+from tests.conftest import reading
+
+START = datetime(2025, 1, 6, 12, 0)
+
+
+def _fleet(step):
+    """A changes every step, B never, C drops out after step 2, D joins at step 4."""
+    ts = START + timedelta(minutes=step)
+    devices = [reading("A", ts, temperature=20 + step), reading("B", START, temperature=30)]
+    if step <= 2:
+        devices.append(reading("C", START, temperature=10))
+    if step >= 4:
+        devices.append(reading("D", ts, temperature=5, online=False))
+    return ts, devices
+
+
+def _state(devices):
+    return {d["id"]: (float(d["temperature"]), d["online"], d["last_seen"]) for d in devices}
+
+
+def test_append_writes_keyframes_and_deltas(store):
+    written = [store.append(*_fleet(step)) for step in range(7)]
+    # 0: キーフレーム (A, B, C), 1-2: A だけ, 3: A + C の削除, 4: A + D 追加,
+    # 5: キーフレーム (keyframe_every=5), 6: A + D
+    assert written == [3, 1, 1, 2, 2, 3, 2]
+
+
+def test_load_replays_deltas_from_the_last_keyframe(store):
+    fleets = [_fleet(step) for step in range(7)]
+    for ts, devices in fleets:
+        store.append(ts, devices)
+
+    for ts, devices in fleets:
+        assert _state(store.load(ts)) == _state(devices)
+    # スナップショットの間の時刻はその直前の状態
+    assert _state(store.load(fleets[3][0] + timedelta(seconds=30))) == _state(fleets[3][1])
+
+
+def test_load_after_reopening_the_store(store, tmp_path):
+    fleets = [_fleet(step) for step in range(7)]
+    for ts, devices in fleets:
+        store.append(ts, devices)
+    store.close()
+
+    reopened = TimeSeriesStore(str(tmp_path / "store"))
+    try:
+        assert reopened.snapshot_times() == [ts for ts, _ in fleets]
+        assert _state(reopened.load(fleets[4][0])) == _state(fleets[4][1])
+        # 再オープン後の最初の追記はキーフレームになる
+        assert reopened.append(*_fleet(7)) == 3
+        assert _state(reopened.load(_fleet(7)[0])) == _state(_fleet(7)[1])
+    finally:
+        reopened.close()
+
+
+def test_first_append_of_a_day_is_a_keyframe(store):
+    store.append(*_fleet(0))
+    next_day = START + timedelta(days=1)
+    devices = [reading("A", START, temperature=20), reading("B", START, temperature=30),
+               reading("C", START, temperature=10)]
+    assert store.append(next_day, devices) == 3
+    assert _state(store.load(next_day)) == _state(devices)
+
+
+def test_drop_before_removes_whole_days_only(store):
+    days = [START - timedelta(days=2), START - timedelta(days=1), START]
+    for ts in days:
+        store.append(ts, [reading("A", ts)])
+
+    assert store.drop_before(START.replace(hour=0)) == [(START - timedelta(days=2)).strftime("%Y%m%d"),
+                                                        (START - timedelta(days=1)).strftime("%Y%m%d")]
+    assert store.segment_days() == [START.strftime("%Y%m%d")]
+    assert store.snapshot_times() == [START]
+    assert store.load(days[0]) == []
+    assert _state(store.load(START)) == _state([reading("A", START)])
+    # 当日の途中までの cutoff では当日分は消さない
+    assert store.drop_before(START + timedelta(hours=1)) == []
+
+
+def _hour_totals(store, serials, start):
+    """One 1-hour bucket per device from ``start``: the rollup path when aligned, raw readings otherwise."""
+    result = store.aggregate(serials, start, start + timedelta(hours=1), 3600)
+    return {sn: {key: columns[key][0] for key in columns if key != "t"} for sn, columns in result.items()}
+
+
+def test_raw_fallback_counts_only_fresh_readings_like_the_rollups(store, tmp_path):
+    hour = START.replace(minute=0)
+    for step in range(1, 8):
+        store.append(*_fleet(step))
+    store.close()
+    # 再起動後の最初の追記はキーフレームだが、変化のない B は数えない
+    reopened = TimeSeriesStore(str(tmp_path / "store"), keyframe_every=5)
+    try:
+        for step in range(8, 12):
+            reopened.append(*_fleet(step))
+        serials = ["A", "B", "C", "D"]
+        rollup = _hour_totals(reopened, serials, hour)
+        raw = _hour_totals(reopened, serials, hour + timedelta(seconds=1))
+        assert raw == rollup
+        assert rollup["A"]["count"] == 11
+        assert rollup["B"]["count"] == 1
+        assert rollup["C"]["count"] == 1
+        assert rollup["D"]["count"] == 8
+    finally:
+        reopened.close()
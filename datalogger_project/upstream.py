@@ -0,0 +1,541 @@
+import math
+import logging
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LOGIN_URL = "http://1weilian.com/user/login"
+DATA_URL = "http://1weilian.com/public/realTimeData"
+ACCOUNT = "nglswhs47"
+PASSWORD = "ngls1234"
+
+HEADERS = {"Content-Type": "application/json;charset=UTF-8"}
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 15
+DEFAULT_TOKEN_TTL = 3600
+DEFAULT_FETCH_ROWS = 20
+DEFAULT_FETCH_WORKERS = 4
+DEFAULT_FETCH_RETRIES = 2
+DEFAULT_RETRY_BACKOFF = 0.5
+DEFAULT_BREAKER_FAILURES = 3
+DEFAULT_BREAKER_RESET_SECONDS = 60
+BREAKER_MAX_SECONDS = 900
+DEFAULT_ACCOUNT_NAME = "default"
+DEFAULT_RATE_LIMIT = 0      # 1 アカウントあたりの毎秒リクエスト数。0 は無制限
+
+# Keys the realTimeData response has been seen to carry the device count under
+TOTAL_KEYS = ("total", "totalCount", "totalRows", "count")
+
+LOGIN_SECONDS = metrics.histogram("datalogger_upstream_login_seconds", "Upstream login latency")
+PAGE_SECONDS = metrics.histogram("datalogger_upstream_page_seconds", "Upstream device page latency by outcome")
+PAGE_RETRIES = metrics.counter("datalogger_upstream_page_retries_total", "Device page requests retried")
+PAGES_PER_CYCLE = metrics.histogram("datalogger_fetch_pages", "Device pages fetched per cycle",
+                                    buckets=(1, 2, 5, 10, 20, 50, 100, 200))
+ACCOUNT_SECONDS = metrics.histogram("datalogger_fetch_account_seconds", "Time to list one account's devices")
+DEVICES_PER_CYCLE = metrics.gauge("datalogger_fetch_devices", "Devices returned by the last fetch, by account")
+FAILED_PAGES = metrics.counter("datalogger_fetch_failed_pages_total", "Device pages that failed after all retries")
+CIRCUIT_OPEN = metrics.gauge("datalogger_upstream_circuit_open", "1 while an account's circuit breaker is open")
+REQUESTS = metrics.counter("datalogger_upstream_requests_total", "Requests sent to upstream by account")
+RATE_WAIT = metrics.histogram("datalogger_upstream_rate_wait_seconds", "Time requests waited for the account rate limit")
+
+
+class RateLimiter:
+    """Token bucket allowing ``rate`` requests per second with bursts of up to ``burst``.
+
+    A ``rate`` of 0 disables the limit. ``acquire`` blocks until a token is
+    available, so the worker threads of one account share its budget.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE_LIMIT, burst=None):
+        self.rate = float(rate or 0)
+        self.burst = max(float(burst if burst is not None else self.rate), 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.burst)
+            self._updated = now
+            self._tokens -= 1
+            # 予約済みにしてからロックの外で待つ。後続は更に先の枠を取る
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        RATE_WAIT.observe(wait)
+        return wait
+
+
+class UpstreamClient:
+    """1weilian API client holding one keep-alive session and a cached token.
+
+    The accessToken/userId pair is reused until ``token_ttl`` seconds have
+    passed or the API rejects it, in which case we log in again once and
+    retry the request. Every request first waits for the client's
+    RateLimiter (``rate_limit`` requests per second, 0 for none).
+    """
+
+    def __init__(self, account=ACCOUNT, password=PASSWORD, pool_size=DEFAULT_POOL_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 token_ttl=DEFAULT_TOKEN_TTL, login_url=LOGIN_URL, data_url=DATA_URL,
+                 name=DEFAULT_ACCOUNT_NAME, rate_limit=DEFAULT_RATE_LIMIT):
+        self.name = name
+        self.account = account
+        self.password = password
+        self.limiter = RateLimiter(rate_limit)
+        self.timeout = (connect_timeout, read_timeout)
+        self.token_ttl = token_ttl
+        self.login_url = login_url
+        self.data_url = data_url
+
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._token = None
+        self._user_id = None
+        self._expires_at = 0.0
+
+    def _before_request(self):
+        self.limiter.acquire()
+        REQUESTS.inc(account=self.name)
+        _count_request()
+
+    def login(self):
+        payload = {
+            "account": self.account,
+            "pwd": self.password,
+            "systemVersion": "PC",
+            "loginType": 2
+        }
+        self._before_request()
+        with LOGIN_SECONDS.time():
+            response = self.session.post(self.login_url, json=payload, timeout=self.timeout)
+            result = response.json()
+        self._token = result["data"]["accessToken"]
+        self._user_id = result["data"]["userId"]
+        self._expires_at = time.monotonic() + self.token_ttl
+        logger.info("Logged in to upstream as %s", self.account, extra={"account": self.name})
+        return self._token, self._user_id
+
+    def get_token(self):
+        with self._lock:
+            if self._token is None or time.monotonic() >= self._expires_at:
+                return self.login()
+            return self._token, self._user_id
+
+    def invalidate(self, token=None):
+        with self._lock:
+            # 他スレッドが既に再ログイン済みなら新しいトークンは捨てない
+            if token is None or token == self._token:
+                self._token = None
+
+    def post_data(self, payload):
+        """POST ``payload`` to DATA_URL with credentials filled in; returns the parsed JSON."""
+        for attempt in range(2):
+            token, user_id = self.get_token()
+            body = dict(payload, userId=user_id, accessToken=token, loginType=2)
+            self._before_request()
+            response = self.session.post(self.data_url, json=body, timeout=self.timeout)
+            if response.status_code >= 500:
+                response.raise_for_status()
+            rejected = response.status_code in (401, 403)
+            result = None
+            if not rejected:
+                result = response.json()
+                rejected = not _has_data_list(result)
+            if not rejected or attempt:
+                return result if result is not None else response.json()
+            logger.warning("Upstream rejected the access token, logging in again", extra={"account": self.name})
+            self.invalidate(token)
+
+    def fetch_page(self, page, rows=DEFAULT_FETCH_ROWS):
+        return self.fetch_page_with_total(page, rows)[0]
+
+    def fetch_page_with_total(self, page, rows=DEFAULT_FETCH_ROWS):
+        result = self.post_data({
+            "permissions": 2,
+            "language": 1,
+            "page": page,
+            "rows": rows,
+            "sortingType": 0
+        })
+        if not _has_data_list(result):
+            raise ValueError(f"No dataList found in response: {result}")
+        total = None
+        for key in TOTAL_KEYS:
+            value = result["data"].get(key)
+            if isinstance(value, int) or (isinstance(value, str) and value.isdigit()):
+                total = int(value)
+                break
+        return result["data"]["dataList"] or [], total
+
+    def close(self):
+        self.session.close()
+
+
+_request_total = 0
+_request_lock = threading.Lock()
+
+
+def _count_request():
+    global _request_total
+    with _request_lock:
+        _request_total += 1
+
+
+def request_count():
+    """Requests sent to upstream by this process so far (logins included), over every account."""
+    return _request_total
+
+
+def _has_data_list(result):
+    return isinstance(result, dict) and isinstance(result.get("data"), dict) \
+        and "dataList" in result["data"]
+
+
+def to_device(dev, offline_value=""):
+    online = dev["status"] == 0
+    return {
+        "id": dev["sn"],
+        "name": dev["deviceName"],
+        "temperature": dev["temperature"] if online else offline_value,
+        "humidity": dev["humidity"] if online else offline_value,
+        "last_seen": dev["date"],
+        "online": online
+    }
+
+
+FetchResult = namedtuple("FetchResult", "devices complete failed_pages")
+
+
+class FetchError(Exception):
+    """Raised when a device page that the listing cannot do without keeps failing."""
+
+
+def fetch_snapshot(client, offline_value="", rows=DEFAULT_FETCH_ROWS, workers=DEFAULT_FETCH_WORKERS,
+                   retries=DEFAULT_FETCH_RETRIES, backoff=DEFAULT_RETRY_BACKOFF):
+    """Fetch every device page; returns a FetchResult.
+
+    Page 0 is fetched first. If it reports the device count, the remaining
+    pages are requested concurrently on up to ``workers`` threads; otherwise
+    we probe ahead ``workers`` pages at a time until a short page shows up.
+    Each page is retried ``retries`` times with jittered exponential
+    backoff. A page that still fails does not end the listing silently:
+    the result is marked incomplete and lists the failed pages, so the
+    caller can fill the gap. Raises FetchError when page 0 fails.
+    """
+    first = _fetch_page_retry(client, 0, rows, retries, backoff, with_total=True)
+    if first is None:
+        raise FetchError("first device page could not be fetched")
+    first, total = first
+
+    pages = {0: first}
+    failed = []
+    if len(first) >= rows:
+        if total is not None:
+            numbers = range(1, math.ceil(total / rows))
+            for page, data_list in zip(numbers, _fetch_pages(client, numbers, rows, workers, retries, backoff)):
+                if data_list is None:
+                    failed.append(page)
+                else:
+                    pages[page] = data_list
+        else:
+            page = 1
+            step = max(workers, 1)
+            done = False
+            while not done:
+                numbers = range(page, page + step)
+                for number, data_list in zip(numbers, _fetch_pages(client, numbers, rows, workers, retries, backoff)):
+                    if data_list is None:
+                        # 件数が分からないので失敗ページ以降は取得できたかどうか判断できない
+                        failed.append(number)
+                        done = True
+                        break
+                    pages[number] = data_list
+                    if len(data_list) < rows:
+                        done = True
+                        break
+                page += step
+
+    all_devices = []
+    for page in sorted(pages):
+        all_devices.extend(to_device(dev, offline_value) for dev in pages[page])
+    account = getattr(client, "name", DEFAULT_ACCOUNT_NAME)
+    PAGES_PER_CYCLE.observe(len(pages) + len(failed))
+    DEVICES_PER_CYCLE.set(len(all_devices), account=account)
+    if failed:
+        FAILED_PAGES.inc(len(failed))
+        logger.debug("Device pages %s failed after %d retries; listing is incomplete", failed, retries,
+                     extra={"account": account})
+    return FetchResult(all_devices, not failed, failed)
+
+
+def iter_device_pages(client, offline_value="", rows=DEFAULT_FETCH_ROWS, retries=DEFAULT_FETCH_RETRIES,
+                      backoff=DEFAULT_RETRY_BACKOFF):
+    """Yield the device list one page at a time, in order, so callers can show results as they arrive.
+
+    Stops after the first short page; raises FetchError when a page keeps
+    failing.
+    """
+    page = 0
+    while True:
+        data_list = _fetch_page_retry(client, page, rows, retries, backoff)
+        if data_list is None:
+            raise FetchError(f"device page {page} could not be fetched")
+        yield [to_device(dev, offline_value) for dev in data_list]
+        if len(data_list) < rows:
+            return
+        page += 1
+
+
+def fetch_all_devices(client, offline_value="", rows=DEFAULT_FETCH_ROWS, workers=DEFAULT_FETCH_WORKERS,
+                      retries=DEFAULT_FETCH_RETRIES, backoff=DEFAULT_RETRY_BACKOFF):
+    """Every device that could be fetched, in page order (see fetch_snapshot)."""
+    try:
+        return fetch_snapshot(client, offline_value, rows, workers, retries, backoff).devices
+    except FetchError as e:
+        logger.error("Failed to fetch device data: %s", e)
+        return []
+
+
+def fetch_accounts(clients, offline_value="", **options):
+    """Fetch every account's snapshot at the same time; returns ``{name: FetchResult or Exception}``.
+
+    ``clients`` maps account names to UpstreamClient (see get_clients) and
+    ``options`` are passed to fetch_snapshot. Each account pages with its
+    own workers, token and rate limit, so the total time is that of the
+    slowest account rather than the sum.
+    """
+    def fetch(client):
+        start = time.perf_counter()
+        try:
+            client.get_token()
+            return fetch_snapshot(client, offline_value, **options)
+        except Exception as e:
+            return e
+        finally:
+            ACCOUNT_SECONDS.observe(time.perf_counter() - start, account=client.name)
+
+    if not clients:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+        futures = {name: pool.submit(fetch, client) for name, client in clients.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def merge_results(results):
+    """Merge per-account results (see fetch_accounts) into one FetchResult.
+
+    Each device gets an ``account`` key naming its source. A serial listed
+    by several accounts is kept once, from the first account in
+    configuration order. The merged result is incomplete when any account
+    failed or missed pages; failed pages read ``"<account>:<page>"`` and a
+    failed account is listed as ``"<account>:*"``.
+    """
+    devices, failed, seen = [], [], set()
+    for name, result in results.items():
+        if isinstance(result, Exception):
+            failed.append(f"{name}:*")
+            continue
+        for device in result.devices:
+            sn = str(device["id"])
+            if sn in seen:
+                continue
+            seen.add(sn)
+            device["account"] = name
+            devices.append(device)
+        failed.extend(f"{name}:{page}" for page in result.failed_pages)
+    return FetchResult(devices, not failed, failed)
+
+
+def _fetch_pages(client, page_numbers, rows, workers, retries=0, backoff=0):
+    """Fetch ``page_numbers`` concurrently; returns one list (or None on failure) per page, in order."""
+    page_numbers = list(page_numbers)
+    if not page_numbers:
+        return []
+    if workers <= 1:
+        return [_fetch_page_retry(client, page, rows, retries, backoff) for page in page_numbers]
+    with ThreadPoolExecutor(max_workers=min(workers, len(page_numbers))) as pool:
+        return list(pool.map(lambda page: _fetch_page_retry(client, page, rows, retries, backoff), page_numbers))
+
+
+def _fetch_page_retry(client, page, rows, retries, backoff, with_total=False):
+    for attempt in range(retries + 1):
+        start = time.perf_counter()
+        try:
+            result = client.fetch_page_with_total(page, rows)
+            PAGE_SECONDS.observe(time.perf_counter() - start, outcome="ok")
+            return result if with_total else result[0]
+        except (requests.RequestException, KeyError, ValueError) as e:
+            PAGE_SECONDS.observe(time.perf_counter() - start, outcome="error")
+            if attempt >= retries:
+                logger.debug("Fetching device page %s failed: %s", page, e)
+                return None
+            # 同時に失敗したページが一斉に再送しないよう揺らぎを入れる
+            delay = backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            logger.debug("Device page %s failed (%s), retry %d/%d in %.2fs", page, e, attempt + 1, retries, delay)
+            PAGE_RETRIES.inc()
+            time.sleep(delay)
+
+
+class CircuitBreaker:
+    """Skip whole fetch cycles while upstream keeps failing.
+
+    After ``failures`` consecutive failed cycles the breaker opens for
+    ``reset_seconds``; the first cycle after that is a trial. A failed
+    trial reopens it for twice as long (up to BREAKER_MAX_SECONDS), a
+    successful one closes it. ``name`` is the account it guards.
+    """
+
+    def __init__(self, failures=DEFAULT_BREAKER_FAILURES, reset_seconds=DEFAULT_BREAKER_RESET_SECONDS,
+                 name=DEFAULT_ACCOUNT_NAME):
+        self.name = name
+        self.failures = max(int(failures), 1)
+        self.reset_seconds = reset_seconds
+        self.consecutive = 0
+        self.opened = 0
+        self.open_until = 0.0
+
+    @property
+    def state(self):
+        if self.consecutive < self.failures:
+            return "closed"
+        return "open" if time.monotonic() < self.open_until else "half-open"
+
+    def allow(self):
+        return self.state != "open"
+
+    def record_success(self):
+        if self.consecutive >= self.failures:
+            logger.info("Upstream recovered, circuit closed", extra={"account": self.name})
+        self.consecutive = 0
+        self.opened = 0
+        CIRCUIT_OPEN.set(0, account=self.name)
+
+    def record_failure(self):
+        self.consecutive += 1
+        if self.consecutive >= self.failures:
+            wait = min(self.reset_seconds * (2 ** self.opened), BREAKER_MAX_SECONDS)
+            self.opened += 1
+            self.open_until = time.monotonic() + wait
+            CIRCUIT_OPEN.set(1, account=self.name)
+            logger.warning("Upstream failed %d cycles in a row, circuit open for %ss", self.consecutive, wait,
+                           extra={"account": self.name})
+
+    def remaining(self):
+        return max(self.open_until - time.monotonic(), 0) if self.state == "open" else 0
+
+
+def fetch_options(settings):
+    return {
+        "rows": int(settings.get("fetch_rows", DEFAULT_FETCH_ROWS)),
+        "workers": int(settings.get("fetch_workers", DEFAULT_FETCH_WORKERS)),
+        "retries": int(settings.get("fetch_retries", DEFAULT_FETCH_RETRIES)),
+        "backoff": float(settings.get("fetch_retry_backoff", DEFAULT_RETRY_BACKOFF)),
+    }
+
+
+def breaker_config(settings):
+    return (int(settings.get("breaker_failures", DEFAULT_BREAKER_FAILURES)),
+            float(settings.get("breaker_reset_seconds", DEFAULT_BREAKER_RESET_SECONDS)))
+
+
+_clients = {}       # name -> (config, UpstreamClient)
+_client_lock = threading.Lock()
+
+
+def client_config(settings):
+    return (
+        int(settings.get("upstream_pool_size", DEFAULT_POOL_SIZE)),
+        float(settings.get("upstream_connect_timeout", DEFAULT_CONNECT_TIMEOUT)),
+        float(settings.get("upstream_read_timeout", DEFAULT_READ_TIMEOUT)),
+        int(settings.get("token_ttl", DEFAULT_TOKEN_TTL)),
+    )
+
+
+def _rate(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def account_configs(settings):
+    """``[(name, account, password, rate_limit)]`` from the ``accounts`` setting, in order.
+
+    Each entry is ``{"name", "account", "password", "rate_limit"}``; ``name``
+    defaults to the account and ``rate_limit`` to ``upstream_rate_limit``.
+    Without any usable entry the built-in ACCOUNT is polled as "default".
+    """
+    default_rate = _rate(settings.get("upstream_rate_limit", DEFAULT_RATE_LIMIT))
+    if default_rate is None:
+        logger.warning("Ignoring non-numeric upstream_rate_limit: %r", settings.get("upstream_rate_limit"))
+        default_rate = DEFAULT_RATE_LIMIT
+    configs, names = [], set()
+    for entry in settings.get("accounts") or []:
+        if not isinstance(entry, dict) or not entry.get("account") or not entry.get("password"):
+            logger.warning("Ignoring account entry without account/password: %r",
+                           entry.get("name") if isinstance(entry, dict) else entry)
+            continue
+        name = str(entry.get("name") or entry["account"])
+        rate_limit = _rate(entry.get("rate_limit", default_rate))
+        if rate_limit is None:
+            logger.warning("Ignoring account entry %s with non-numeric rate_limit: %r", name, entry["rate_limit"])
+            continue
+        if name in names:
+            logger.warning("Ignoring duplicate account name %s", name)
+            continue
+        names.add(name)
+        configs.append((name, str(entry["account"]), str(entry["password"]), rate_limit))
+    if not configs:
+        configs.append((DEFAULT_ACCOUNT_NAME, ACCOUNT, PASSWORD, default_rate))
+    return configs
+
+
+def get_clients(settings=None):
+    """Return ``{name: UpstreamClient}`` for every configured account, in configuration order.
+
+    Clients (and their cached tokens) are kept across calls; one is only
+    rebuilt when its own account or the connection settings change, and
+    clients of removed accounts are closed.
+    """
+    settings = settings or {}
+    pool_size, connect_timeout, read_timeout, token_ttl = client_config(settings)
+    clients = {}
+    with _client_lock:
+        for name, account, password, rate_limit in account_configs(settings):
+            config = (account, password, rate_limit) + client_config(settings)
+            current = _clients.get(name)
+            if current is None or current[0] != config:
+                if current is not None:
+                    current[1].close()
+                current = _clients[name] = (config, UpstreamClient(
+                    account=account, password=password, pool_size=pool_size, connect_timeout=connect_timeout,
+                    read_timeout=read_timeout, token_ttl=token_ttl, name=name, rate_limit=rate_limit))
+            clients[name] = current[1]
+        for name in [name for name in _clients if name not in clients]:
+            _clients.pop(name)[1].close()
+    return clients
+
+
+def get_client(settings=None):
+    """Return the client of the first configured account (see get_clients)."""
+    return next(iter(get_clients(settings).values()))
@@ -0,0 +1,93 @@
+import hashlib
+import threading
+from collections import namedtuple
+
+UNASSIGNED = "未割当"
+
+WarehouseView = namedtuple("WarehouseView", "version etag updated rows warehouses")
+WarehouseView.__doc__ = """One snapshot joined with assignments and locations.
+
+``rows`` is every device (with ``location_id``/``warehouse`` filled in);
+``warehouses`` is a tuple of ``(name, devices, stats)`` in display order,
+covering only devices assigned to a named warehouse. Treat it as read-only:
+the same object is handed to every request until the snapshot changes.
+"""
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def summarize(devices):
+    """Min/max/avg temperature and humidity over devices reporting a number, plus online counts."""
+    stats = {"devices": len(devices), "online": sum(1 for d in devices if d.get("online"))}
+    for key in ("temperature", "humidity"):
+        values = [v for v in (_number(d.get(key)) for d in devices if d.get("online")) if v is not None]
+        stats[f"{key}_min"] = min(values) if values else None
+        stats[f"{key}_max"] = max(values) if values else None
+        stats[f"{key}_avg"] = round(sum(values) / len(values), 2) if values else None
+    return stats
+
+
+def build_view(version, updated, devices, assignments, locations):
+    rows = []
+    grouped = {}
+    for device in devices:
+        loc_id = assignments.get(str(device.get("id"))) or ""
+        warehouse = locations.get(loc_id, UNASSIGNED) if loc_id else UNASSIGNED
+        row = dict(device, location_id=loc_id, warehouse=warehouse)
+        rows.append(row)
+        # 倉庫名が未登録・未割当の機器はモニター画面に出さない
+        if loc_id and warehouse != UNASSIGNED:
+            grouped.setdefault(warehouse, []).append(row)
+    warehouses = tuple((name, tuple(devs), summarize(devs)) for name, devs in grouped.items())
+    etag = hashlib.md5(repr(version).encode()).hexdigest()
+    return WarehouseView(version, etag, updated, tuple(rows), warehouses)
+
+
+class ViewCache:
+    """Build the warehouse view once per snapshot version and memoize what is rendered from it.
+
+    ``stamp_fn()`` must be cheap (stat calls); ``load_fn()`` returns
+    ``(updated, devices, assignments, locations)`` and only runs when the
+    stamp changed. ``render(key, fn)`` caches ``fn(view)`` until the next
+    version, so repeated page loads are a dictionary lookup.
+    """
+
+    def __init__(self, stamp_fn, load_fn):
+        self.stamp_fn = stamp_fn
+        self.load_fn = load_fn
+        self._lock = threading.Lock()
+        self._view = None
+        self._rendered = {}
+
+    def get(self):
+        stamp = self.stamp_fn()
+        view = self._view
+        if view is not None and view.version == stamp:
+            return view
+        with self._lock:
+            if self._view is None or self._view.version != stamp:
+                updated, devices, assignments, locations = self.load_fn()
+                self._view = build_view(stamp, updated, devices, assignments, locations)
+                self._rendered = {}
+            return self._view
+
+    def render(self, key, fn):
+        """``(view, fn(view))``, computing ``fn`` at most once per view version and ``key``."""
+        view = self.get()
+        rendered = self._rendered
+        if self._view is view and key in rendered:
+            return view, rendered[key]
+        value = fn(view)
+        with self._lock:
+            if self._view is view:
+                self._rendered[key] = value
+        return view, value